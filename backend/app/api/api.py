@@ -1,8 +1,14 @@
 from fastapi import APIRouter
 from app.routers import video
 from app.routers import manuals
+from app.routers import metrics
+from app.routers import uploads
+from app.routers import jobs
 
 api_router = APIRouter()
 
 api_router.include_router(video.router, tags=["video"])
 api_router.include_router(manuals.router, tags=["manuals"])
+api_router.include_router(uploads.router, tags=["uploads"])
+api_router.include_router(jobs.router, tags=["jobs"])
+api_router.include_router(metrics.router, tags=["metrics"])
@@ -0,0 +1,37 @@
+# ルーターに注入する依存関係
+# サービスは軽量なのでリクエストごとに作るが、内部のクライアントは lifespan で作成した共有レジストリのものを使う
+from fastapi import Request
+from app.repositories.clients import ClientRegistry, get_client_registry
+from app.repositories.firestore_repository import AsyncFirestoreRepository
+from app.repositories.gcs_repository import AsyncGCSRepository
+from app.services.gemini_service import GeminiService
+from app.services.manual_service import ManualService
+from app.services.video_service import VideoService
+
+
+def get_clients(request: Request) -> ClientRegistry:
+    return getattr(request.app.state, "clients", None) or get_client_registry()
+
+
+# リクエスト外（ワーカーなど）でも同じ構成のサービスを作れるようにレジストリから組み立てる
+def build_manual_service(clients: ClientRegistry) -> ManualService:
+    return ManualService(
+        firestore_repository=AsyncFirestoreRepository(clients.async_firestore),
+        gcs_repository=AsyncGCSRepository(clients.storage_http, clients.storage_credentials, clients.storage_api_base)
+    )
+
+
+def build_gemini_service(clients: ClientRegistry) -> GeminiService:
+    return GeminiService(clients.genai)
+
+
+def get_manual_service(request: Request) -> ManualService:
+    return build_manual_service(get_clients(request))
+
+
+def get_gemini_service(request: Request) -> GeminiService:
+    return build_gemini_service(get_clients(request))
+
+
+def get_video_service() -> VideoService:
+    return VideoService()
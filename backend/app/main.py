@@ -1,10 +1,21 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.api.api import api_router
+from app.repositories.clients import init_client_registry, close_client_registry
+from app.services.job_queue import close_job_queue
 import os
 
-app = FastAPI(title="Video to Manual Generator")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Google Cloud クライアントはアプリケーション全体で共有する
+    app.state.clients = init_client_registry()
+    yield
+    await close_job_queue()
+    await close_client_registry()
+
+app = FastAPI(title="Video to Manual Generator", lifespan=lifespan)
 
 # Create static directory if it doesn't exist
 os.makedirs("app/static/images", exist_ok=True)
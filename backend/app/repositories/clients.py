@@ -0,0 +1,196 @@
+# Google Cloud クライアントをアプリケーション全体で共有するためのレジストリ
+# リクエストごとにクライアントを作ると認証・TLS接続・gRPCチャネルの確立が毎回発生するため、
+# FastAPI の lifespan で1つだけ作成し、各リポジトリ/サービスはここから取得する
+import os
+import threading
+from typing import Optional
+
+import httpx
+import requests
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import firestore, storage
+from google import genai
+from google.genai import types
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# GCS (requests) のコネクションプールサイズ
+STORAGE_HTTP_POOL_SIZE = int(os.getenv("STORAGE_HTTP_POOL_SIZE", "32"))
+# Gemini (httpx) の最大同時接続数
+GENAI_MAX_CONNECTIONS = int(os.getenv("GENAI_MAX_CONNECTIONS", "32"))
+# GCS JSON API を非同期で呼び出すときのタイムアウト（秒）
+STORAGE_HTTP_TIMEOUT = float(os.getenv("STORAGE_HTTP_TIMEOUT", "300"))
+
+
+class ClientRegistry:
+    def __init__(self, storage_pool_size: int = STORAGE_HTTP_POOL_SIZE, genai_max_connections: int = GENAI_MAX_CONNECTIONS):
+        self.project_id = os.getenv("PROJECT_ID")
+        self.storage_pool_size = storage_pool_size
+        self.genai_max_connections = genai_max_connections
+
+        self._lock = threading.Lock()
+        self._firestore: Optional[firestore.Client] = None
+        self._storage: Optional[storage.Client] = None
+        self._storage_session: Optional[requests.Session] = None
+        self._genai: Optional[genai.Client] = None
+        # 非同期版（AsyncFirestoreRepository / AsyncGCSRepository 用）
+        self._async_firestore: Optional[firestore.AsyncClient] = None
+        self._storage_http: Optional[httpx.AsyncClient] = None
+        self._storage_credentials = None
+        self._storage_credentials_loaded = False
+
+    # 各クライアントは初回利用時に作成する（設定が不足していてもアプリ自体は起動できるように）
+    @property
+    def firestore(self) -> firestore.Client:
+        with self._lock:
+            if self._firestore is None:
+                self._firestore = firestore.Client.from_service_account_json(
+                    os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
+                    project=self.project_id,
+                    database=os.getenv("FIRESTORE_DATABASE")
+                )
+            return self._firestore
+
+    @property
+    def storage(self) -> storage.Client:
+        with self._lock:
+            if self._storage is None:
+                if os.getenv("STORAGE_EMULATOR_HOST"):
+                    # ローカルのGCSエミュレータは認証不要
+                    session = requests.Session()
+                else:
+                    credentials, _ = google.auth.default(scopes=storage.Client.SCOPE)
+                    session = AuthorizedSession(credentials)
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self.storage_pool_size,
+                    pool_maxsize=self.storage_pool_size
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._storage_session = session
+                self._storage = storage.Client(project=self.project_id, _http=session)
+            return self._storage
+
+    @property
+    def genai(self) -> genai.Client:
+        with self._lock:
+            if self._genai is None:
+                limits = httpx.Limits(
+                    max_connections=self.genai_max_connections,
+                    max_keepalive_connections=self.genai_max_connections
+                )
+                self._genai = genai.Client(
+                    vertexai=True,
+                    project=self.project_id,
+                    location=os.getenv("LOCATION", "us-central1"),
+                    http_options=types.HttpOptions(
+                        client_args={"limits": limits},
+                        async_client_args={"limits": limits}
+                    )
+                )
+            return self._genai
+
+    @property
+    def async_firestore(self) -> "firestore.AsyncClient":
+        with self._lock:
+            if self._async_firestore is None:
+                self._async_firestore = firestore.AsyncClient.from_service_account_json(
+                    os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
+                    project=self.project_id,
+                    database=os.getenv("FIRESTORE_DATABASE")
+                )
+            return self._async_firestore
+
+    @property
+    def storage_api_base(self) -> str:
+        emulator_host = os.getenv("STORAGE_EMULATOR_HOST")
+        if emulator_host:
+            return emulator_host if "://" in emulator_host else f"http://{emulator_host}"
+        return "https://storage.googleapis.com"
+
+    @property
+    def storage_credentials(self):
+        """GCS JSON API 用の認証情報（エミュレータ利用時は None）"""
+        with self._lock:
+            if not self._storage_credentials_loaded:
+                if not os.getenv("STORAGE_EMULATOR_HOST"):
+                    self._storage_credentials, _ = google.auth.default(scopes=storage.Client.SCOPE)
+                self._storage_credentials_loaded = True
+            return self._storage_credentials
+
+    @property
+    def storage_http(self) -> httpx.AsyncClient:
+        with self._lock:
+            if self._storage_http is None:
+                self._storage_http = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.storage_pool_size,
+                        max_keepalive_connections=self.storage_pool_size
+                    ),
+                    timeout=httpx.Timeout(STORAGE_HTTP_TIMEOUT, connect=10.0)
+                )
+            return self._storage_http
+
+    async def aclose(self):
+        """
+        作成済みのクライアントの接続を閉じる
+        """
+        with self._lock:
+            firestore_client, self._firestore = self._firestore, None
+            async_firestore_client, self._async_firestore = self._async_firestore, None
+            storage_session, self._storage_session = self._storage_session, None
+            storage_http, self._storage_http = self._storage_http, None
+            genai_client, self._genai = self._genai, None
+            self._storage = None
+
+        for name, client in (("Firestore", firestore_client), ("Firestore (async)", async_firestore_client)):
+            if client is not None:
+                try:
+                    client.close()
+                except Exception as e:
+                    print(f"Failed to close {name} client: {e}")
+        if storage_session is not None:
+            storage_session.close()
+        if storage_http is not None:
+            await storage_http.aclose()
+        if genai_client is not None:
+            try:
+                genai_client.close()
+                await genai_client.aio.aclose()
+            except Exception as e:
+                print(f"Failed to close Gemini client: {e}")
+
+
+_registry: Optional[ClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def init_client_registry() -> ClientRegistry:
+    """
+    アプリケーション起動時にレジストリを作成する
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry()
+        return _registry
+
+
+def get_client_registry() -> ClientRegistry:
+    """
+    共有レジストリを取得する（lifespan 外から呼ばれた場合もその場で作成して共有する）
+    """
+    return _registry or init_client_registry()
+
+
+async def close_client_registry():
+    """
+    アプリケーション終了時にすべてのクライアントを閉じる
+    """
+    global _registry
+    with _registry_lock:
+        registry, _registry = _registry, None
+    if registry:
+        await registry.aclose()
@@ -2,21 +2,20 @@
 import os
 from google.cloud import firestore
 from dotenv import load_dotenv
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
+from app.repositories.clients import get_client_registry
 
 load_dotenv()
 
+# 1回のバッチ書き込みに含められる最大件数（Firestoreの制限）
+MAX_BATCH_SIZE = 500
+
 class FirestoreRepository:
-    # Firestoreクライアントの初期化
-    def __init__(self):
+    # Firestoreクライアントの初期化（省略時はアプリケーション共有のクライアントを使う）
+    def __init__(self, db: Optional[firestore.Client] = None):
         self.project_id = os.getenv("PROJECT_ID")
         self.database_name = os.getenv("FIRESTORE_DATABASE")
-        self.credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-        self.db = firestore.Client.from_service_account_json(
-            self.credentials_path,
-            project=self.project_id,
-            database=self.database_name
-        )
+        self.db = db or get_client_registry().firestore
 
     # ドキュメントの作成
     def create_document(self, collection_name: str, document_id: str, data: Dict[str, Any]) -> str:
@@ -74,3 +73,74 @@ class FirestoreRepository:
         docs = self.db.collection_group(collection_group_id).where(field, operator, value).stream()
         return [{"id": doc.id, "path": doc.reference.path, **doc.to_dict()} for doc in docs]
 
+
+
+class AsyncFirestoreRepository:
+    """
+    FirestoreRepository の非同期版（Firestore AsyncClient を使い、イベントループをブロックしない）
+    """
+    # Firestoreクライアントの初期化（省略時はアプリケーション共有のクライアントを使う）
+    def __init__(self, db: Optional[firestore.AsyncClient] = None):
+        self.project_id = os.getenv("PROJECT_ID")
+        self.database_name = os.getenv("FIRESTORE_DATABASE")
+        self.db = db or get_client_registry().async_firestore
+
+    # ドキュメントの作成
+    async def create_document(self, collection_name: str, document_id: str, data: Dict[str, Any]) -> str:
+        doc_ref = self.db.collection(collection_name).document(document_id)
+        await doc_ref.set(data)
+        return document_id
+
+    # ドキュメントの取得
+    async def get_document(self, collection_name: str, document_id: str) -> Optional[Dict[str, Any]]:
+        doc_ref = self.db.collection(collection_name).document(document_id)
+        doc = await doc_ref.get()
+        if doc.exists:
+            return doc.to_dict()
+        return None
+
+    # コレクション内の全ドキュメント取得
+    async def get_all_documents(self, collection_name: str) -> List[Dict[str, Any]]:
+        docs = self.db.collection(collection_name).stream()
+        return [{"id": doc.id, **doc.to_dict()} async for doc in docs]
+
+    # ドキュメントの更新
+    async def update_document(self, collection_name: str, document_id: str, data: Dict[str, Any]) -> None:
+        doc_ref = self.db.collection(collection_name).document(document_id)
+        await doc_ref.update(data)
+
+    # ドキュメントの削除
+    async def delete_document(self, collection_name: str, document_id: str) -> None:
+        doc_ref = self.db.collection(collection_name).document(document_id)
+        await doc_ref.delete()
+
+    # 複数ドキュメントの一括書き込み
+    async def batch_write(self, sets: List[Tuple[str, str, Dict[str, Any]]] = (), updates: List[Tuple[str, str, Dict[str, Any]]] = (), deletes: List[Tuple[str, str]] = ()) -> None:
+        operations = (
+            [("set", c, d, data) for c, d, data in sets]
+            + [("update", c, d, data) for c, d, data in updates]
+            + [("delete", c, d, None) for c, d in deletes]
+        )
+        for start in range(0, len(operations), MAX_BATCH_SIZE):
+            batch = self.db.batch()
+            for op, collection_name, document_id, data in operations[start:start + MAX_BATCH_SIZE]:
+                doc_ref = self.db.collection(collection_name).document(document_id)
+                if op == "set":
+                    batch.set(doc_ref, data)
+                elif op == "update":
+                    batch.update(doc_ref, data)
+                else:
+                    batch.delete(doc_ref)
+            await batch.commit()
+
+    # コレクション内のドキュメントを並び順指定で取得
+    async def query_collection(self, collection_name: str, order_by: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = self.db.collection(collection_name)
+        if order_by:
+            query = query.order_by(order_by)
+        return [{"id": doc.id, **doc.to_dict()} async for doc in query.stream()]
+
+    # コレクショングループクエリ
+    async def find_in_collection_group(self, collection_group_id: str, field: str, operator: str, value: Any) -> List[Dict[str, Any]]:
+        docs = self.db.collection_group(collection_group_id).where(field, operator, value).stream()
+        return [{"id": doc.id, "path": doc.reference.path, **doc.to_dict()} async for doc in docs]
@@ -1,15 +1,160 @@
 # GCS操作用クラス
+import io
 import os
+import base64
+import asyncio
+import mimetypes
+import re
+import json
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Optional, AsyncIterator, Dict, Any, List, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+import httpx
+import google_crc32c
 from google.cloud import storage
 from dotenv import load_dotenv
+from app.repositories.clients import get_client_registry
 
 load_dotenv()
+
+# リモートの動画を範囲読み込みするときの1リクエストのサイズと、保持するブロック数
+REMOTE_READ_BLOCK_SIZE = int(os.getenv("REMOTE_READ_BLOCK_SIZE", str(256 * 1024)))
+REMOTE_READ_CACHE_BLOCKS = int(os.getenv("REMOTE_READ_CACHE_BLOCKS", "64"))
+
+# 並列分割ダウンロードの同時リクエスト数と1リクエストのサイズ
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+DOWNLOAD_SLICE_SIZE = int(os.getenv("DOWNLOAD_SLICE_SIZE", str(32 * 1024 * 1024)))
+# これより小さいオブジェクトは分割せずに1本のストリームでダウンロードする
+SLICED_DOWNLOAD_MIN_BYTES = int(os.getenv("SLICED_DOWNLOAD_MIN_BYTES", str(64 * 1024 * 1024)))
+
+
+# JSON API のバッチリクエスト1回に含められる最大件数
+MAX_BATCH_CALLS = 100
+
+class ChecksumMismatchError(Exception):
+    pass
+
+
+def _file_crc32c(path: str) -> str:
+    """
+    ダウンロード済みファイルの CRC32C（GCSのメタデータと同じ base64 形式）を計算する
+    """
+    crc = google_crc32c.Checksum()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(8 * 1024 * 1024)
+            if not chunk:
+                break
+            crc.update(chunk)
+    return base64.b64encode(crc.digest()).decode("ascii")
+
+
+def _blob_metadata(size, generation, md5_hash, crc32c, content_type) -> Dict[str, Any]:
+    return {
+        "size": int(size) if size is not None else None,
+        "generation": int(generation) if generation is not None else None,
+        "md5_hash": md5_hash,
+        "crc32c": crc32c,
+        "content_type": content_type
+    }
+
+
+class GCSRangeReader(io.RawIOBase):
+    """
+    GCS上のオブジェクトを Range リクエストで必要な部分だけ読む読み取り専用ファイル
+    PyAV などシーク可能なファイルを要求するライブラリに渡せる（同期API、スレッド内で使う）
+    """
+    def __init__(self, blob, size: int, block_size: int = REMOTE_READ_BLOCK_SIZE, cache_blocks: int = REMOTE_READ_CACHE_BLOCKS):
+        super().__init__()
+        self.blob = blob
+        self.size = size
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self._position = 0
+        self._blocks: "OrderedDict[int, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 転送量の確認用
+        self.bytes_fetched = 0
+        self.requests = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        length = min(len(view), self.size - self._position)
+        if length <= 0:
+            return 0
+
+        with self._lock:
+            if length >= self.block_size:
+                # 大きな読み込み（全体コピーなど）はブロックキャッシュを通さずにそのまま取得する
+                view[:length] = self._fetch(self._position, self._position + length)
+            else:
+                written = 0
+                while written < length:
+                    position = self._position + written
+                    index, offset = divmod(position, self.block_size)
+                    block = self._block(index)
+                    chunk = block[offset:offset + length - written]
+                    if not chunk:
+                        break
+                    view[written:written + len(chunk)] = chunk
+                    written += len(chunk)
+                length = written
+
+        self._position += length
+        return length
+
+    def _block(self, index: int) -> bytes:
+        block = self._blocks.get(index)
+        if block is not None:
+            self._blocks.move_to_end(index)
+            return block
+        start = index * self.block_size
+        block = self._fetch(start, min(start + self.block_size, self.size))
+        self._blocks[index] = block
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        # end は含まない（download_as_bytes の end は含むため -1 する）
+        data = self.blob.download_as_bytes(start=start, end=end - 1, checksum=None, raw_download=True)
+        self.bytes_fetched += len(data)
+        self.requests += 1
+        return data
+
+
 class GCSRepository:
-    # GCSクライアントの初期化
-    def __init__(self):
+    # GCSクライアントの初期化（省略時はアプリケーション共有のクライアントを使う）
+    def __init__(self, storage_client: Optional[storage.Client] = None):
         self.project_id = os.getenv("PROJECT_ID")
         self.bucket_name = os.getenv("BUCKET_NAME")
-        self.storage_client = storage.Client(project=self.project_id)
+        self.storage_client = storage_client or get_client_registry().storage
         self.bucket = self.storage_client.bucket(self.bucket_name)
 
     # 動画、画像などファイルのアップロード
@@ -32,6 +177,29 @@ class GCSRepository:
         blob = self.bucket.blob(source_blob_name)
         blob.download_to_filename(destination_file_path)
 
+    # メタデータ（サイズ・世代・ハッシュ）の取得
+    def get_metadata(self, blob_name: str, bucket_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        ダウンロードせずにオブジェクトのサイズ・generation・md5/crc32c を取得する
+        """
+        bucket = self.storage_client.bucket(bucket_name) if bucket_name else self.bucket
+        blob = bucket.get_blob(blob_name)
+        if blob is None:
+            raise FileNotFoundError(f"gs://{bucket.name}/{blob_name} not found")
+        return _blob_metadata(blob.size, blob.generation, blob.md5_hash, blob.crc32c, blob.content_type)
+
+    # 範囲読み込み用のファイルオブジェクトを開く
+    def open_range_reader(self, blob_name: str, bucket_name: Optional[str] = None, generation: Optional[int] = None, size: Optional[int] = None) -> GCSRangeReader:
+        """
+        必要な範囲だけを読み込むファイルオブジェクトを返す
+        読み込み中にオブジェクトが上書きされても内容が混ざらないよう generation を固定する
+        """
+        if generation is None or size is None:
+            metadata = self.get_metadata(blob_name, bucket_name)
+            generation, size = metadata["generation"], metadata["size"]
+        bucket = self.storage_client.bucket(bucket_name) if bucket_name else self.bucket
+        return GCSRangeReader(bucket.blob(blob_name, generation=generation), size)
+
     # ファイルの削除
     def delete_file(self, blob_name: str):
         """バケットからファイルを削除する"""
@@ -60,3 +228,363 @@ class GCSRepository:
         """
         blob = self.bucket.blob(blob_name)
         return blob.download_as_text()
+
+
+class AsyncGCSRepository:
+    """
+    GCSRepository の非同期版
+    google-cloud-storage には非同期APIがないため、共有の httpx.AsyncClient で JSON API を直接呼び出す
+    """
+    DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+    # 省略時はアプリケーション共有のHTTPクライアント・認証情報を使う
+    # （http_client と api_base を渡した場合は credentials=None を「認証なし（エミュレータ）」として扱う）
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None, credentials=None, api_base: Optional[str] = None):
+        if http_client is None or api_base is None:
+            registry = get_client_registry()
+            http_client = http_client or registry.storage_http
+            api_base = api_base or registry.storage_api_base
+            credentials = credentials or registry.storage_credentials
+        self.project_id = os.getenv("PROJECT_ID")
+        self.bucket_name = os.getenv("BUCKET_NAME")
+        self.http = http_client
+        self.credentials = credentials
+        self.api_base = api_base.rstrip("/")
+
+    # --- URL・認証ヘッダー ---
+
+    def _object_url(self, blob_name: str) -> str:
+        return f"{self.api_base}/storage/v1/b/{self.bucket_name}/o/{quote(blob_name, safe='')}"
+
+    def public_url(self, blob_name: str) -> str:
+        """Blob.public_url と同じ形式の公開URL"""
+        return f"{self.api_base}/{self.bucket_name}/{quote(blob_name, safe='/~')}"
+
+    def blob_name_from_url(self, url: Optional[str]) -> Optional[str]:
+        """
+        gs://{bucket}/... または公開URLがこのバケットのオブジェクトを指していればオブジェクト名を返す
+        （それ以外のURLやローカルパスは None）
+        """
+        if not url:
+            return None
+        prefixes = [f"gs://{self.bucket_name}/", f"{self.api_base}/{self.bucket_name}/", f"https://storage.googleapis.com/{self.bucket_name}/"]
+        for prefix in prefixes:
+            if url.startswith(prefix):
+                name = url[len(prefix):].split("?", 1)[0]
+                # 公開URLはパスがエンコードされている
+                return (name if prefix.startswith("gs://") else unquote(name)) or None
+        return None
+
+    async def _headers(self) -> dict:
+        if self.credentials is None:
+            # エミュレータは認証不要
+            return {}
+        if not self.credentials.valid:
+            # トークンの更新は同期APIしかないため、期限切れのときだけスレッドで行う
+            from google.auth.transport.requests import Request
+            await asyncio.to_thread(self.credentials.refresh, Request())
+        return {"Authorization": f"Bearer {self.credentials.token}"}
+
+    async def _make_public(self, blob_name: str) -> None:
+        response = await self.http.post(
+            f"{self._object_url(blob_name)}/acl",
+            json={"entity": "allUsers", "role": "READER"},
+            headers=await self._headers()
+        )
+        response.raise_for_status()
+
+    async def _batch(self, calls: List[Tuple[str, str, Optional[dict]]]) -> List[int]:
+        """
+        (method, url, json_body) の呼び出しを JSON API のバッチリクエストでまとめて送る
+        バッチが使えない場合（エミュレータなど）は個別のリクエストを並行に送る
+        returns: 各呼び出しのHTTPステータス（呼び出し順）
+        """
+        statuses: List[int] = []
+        for start in range(0, len(calls), MAX_BATCH_CALLS):
+            chunk = calls[start:start + MAX_BATCH_CALLS]
+            try:
+                statuses.extend(await self._send_batch(chunk))
+            except Exception as e:
+                print(f"GCS batch request failed, sending {len(chunk)} calls individually: {e}")
+                statuses.extend(await asyncio.gather(*(self._send_single(*call) for call in chunk)))
+        return statuses
+
+    async def _send_single(self, method: str, url: str, body: Optional[dict]) -> int:
+        try:
+            response = await self.http.request(method, url, json=body, headers=await self._headers())
+            return response.status_code
+        except Exception as e:
+            print(f"GCS {method} {url} failed: {e}")
+            return 0
+
+    async def _send_batch(self, calls: List[Tuple[str, str, Optional[dict]]]) -> List[int]:
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for index, (method, url, body) in enumerate(calls):
+            payload = json.dumps(body) if body is not None else ""
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <{index}>\r\n\r\n"
+                f"{method} {urlsplit(url).path} HTTP/1.1\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(payload.encode('utf-8'))}\r\n\r\n"
+                f"{payload}\r\n"
+            )
+        body = "".join(parts) + f"--{boundary}--\r\n"
+
+        headers = await self._headers()
+        headers["Content-Type"] = f"multipart/mixed; boundary={boundary}"
+        response = await self.http.post(f"{self.api_base}/batch/storage/v1", content=body.encode("utf-8"), headers=headers)
+        response.raise_for_status()
+
+        # レスポンスの各パートから Content-ID と HTTPステータスを取り出す
+        match = re.search(r"boundary=\"?([^\";]+)", response.headers.get("content-type", ""))
+        if not match:
+            raise ValueError("Batch response is not multipart")
+        statuses = [0] * len(calls)
+        for part in response.text.split(f"--{match.group(1)}"):
+            content_id = re.search(r"Content-ID:\s*<response-(\d+)>", part, re.IGNORECASE)
+            status = re.search(r"HTTP/1\.1 (\d{3})", part)
+            if content_id and status and int(content_id.group(1)) < len(calls):
+                statuses[int(content_id.group(1))] = int(status.group(1))
+        return statuses
+
+    async def make_public_batch(self, blob_names: List[str]) -> List[str]:
+        """
+        複数のオブジェクトをまとめて公開する
+        returns: 公開できなかったオブジェクト名（バケットポリシーでACLが使えない場合など）
+        """
+        calls = [("POST", f"{self._object_url(name)}/acl", {"entity": "allUsers", "role": "READER"}) for name in blob_names]
+        statuses = await self._batch(calls)
+        failed = [name for name, status in zip(blob_names, statuses) if not 200 <= status < 300]
+        if failed:
+            print(f"Warning: Failed to make {len(failed)} blob(s) public")
+        return failed
+
+    async def delete_files(self, blob_names: List[str]) -> List[str]:
+        """
+        複数のオブジェクトをまとめて削除する
+        returns: 削除できなかったオブジェクト名（既に存在しないものは削除済みとして扱う）
+        """
+        calls = [("DELETE", self._object_url(name), None) for name in blob_names]
+        statuses = await self._batch(calls)
+        return [name for name, status in zip(blob_names, statuses) if not (200 <= status < 300 or status == 404)]
+
+    async def _upload(self, destination_blob_name: str, content, size: int, content_type: str) -> None:
+        headers = await self._headers()
+        headers["Content-Type"] = content_type
+        headers["Content-Length"] = str(size)
+        response = await self.http.post(
+            f"{self.api_base}/upload/storage/v1/b/{self.bucket_name}/o",
+            params={"uploadType": "media", "name": destination_blob_name},
+            content=content,
+            headers=headers
+        )
+        response.raise_for_status()
+
+    async def _read_chunks(self, path: str) -> AsyncIterator[bytes]:
+        """ファイルをチャンクごとに読み込む（ファイルI/Oのみスレッドで行う）"""
+        f = await asyncio.to_thread(open, path, "rb")
+        try:
+            while True:
+                chunk = await asyncio.to_thread(f.read, self.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            f.close()
+
+    # 動画、画像などファイルのアップロード
+    async def upload_file(self, source_file_path: str, destination_blob_name: str, content_type: Optional[str] = None, make_public: bool = True) -> str:
+        """
+        ファイルをストリーミングでアップロードする（content_type 省略時は拡張子から推測する）
+        make_public=False の場合は公開設定をしない（一時ファイル用）
+        returns: アップロードしたファイルの公開URL
+        """
+        content_type = content_type or mimetypes.guess_type(source_file_path)[0] or "application/octet-stream"
+        size = os.path.getsize(source_file_path)
+        await self._upload(destination_blob_name, self._read_chunks(source_file_path), size, content_type)
+        if make_public:
+            try:
+                await self._make_public(destination_blob_name)
+            except Exception as e:
+                print(f"Warning: Failed to make blob public: {e}")
+        return self.public_url(destination_blob_name)
+
+    # クライアントが直接アップロードするための再開可能アップロードセッション
+    async def create_resumable_session(self, destination_blob_name: str, content_type: str, size: Optional[int] = None, origin: Optional[str] = None, if_generation_match: Optional[int] = 0) -> str:
+        """
+        再開可能アップロードのセッションを開始し、セッションURIを返す
+        セッションURI自体がアップロード権限を持つため、クライアントは認証情報なしで PUT できる（有効期限は1週間）
+        origin を渡すとブラウザからの CORS アップロードが許可される
+        if_generation_match=0 の場合は既存のオブジェクトを上書きしない
+        """
+        headers = await self._headers()
+        headers["X-Upload-Content-Type"] = content_type
+        if size is not None:
+            headers["X-Upload-Content-Length"] = str(size)
+        if origin:
+            headers["Origin"] = origin
+        params = {"uploadType": "resumable", "name": destination_blob_name}
+        if if_generation_match is not None:
+            params["ifGenerationMatch"] = str(if_generation_match)
+        response = await self.http.post(
+            f"{self.api_base}/upload/storage/v1/b/{self.bucket_name}/o",
+            params=params,
+            json={"name": destination_blob_name, "contentType": content_type},
+            headers=headers
+        )
+        response.raise_for_status()
+        session_url = response.headers.get("location")
+        if not session_url:
+            raise ValueError("Resumable upload response has no Location header")
+        return session_url
+
+    # バケット内でのコピー
+    async def copy_file(self, source_blob_name: str, destination_blob_name: str, make_public: bool = True) -> str:
+        """
+        オブジェクトをサーバー側でコピーする（rewrite API。データはAPIサーバーを経由しない）
+        大きなオブジェクトは1回で終わらないため rewriteToken を付けて完了まで繰り返す
+        returns: コピー先の公開URL
+        """
+        url = f"{self._object_url(source_blob_name)}/rewriteTo/b/{self.bucket_name}/o/{quote(destination_blob_name, safe='')}"
+        params: Dict[str, str] = {}
+        while True:
+            response = await self.http.post(url, params=params, headers=await self._headers())
+            if response.status_code == 404:
+                raise FileNotFoundError(f"gs://{self.bucket_name}/{source_blob_name} not found")
+            response.raise_for_status()
+            data = response.json()
+            if data.get("done"):
+                break
+            params["rewriteToken"] = data["rewriteToken"]
+        if make_public:
+            try:
+                await self._make_public(destination_blob_name)
+            except Exception as e:
+                print(f"Warning: Failed to make blob public: {e}")
+        return self.public_url(destination_blob_name)
+
+    # 動画、画像などファイルのダウンロード
+    async def download_file(self, source_blob_name: str, destination_file_path: str, workers: Optional[int] = None, slice_size: Optional[int] = None):
+        """
+        バケットからファイルをダウンロードし、最後に CRC32C を検証する
+        SLICED_DOWNLOAD_MIN_BYTES 以上のオブジェクトは slice_size ごとの Range リクエストを workers 本並列で取得する
+        """
+        workers = workers or DOWNLOAD_WORKERS
+        slice_size = slice_size or DOWNLOAD_SLICE_SIZE
+        metadata = await self.get_metadata(source_blob_name)
+        size = metadata["size"]
+        # 途中で上書きされても別の世代が混ざらないように generation を固定する
+        params = {"alt": "media", "generation": str(metadata["generation"])}
+
+        try:
+            if workers > 1 and size >= max(SLICED_DOWNLOAD_MIN_BYTES, slice_size * 2):
+                await self._download_sliced(source_blob_name, destination_file_path, params, size, workers, slice_size)
+            else:
+                await self._download_stream(source_blob_name, destination_file_path, params)
+
+            crc32c = await asyncio.to_thread(_file_crc32c, destination_file_path)
+            if metadata["crc32c"] and crc32c != metadata["crc32c"]:
+                raise ChecksumMismatchError(
+                    f"CRC32C mismatch for {source_blob_name}: expected {metadata['crc32c']}, got {crc32c}"
+                )
+        except BaseException:
+            if os.path.exists(destination_file_path):
+                os.remove(destination_file_path)
+            raise
+
+    async def _download_stream(self, source_blob_name: str, destination_file_path: str, params: dict):
+        async with self.http.stream(
+            "GET",
+            self._object_url(source_blob_name),
+            params=params,
+            headers=await self._headers()
+        ) as response:
+            response.raise_for_status()
+            with open(destination_file_path, "wb") as f:
+                async for chunk in response.aiter_bytes(self.DOWNLOAD_CHUNK_SIZE):
+                    await asyncio.to_thread(f.write, chunk)
+
+    async def _download_sliced(self, source_blob_name: str, destination_file_path: str, params: dict, size: int, workers: int, slice_size: int):
+        """
+        ファイルを先に確保し、各スライスを自分のオフセットへ書き込む
+        """
+        semaphore = asyncio.Semaphore(workers)
+        url = self._object_url(source_blob_name)
+        fd = os.open(destination_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+        async def fetch(start: int, end: int):
+            async with semaphore:
+                headers = await self._headers()
+                headers["Range"] = f"bytes={start}-{end - 1}"
+                async with self.http.stream("GET", url, params=params, headers=headers) as response:
+                    response.raise_for_status()
+                    offset = start
+                    async for chunk in response.aiter_bytes(self.DOWNLOAD_CHUNK_SIZE):
+                        await asyncio.to_thread(os.pwrite, fd, chunk, offset)
+                        offset += len(chunk)
+                if offset != end:
+                    raise IOError(f"Incomplete slice {start}-{end - 1} of {source_blob_name}: got {offset - start} bytes")
+
+        try:
+            await asyncio.to_thread(os.ftruncate, fd, size)
+            tasks = [asyncio.create_task(fetch(start, min(start + slice_size, size))) for start in range(0, size, slice_size)]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # 1つでも失敗したら残りのスライスを止める
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        finally:
+            os.close(fd)
+
+    # メタデータ（サイズ・世代・ハッシュ）の取得
+    async def get_metadata(self, blob_name: str) -> Dict[str, Any]:
+        """
+        ダウンロードせずにオブジェクトのサイズ・generation・md5/crc32c を取得する
+        """
+        response = await self.http.get(self._object_url(blob_name), headers=await self._headers())
+        if response.status_code == 404:
+            raise FileNotFoundError(f"gs://{self.bucket_name}/{blob_name} not found")
+        response.raise_for_status()
+        data = response.json()
+        return _blob_metadata(data.get("size"), data.get("generation"), data.get("md5Hash"), data.get("crc32c"), data.get("contentType"))
+
+    # ファイルの削除
+    async def delete_file(self, blob_name: str):
+        """バケットからファイルを削除する"""
+        response = await self.http.delete(self._object_url(blob_name), headers=await self._headers())
+        response.raise_for_status()
+
+    # 文字列やバイトデータを直接アップロード
+    async def upload_structure_content(self, content: str, destination_blob_name: str, content_type: str = "text/plain", make_public: bool = True) -> str:
+        """
+        コンテンツを直接GCSにアップロード
+        returns: アップロードしたファイルの公開URL
+        """
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        await self._upload(destination_blob_name, data, len(data), content_type)
+        if make_public:
+            try:
+                await self._make_public(destination_blob_name)
+            except Exception:
+                pass # Ignore if bucket policy prevents ACLs
+        return self.public_url(destination_blob_name)
+
+    # ファイルの中身を読み込む
+    async def read_file(self, blob_name: str) -> str:
+        """
+        GCS上のファイルの中身を文字列として読み込む
+        """
+        response = await self.http.get(
+            self._object_url(blob_name),
+            params={"alt": "media"},
+            headers=await self._headers()
+        )
+        response.raise_for_status()
+        return response.content.decode("utf-8")
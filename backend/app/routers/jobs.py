@@ -0,0 +1,54 @@
+from fastapi import APIRouter, HTTPException, Depends
+from app.services.manual_service import ManualService
+from app.services.job_queue import get_job_queue
+from app.api.deps import get_manual_service
+
+router = APIRouter()
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, manual_service: ManualService = Depends(get_manual_service)):
+    """
+    解析ジョブの状態を返す
+    queue: キュー上の状態（待機中・実行中・リトライ待ち・失敗）、manual: Firestore 上の解析の進捗
+    """
+    job = await get_job_queue().get(job_id)
+
+    manual = None
+    try:
+        # ログインユーザーのID (現状は固定)
+        user_id = "test-user-001"
+        manual = await manual_service.firestore_repository.get_document(f"users/{user_id}/manuals", job_id)
+    except Exception as e:
+        print(f"Job Status Error: {e}")
+
+    if job is None and manual is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    queue_status = None
+    if job:
+        queue_status = {
+            "status": job["status"],
+            "attempts": job["attempts"],
+            "max_attempts": job["max_attempts"],
+            "last_error": job["last_error"],
+            "available_at": job["available_at"],
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"]
+        }
+
+    manual_status = None
+    if manual:
+        manual_status = {
+            "status": manual.get("status"),
+            "step_count": manual.get("step_count", len(manual.get("steps") or [])),
+            "completed_step_count": manual.get("completed_step_count")
+        }
+
+    return {
+        "id": job_id,
+        # 解析の進捗があればそれを、なければキューの状態を返す
+        "status": (manual_status or {}).get("status") or (queue_status or {}).get("status"),
+        "queue": queue_status,
+        "manual": manual_status
+    }
@@ -1,8 +1,9 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from app.services.manual_service import ManualService
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Depends
+from app.services.manual_service import ManualService, VideoSourceError
+from app.services.upload_service import save_upload, UploadTooLargeError
+from app.api.deps import get_manual_service
 from pydantic import BaseModel
 from typing import Optional
-import shutil
 import os
 import uuid
 import json
@@ -19,54 +20,57 @@ class PublishRequest(BaseModel):
 async def save_manual(
     manual_id: str = Form(...),
     steps: str = Form(...),
-    video: Optional[UploadFile] = File(None)
+    video: Optional[UploadFile] = File(None),
+    video_url: Optional[str] = Form(None),
+    service: ManualService = Depends(get_manual_service)
 ):
+    upload = None
     try:
         steps_list = json.loads(steps)
-        service = ManualService()
         
-        # 保存先の準備
-        video_path = None
+        # 保存先の準備（イベントループを止めずにチャンクごとに保存する）
         if video:
             video_id = str(uuid.uuid4())
-            video_path = f"{TEMP_DIR}/save_{video_id}_{video.filename}"
-            with open(video_path, "wb") as buffer:
-                shutil.copyfileobj(video.file, buffer)
+            upload = await save_upload(video, f"{TEMP_DIR}/save_{video_id}_{video.filename}")
         
         result = await service.save_manual(
             steps=steps_list, 
             manual_id=manual_id,
-            video_path=video_path
+            video_path=upload.path if upload else None,
+            video_url=video_url # 解析時にアップロード済みの動画 (gs://...) はサーバー側で再利用する
         )
-        
-        # Cleanup video if it was saved locally
-        if video_path and os.path.exists(video_path):
-            os.remove(video_path)
             
         return {
             "status": "success",
             "message": "Manual and assets saved to GCS",
             "paths": result
         }
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except VideoSourceError as e:
+        # バケット外の動画URLは参照できないため、動画ファイルを送ってもらう
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Save Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Cleanup video if it was saved locally
+        if upload:
+            upload.remove()
 
 @router.get("/public/manuals/{manual_id}")
-async def get_public_manual(manual_id: str):
-    service = ManualService()
-    manual = service.get_public_manual(manual_id)
+async def get_public_manual(manual_id: str, service: ManualService = Depends(get_manual_service)):
+    manual = await service.get_public_manual(manual_id)
     if not manual:
         raise HTTPException(status_code=404, detail="Manual not found or not public")
     return manual
 
 @router.put("/manuals/{manual_id}/publish")
-async def toggle_manual_publish(manual_id: str, request: PublishRequest):
+async def toggle_manual_publish(manual_id: str, request: PublishRequest, service: ManualService = Depends(get_manual_service)):
     # ログインユーザーのIDを取得する
     user_id = "test-user-001"
     
-    service = ManualService()
-    success = service.update_visibility(user_id, manual_id, request.is_public)
+    success = await service.update_visibility(user_id, manual_id, request.is_public)
     
     if not success:
         raise HTTPException(status_code=404, detail="Manual not found")
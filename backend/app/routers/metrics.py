@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from app.services.metrics import metrics
+from app.services.analysis_cache import get_analysis_cache
+from app.services.job_queue import get_job_queue, JOB_QUEUE_ENABLED
+from app.services.rate_limiter import get_rate_limiter
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    プロセス内のパフォーマンス指標を返す
+    """
+    analysis_cache = get_analysis_cache()
+    rate_limiter = get_rate_limiter()
+    return {
+        **metrics.snapshot(),
+        "analysis_cache": analysis_cache.stats() if analysis_cache else None,
+        "rate_limiter": rate_limiter.stats() if rate_limiter else None,
+        # ジョブはワーカープロセスで実行されるため、件数は共有のキューから取得する
+        "job_queue": await get_job_queue().stats() if JOB_QUEUE_ENABLED else None
+    }
@@ -0,0 +1,122 @@
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, Request
+from app.services.gemini_service import GeminiService
+from app.services.manual_service import ManualService
+from app.services.metrics import metrics
+from app.services.upload_service import MAX_UPLOAD_BYTES
+from app.services.job_queue import JobAlreadyActiveError
+from app.routers.video import start_video_analysis
+from app.api.deps import get_manual_service, get_gemini_service
+from pydantic import BaseModel
+from typing import Optional
+import re
+import uuid
+import httpx
+
+router = APIRouter()
+
+# manual_id はオブジェクト名に使うため、パスとして安全な文字だけを受け付ける
+MANUAL_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+    content_type: str = "video/mp4"
+    manual_id: Optional[str] = None
+
+class CompleteUploadRequest(BaseModel):
+    title: Optional[str] = None
+
+def _video_blob_name(manual_id: str) -> str:
+    # フロントエンドの Firebase Storage へのアップロードと同じパス
+    return f"manuals/{manual_id}/video.mp4"
+
+def _validate_manual_id(manual_id: str):
+    if not MANUAL_ID_PATTERN.match(manual_id):
+        raise HTTPException(status_code=400, detail="Invalid manual_id")
+
+@router.post("/uploads/sessions", status_code=201)
+async def create_upload_session(
+    body: UploadSessionRequest,
+    request: Request,
+    manual_service: ManualService = Depends(get_manual_service)
+):
+    """
+    動画をAPIサーバーを経由せずにバケットへ直接アップロードするための再開可能アップロードセッションを発行する
+    クライアントは upload_url に PUT し（Content-Range で分割・中断後の再開が可能）、
+    完了後に /uploads/sessions/{manual_id}/complete を呼んで解析を開始する
+    """
+    if body.size <= 0:
+        raise HTTPException(status_code=400, detail="size must be positive")
+    if body.size > MAX_UPLOAD_BYTES:
+        metrics.incr("upload.rejected")
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the maximum size of {MAX_UPLOAD_BYTES} bytes")
+    if not body.content_type.startswith("video/"):
+        raise HTTPException(status_code=415, detail="Only video uploads are supported")
+
+    manual_id = body.manual_id or str(uuid.uuid4())
+    _validate_manual_id(manual_id)
+    blob_name = _video_blob_name(manual_id)
+
+    try:
+        upload_url = await manual_service.gcs_repository.create_resumable_session(
+            blob_name,
+            body.content_type,
+            size=body.size,
+            origin=request.headers.get("origin") # ブラウザから PUT するときの CORS 用
+        )
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 412:
+            raise HTTPException(status_code=409, detail="Video for this manual_id already exists")
+        print(f"Upload Session Error: {e}")
+        raise HTTPException(status_code=502, detail="Failed to create upload session")
+
+    metrics.incr("upload_sessions.created")
+    return {
+        "manual_id": manual_id,
+        "upload_url": upload_url,
+        "blob_name": blob_name,
+        "gs_url": f"gs://{manual_service.gcs_repository.bucket_name}/{blob_name}"
+    }
+
+@router.post("/uploads/sessions/{manual_id}/complete", status_code=202)
+async def complete_upload_session(
+    manual_id: str,
+    body: CompleteUploadRequest,
+    background_tasks: BackgroundTasks,
+    manual_service: ManualService = Depends(get_manual_service),
+    gemini_service: GeminiService = Depends(get_gemini_service)
+):
+    """
+    直接アップロードの完了通知。オブジェクトの存在とサイズを確認し、/analyze と同じ解析をバックグラウンドで開始する
+    """
+    _validate_manual_id(manual_id)
+    blob_name = _video_blob_name(manual_id)
+    gs_url = f"gs://{manual_service.gcs_repository.bucket_name}/{blob_name}"
+
+    try:
+        metadata = await manual_service.gcs_repository.get_metadata(blob_name)
+    except FileNotFoundError:
+        # アップロードが最後まで終わっていない（セッションは再開可能）
+        raise HTTPException(status_code=409, detail="Upload has not been finalized")
+
+    if metadata["size"] > MAX_UPLOAD_BYTES:
+        metrics.incr("upload.rejected")
+        await manual_service.gcs_repository.delete_file(blob_name)
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the maximum size of {MAX_UPLOAD_BYTES} bytes")
+
+    try:
+        await start_video_analysis(gs_url, manual_id, body.title or "無題の動画", background_tasks, manual_service, gemini_service, blob_name)
+    except JobAlreadyActiveError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"Analysis Trigger Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    metrics.incr("upload_sessions.completed")
+    metrics.incr("upload_sessions.bytes", metadata["size"])
+    return {
+        "status": "accepted",
+        "message": "Video analysis started (background)",
+        "manual_id": manual_id,
+        "video_url": gs_url
+    }
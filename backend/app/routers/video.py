@@ -1,10 +1,17 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Depends
 from fastapi.responses import StreamingResponse
 from app.services.gemini_service import GeminiService
-from app.services.video_service import VideoService
+from app.services.video_service import VideoService, REMOTE_FRAME_EXTRACTION
 from app.services.manual_service import ManualService
+from app.services.prompts import PROMPT_VERSION
+from app.services.metrics import metrics
+from app.services.upload_service import save_upload, UploadTooLargeError
+from app.services.job_queue import get_job_queue, JobAlreadyActiveError, JOB_QUEUE_ENABLED
+from app.api.deps import get_manual_service, get_gemini_service, get_video_service
 from pydantic import BaseModel
-import shutil
+from typing import Optional
+import asyncio
+import base64
 import os
 import uuid
 import json
@@ -14,14 +21,49 @@ router = APIRouter()
 TEMP_DIR = "/tmp/video_uploads"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+# /process-video-stream で同時に処理するステップ数
+STREAM_CONCURRENCY = int(os.getenv("STREAM_CONCURRENCY", "4"))
+# 動画全体をダウンロードする場合も、Phase 1 (gs:// URI) をダウンロード完了を待たずに始める
+PROGRESSIVE_DOWNLOAD = os.getenv("PROGRESSIVE_DOWNLOAD", "1") == "1"
+# キューに積む動画解析ジョブの種類（app.worker のハンドラ名）
+VIDEO_ANALYSIS_JOB = "video_analysis"
+
 class AnalyzeRequest(BaseModel):
     manual_id: str
     video_url: str
     title: str = "無題の動画"
 
+def _content_hash(metadata: dict) -> str:
+    """
+    GCSのメタデータから動画内容のハッシュを作る（ダウンロードせずに同一動画を判定する）
+    複合オブジェクトには md5 が無いため crc32c + サイズを使う
+    """
+    if metadata.get("md5_hash"):
+        return "md5-" + base64.b64decode(metadata["md5_hash"]).hex()
+    return "crc32c-" + base64.b64decode(metadata["crc32c"]).hex() + f"-{metadata['size']}"
+
 # Background Task Function
-async def run_video_analysis(video_url: str, manual_id: str, title: str):
+async def run_video_analysis(video_url: str, manual_id: str, title: str, manual_service: Optional[ManualService] = None, gemini_service: Optional[GeminiService] = None):
+    """
+    BackgroundTasks 用（例外はここで止めてステータスを error にする）
+    """
+    try:
+        await process_video_analysis(video_url, manual_id, title, manual_service, gemini_service)
+    except Exception as e:
+        print(f"Background Task Error: {e}")
+        # Update status to error
+        try:
+             await (manual_service or ManualService()).update_manual_status(manual_id, "error")
+        except:
+             print("Failed to update status to error")
+
+async def process_video_analysis(video_url: str, manual_id: str, title: str, manual_service: Optional[ManualService] = None, gemini_service: Optional[GeminiService] = None):
+    """
+    動画をダウンロード（または参照）して解析する。失敗時は例外を送出する（ワーカーがリトライを判断する）
+    """
     file_path = None
+    video_source = None
+    download_task = None
     try:
         print(f"Background Task Started: {manual_id}, {video_url}")
         
@@ -36,49 +78,97 @@ async def run_video_analysis(video_url: str, manual_id: str, title: str):
             if len(parts) > 1:
                 blob_name = parts[1]
 
-        # 拡張子推定
-        ext = os.path.splitext(blob_name)[1]
-        if not ext:
-            ext = ".mp4"
+        # リポジトリ・クライアントはリクエスト時に注入されたサービスのもの（共有クライアント）を使う
+        manual_service = manual_service or ManualService()
+        gemini_service = gemini_service or GeminiService()
+        video_service = VideoService()
+
+        # 同一動画の判定はどの経路でも GCS のメタデータのハッシュで行う（ダウンロード前に再利用を判定できる）
+        metadata = await manual_service.gcs_repository.get_metadata(blob_name)
+        video_hash = _content_hash(metadata)
+        video_size = metadata["size"]
+
+        # 同じ動画・プロンプト・モデルの完了済みジョブがあれば、Gemini/ffmpeg を使わず、動画もダウンロードせずに結果をコピーする
+        job_result = await manual_service.find_job_result(video_hash, PROMPT_VERSION, gemini_service.model_name)
+        if job_result:
+            await manual_service.apply_job_result(manual_id, job_result)
+            metrics.incr("job_reuse.hits")
+            metrics.incr("job_reuse.steps_reused", job_result.get("step_count", 0))
+            metrics.incr("job_reuse.gemini_calls_avoided", job_result.get("gemini_calls", 0))
+            metrics.incr("job_reuse.seconds_saved", job_result.get("duration_seconds", 0))
+            metrics.incr("job_reuse.video_bytes_skipped", video_size)
+            print(f"Reused analysis result of {job_result.get('source_manual_id')} for {manual_id}")
+            return
+        metrics.incr("job_reuse.misses")
+
+        if REMOTE_FRAME_EXTRACTION and video_url.startswith("gs://"):
+            # 動画はダウンロードしない（Phase 1 は gs:// URI、Phase 2 は必要な範囲だけを読み込む）
+            video_source = video_url
+        else:
+            # 拡張子推定
+            ext = os.path.splitext(blob_name)[1]
+            if not ext:
+                ext = ".mp4"
+                
+            file_id = str(uuid.uuid4())
+            file_path = f"{TEMP_DIR}/{file_id}{ext}"
             
-        file_id = str(uuid.uuid4())
-        file_path = f"{TEMP_DIR}/{file_id}{ext}"
-        
-        print(f"Downloading video from Blob: {blob_name} to {file_path}")
-        
-        from app.repositories.gcs_repository import GCSRepository
-        gcs_repo = GCSRepository()
-        gcs_repo.download_file(blob_name, file_path)
+            print(f"Downloading video from Blob: {blob_name} to {file_path}")
+
+            if PROGRESSIVE_DOWNLOAD and video_url.startswith("gs://"):
+                # ダウンロードはバックグラウンドで進め、Phase 2 の直前に完了を待つ
+                download_task = asyncio.create_task(manual_service.gcs_repository.download_file(blob_name, file_path))
+            else:
+                await manual_service.gcs_repository.download_file(blob_name, file_path)
+            video_source = file_path
         
         # 2. Run Analysis
-        gemini_service = GeminiService()
-        video_service = VideoService()
-        manual_service = ManualService()
-        
+
+        # 全ステップが完了した場合は、解析結果が video_hash をキーに保存される
         await gemini_service.generate_manual_from_video(
-            video_path=file_path,
+            video_path=video_source,
             video_service=video_service,
             manual_id=manual_id,
             manual_service=manual_service,
-            gcs_video_uri=video_url
+            gcs_video_uri=video_url,
+            video_ready=download_task,
+            video_hash=video_hash
         )
-        
-    except Exception as e:
-        print(f"Background Task Error: {e}")
-        # Update status to error
-        try:
-             ManualService().update_manual_status(manual_id, "error")
-        except:
-             print("Failed to update status to error")
+
     finally:
+        # 解析が失敗した場合などは途中のダウンロードを止める
+        if download_task and not download_task.done():
+            download_task.cancel()
+            await asyncio.gather(download_task, return_exceptions=True)
         # Cleanup temp video
+        if video_source:
+            VideoService().release(video_source)
         if file_path and os.path.exists(file_path):
             os.remove(file_path)
 
+async def start_video_analysis(video_url: str, manual_id: str, title: str, background_tasks: BackgroundTasks, manual_service: ManualService, gemini_service: GeminiService, video_path: Optional[str] = None):
+    """
+    ジョブを作成して解析を開始する
+    JOB_QUEUE_ENABLED の場合は永続キューに積み、ワーカープロセス（python -m app.worker）が実行する
+    同じIDのジョブが待機中・実行中の場合は JobAlreadyActiveError
+    """
+    if JOB_QUEUE_ENABLED:
+        # 同じIDのジョブが待機中・実行中の場合は、実行中のジョブのドキュメントを上書きしない
+        # （ドキュメントの作成前にワーカーが取得した場合は、その試行が失敗して再試行される）
+        if not await get_job_queue().enqueue(manual_id, VIDEO_ANALYSIS_JOB, {"video_url": video_url, "manual_id": manual_id, "title": title}):
+            raise JobAlreadyActiveError(f"Analysis of {manual_id} is already queued or running")
+        await manual_service.create_manual_job(manual_id, title, video_path, status="queued")
+    else:
+        await manual_service.create_manual_job(manual_id, title, video_path)
+        # We pass the GCS URL (or blob name) so the background task performs the download
+        background_tasks.add_task(run_video_analysis, video_url, manual_id, title, manual_service, gemini_service)
+
 @router.post("/analyze", status_code=202)
 async def analyze_video(
     request: AnalyzeRequest,
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    manual_service: ManualService = Depends(get_manual_service),
+    gemini_service: GeminiService = Depends(get_gemini_service)
 ):
     # 1. Parse Params
     video_url = request.video_url
@@ -86,13 +176,8 @@ async def analyze_video(
     title = request.title
     
     try:
-        # 2. Initialize Job in Firestore (STATUS: queued)
-        manual_service = ManualService()
-        manual_service.create_manual_job(manual_id, title)
-        
-        # 3. Add to Background Tasks
-        # We pass the GCS URL (or blob name) so the background task performs the download
-        background_tasks.add_task(run_video_analysis, video_url, manual_id, title)
+        # 2. Initialize Job in Firestore (STATUS: queued) & 3. Enqueue
+        await start_video_analysis(video_url, manual_id, title, background_tasks, manual_service, gemini_service)
 
         # 4. Return immediately
         return {
@@ -101,6 +186,8 @@ async def analyze_video(
             "manual_id": manual_id
         }
         
+    except JobAlreadyActiveError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         print(f"Analysis Trigger Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -111,20 +198,39 @@ async def process_video(file: UploadFile = File(...)):
     pass
 
 @router.post("/process-video-stream")
-async def process_video_stream(file: UploadFile = File(...)):
+async def process_video_stream(
+    file: UploadFile = File(...),
+    ordered: bool = False,
+    image_ready: bool = False,
+    max_concurrency: Optional[int] = None,
+    gemini_service: GeminiService = Depends(get_gemini_service),
+    video_service: VideoService = Depends(get_video_service)
+):
+    """
+    動画を解析し、Server-Sent Events で結果を逐次返す。
+
+    - ordered=False (default): 全ステップの抽出・解析を並行実行し、完了した順に update を送る
+    - ordered=True: 従来通り1ステップずつ順番に処理する
+    - image_ready=True: 解析完了前に画像の準備ができた時点で image_ready を送る
+    """
     # 1. Save File
     file_id = str(uuid.uuid4())
     file_path = f"{TEMP_DIR}/{file_id}_{file.filename}"
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    try:
+        # イベントループを止めずにチャンクごとに保存する
+        upload = await save_upload(file, file_path)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    file_path = upload.path
+    print(f"Server: Received {upload.size} bytes (sha256 {upload.sha256[:12]})")
+
+    concurrency = 1 if ordered else (max_concurrency or STREAM_CONCURRENCY)
 
     # 2. Generator Function
     async def event_generator():
+        tasks = []
         try:
-            gemini_service = GeminiService()
-            video_service = VideoService()
-
             # --- Phase 1: Structure Analysis ---
             # Analyze video structure (Timestamps & Titles)
             print("Server: Starting Phase 1 (Structure Analysis)")
@@ -139,51 +245,67 @@ async def process_video_stream(file: UploadFile = File(...)):
             yield f"data: {json.dumps(init_data)}\n\n"
             print("Server: Sent 'init' event.")
 
-            # --- Phase 2 & 3: Loop Processing ---
-            for index, step_structure in enumerate(structures):
+            # --- Phase 2 & 3: Concurrent Processing ---
+            # 各ステップの結果はキューに積まれ、完了した順にクライアントへ送る
+            events: asyncio.Queue = asyncio.Queue()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def process_step(index: int, step_structure):
                 try:
-                    print(f"Server: Processing Step {index+1}/{len(structures)} - {step_structure.title}")
-                    # Extract frames (using existing VideoService)
-                    steps_for_extraction = [step_structure.model_dump()]
-                    steps_with_images = await video_service.extract_frames(file_path, steps_for_extraction, start_index=index)
-                    
-                    if not steps_with_images or not steps_with_images[0].get("image_url"):
-                         print(f"Skipping step {index}: Image extraction failed")
-                         continue
-                         
-                    current_step_data = steps_with_images[0]
-
-                    # Detailed Image Analysis
-                    image_url = current_step_data.get("image_url")
-
-                    # Notify 1 step image ready (send partial update)
-                    print(f"Server: Image ready for Step {index+1}: {image_url}")
-                    # Intermediate update skipped to show skeleton until full analysis
-                    
-                    # Resolve path for Gemini
-                    full_image_path = gemini_service.resolve_image_path(image_url)
-                    
-                    print(f"Server: Analyzing image for Step {index+1}...")
-                    detailed_step = await gemini_service.analyze_single_image(
-                        file_path=full_image_path,
-                        title=step_structure.title,
-                        timestamp=step_structure.timestamp,
-                        image_url=image_url
-                    )
-
-                    if detailed_step:
-                        # Notify 1 step completion
-                        update_data = {
-                            "type": "update",
-                            "index": index,
-                            "step": detailed_step.model_dump()
-                        }
-                        yield f"data: {json.dumps(update_data)}\n\n"
-                        print(f"Server: Sent 'update' event for Step {index+1}")
-                    
+                    async with semaphore:
+                        print(f"Server: Processing Step {index+1}/{len(structures)} - {step_structure.title}")
+                        # Extract frames (using existing VideoService)
+                        steps_for_extraction = [step_structure.model_dump()]
+                        steps_with_images = await video_service.extract_frames(file_path, steps_for_extraction, start_index=index)
+
+                        if not steps_with_images or not steps_with_images[0].get("image_url"):
+                             print(f"Skipping step {index}: Image extraction failed")
+                             return
+
+                        # Detailed Image Analysis
+                        image_url = steps_with_images[0].get("image_url")
+
+                        print(f"Server: Image ready for Step {index+1}: {image_url}")
+                        if image_ready:
+                            # Notify 1 step image ready (send partial update)
+                            await events.put({"type": "image_ready", "index": index, "image_url": image_url})
+
+                        # Resolve path for Gemini
+                        full_image_path = gemini_service.resolve_image_path(image_url)
+
+                        print(f"Server: Analyzing image for Step {index+1}...")
+                        detailed_step = await gemini_service.analyze_single_image(
+                            file_path=full_image_path,
+                            title=step_structure.title,
+                            timestamp=step_structure.timestamp,
+                            image_url=image_url
+                        )
+
+                        if detailed_step:
+                            # Notify 1 step completion
+                            await events.put({
+                                "type": "update",
+                                "index": index,
+                                "step": detailed_step.model_dump()
+                            })
                 except Exception as step_err:
                     print(f"Error processing step {index}: {step_err}")
+                finally:
+                    await events.put(None) # このステップの終了通知
+
+            tasks = [
+                asyncio.create_task(process_step(index, step_structure))
+                for index, step_structure in enumerate(structures)
+            ]
+
+            remaining = len(tasks)
+            while remaining:
+                event = await events.get()
+                if event is None:
+                    remaining -= 1
                     continue
+                yield f"data: {json.dumps(event)}\n\n"
+                print(f"Server: Sent '{event['type']}' event for Step {event['index']+1}")
 
             # --- Complete ---
             yield f"data: {json.dumps({'type': 'complete'})}\n\n"
@@ -193,11 +315,17 @@ async def process_video_stream(file: UploadFile = File(...)):
             error_data = {"type": "error", "message": str(e)}
             yield f"data: {json.dumps(error_data)}\n\n"
         finally:
+            # クライアント切断時などに残っているステップ処理を止める
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
             # Cleanup
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except Exception as cleanup_err:
-                    print(f"Cleanup Error: {cleanup_err}")
+            video_service.release(file_path)
+            try:
+                upload.remove()
+            except Exception as cleanup_err:
+                print(f"Cleanup Error: {cleanup_err}")
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
@@ -0,0 +1,153 @@
+# 画像解析結果（StepDetail）のキャッシュ
+# キーは 画像バイト列のハッシュ + ステップタイトル + プロンプトバージョン + モデル名 + temperature
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from app.services.metrics import metrics
+
+# メモリ上に保持する最大バイト数（JSONシリアライズ後のサイズで計算）
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# 指定するとディスクにも保存し、再起動後も利用する
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR")
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "1") == "1"
+
+
+class AnalysisCache:
+    def __init__(self, max_bytes: int = ANALYSIS_CACHE_MAX_BYTES, disk_dir: Optional[str] = ANALYSIS_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_data: bytes, title: str, prompt_version: str, model_name: str, temperature: float) -> str:
+        """
+        解析結果を一意に決める要素からキャッシュキーを作る
+        """
+        digest = hashlib.sha256()
+        digest.update(hashlib.sha256(image_data).digest())
+        for part in (title, prompt_version, model_name, repr(float(temperature))):
+            digest.update(b"\0")
+            digest.update(part.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        メモリ → ディスクの順に探す（ディスクで見つかった場合はメモリに載せる）
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.incr("analysis_cache.hits")
+                return json.loads(data)
+
+        data = self._read_disk(key)
+        if data is not None:
+            self._store_memory(key, data)
+            with self._lock:
+                self.hits += 1
+                self.disk_hits += 1
+            metrics.incr("analysis_cache.hits")
+            metrics.incr("analysis_cache.disk_hits")
+            return json.loads(data)
+
+        with self._lock:
+            self.misses += 1
+        metrics.incr("analysis_cache.misses")
+        return None
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self._store_memory(key, data)
+        self._write_disk(key, data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+                "max_bytes": self.max_bytes,
+                "disk_dir": self.disk_dir
+            }
+
+    def _store_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old)
+            self._entries[key] = data
+            self._memory_bytes += len(data)
+            # サイズ上限を超えたら古いものから捨てる
+            while self._memory_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                self.evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Analysis cache read error: {e}")
+            return None
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 書き込み途中のファイルを読まないように一時ファイルから置き換える
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Analysis cache write error: {e}")
+
+
+_analysis_cache: Optional[AnalysisCache] = None
+_analysis_cache_lock = threading.Lock()
+
+
+def get_analysis_cache() -> Optional[AnalysisCache]:
+    """
+    プロセス共通のキャッシュを取得する（無効化されている場合は None）
+    """
+    global _analysis_cache
+    if not ANALYSIS_CACHE_ENABLED:
+        return None
+    with _analysis_cache_lock:
+        if _analysis_cache is None:
+            _analysis_cache = AnalysisCache()
+        return _analysis_cache
@@ -0,0 +1,220 @@
+# Gemini 呼び出しのリトライ・ヘッジ
+# - 一時的なエラー（429/5xx・タイムアウト・接続エラー）はジッター付き指数バックオフで再送する
+# - レスポンスをスキーマに変換できない場合も GEMINI_PARSE_RETRIES 回まで再送する
+# - GEMINI_HEDGE_ENABLED=1 の場合、呼び出しが過去のレイテンシの GEMINI_HEDGE_PERCENTILE を超えたら
+#   同じリクエストをもう1本送り、先に返ってきた方を使う
+# リトライ・ヘッジの回数はジョブ単位（contextvar）でも集計する
+import os
+import time
+import asyncio
+import contextvars
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential, RetryCallState
+
+from app.services.metrics import metrics
+
+# 一時的なエラーの最大リトライ回数
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+# レスポンスの変換に失敗した場合の最大リトライ回数
+GEMINI_PARSE_RETRIES = int(os.getenv("GEMINI_PARSE_RETRIES", "2"))
+# バックオフ（秒）: 0〜min(GEMINI_RETRY_MAX, GEMINI_RETRY_BASE * 2^n) のランダムな時間待つ
+GEMINI_RETRY_BASE = float(os.getenv("GEMINI_RETRY_BASE", "1.0"))
+GEMINI_RETRY_MAX = float(os.getenv("GEMINI_RETRY_MAX", "30"))
+# ヘッジ（遅い呼び出しの重複送信）
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "0") == "1"
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95"))
+# ヘッジの判断に使うレイテンシのサンプル数（これより少ない間はヘッジしない）
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+
+# 一時的とみなすHTTPステータス
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+
+class ResponseParseError(Exception):
+    """レスポンスが期待するスキーマに変換できない（再送で直る可能性がある）"""
+
+
+def is_transient_error(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    code = getattr(error, "code", None)
+    if code is None:
+        response = getattr(error, "response", None)
+        code = getattr(response, "status_code", None)
+    return code in TRANSIENT_STATUS_CODES
+
+
+class CallStats:
+    """
+    1ジョブ分の呼び出しの集計
+    """
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.parse_retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+_job_call_stats: contextvars.ContextVar[Optional[CallStats]] = contextvars.ContextVar("job_call_stats", default=None)
+
+
+def start_call_tracking() -> CallStats:
+    """
+    現在のタスク（と、ここから作られる子タスク）の呼び出しを集計し始める
+    """
+    stats = CallStats()
+    _job_call_stats.set(stats)
+    return stats
+
+
+def current_call_stats() -> Optional[CallStats]:
+    """
+    現在のタスクで集計中の呼び出し（start_call_tracking 以降）
+    """
+    return _job_call_stats.get()
+
+
+def _count(name: str, value: int = 1):
+    metrics.incr(f"gemini_calls.{name}", value)
+    stats = _job_call_stats.get()
+    if stats is not None:
+        setattr(stats, name, getattr(stats, name) + value)
+
+
+class LatencyTracker:
+    """
+    呼び出し種別ごとの直近のレイテンシ
+    """
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._samples: Dict[str, deque] = {}
+
+    def record(self, kind: str, seconds: float):
+        self._samples.setdefault(kind, deque(maxlen=self.size)).append(seconds)
+
+    def percentile(self, kind: str, percentile: float, min_samples: int = GEMINI_HEDGE_MIN_SAMPLES) -> Optional[float]:
+        samples = self._samples.get(kind)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+
+class CallPolicy:
+    def __init__(
+        self,
+        max_retries: int = GEMINI_MAX_RETRIES,
+        parse_retries: int = GEMINI_PARSE_RETRIES,
+        retry_base: float = GEMINI_RETRY_BASE,
+        retry_max: float = GEMINI_RETRY_MAX,
+        hedge: bool = GEMINI_HEDGE_ENABLED,
+        hedge_percentile: float = GEMINI_HEDGE_PERCENTILE
+    ):
+        self.max_retries = max_retries
+        self.parse_retries = parse_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker()
+
+    async def call(self, kind: str, attempt: Callable[[], Awaitable[T]], can_hedge: Optional[Callable[[], bool]] = None, parse_retries: Optional[int] = None) -> T:
+        """
+        attempt を実行し、一時的なエラー・変換エラーの場合は再送する
+        attempt は毎回新しいリクエストを送る関数（レスポンスの変換まで行い、失敗時は ResponseParseError を送出する）
+        can_hedge: ヘッジしてよいか（レート制限に余裕がない場合などは False を返す）
+        parse_retries: 変換エラーの最大リトライ回数（省略時は self.parse_retries）
+        """
+        failures = {"transient": 0, "parse": 0}
+        if parse_retries is None:
+            parse_retries = self.parse_retries
+
+        def should_retry(error: BaseException) -> bool:
+            if isinstance(error, ResponseParseError):
+                failures["parse"] += 1
+                return failures["parse"] <= parse_retries
+            if is_transient_error(error):
+                failures["transient"] += 1
+                return failures["transient"] <= self.max_retries
+            return False
+
+        def before_sleep(retry_state: RetryCallState):
+            error = retry_state.outcome.exception()
+            _count("parse_retries" if isinstance(error, ResponseParseError) else "retries")
+            print(f"Retrying {kind} in {retry_state.next_action.sleep:.1f}s after: {error}")
+
+        _count("calls")
+        retrying = AsyncRetrying(
+            retry=retry_if_exception(should_retry),
+            wait=wait_random_exponential(multiplier=self.retry_base, max=self.retry_max),
+            stop=stop_after_attempt(self.max_retries + parse_retries + 1),
+            before_sleep=before_sleep,
+            reraise=True
+        )
+        try:
+            return await retrying(self._attempt, kind, attempt, can_hedge)
+        except BaseException as e:
+            if not isinstance(e, asyncio.CancelledError):
+                _count("failures")
+            raise
+
+    async def _attempt(self, kind: str, attempt: Callable[[], Awaitable[T]], can_hedge: Optional[Callable[[], bool]]) -> T:
+        start_time = time.monotonic()
+        delay = self.latencies.percentile(kind, self.hedge_percentile) if self.hedge else None
+        if delay is None:
+            result = await attempt()
+        else:
+            result = await self._hedged(kind, attempt, delay, can_hedge)
+        self.latencies.record(kind, time.monotonic() - start_time)
+        return result
+
+    async def _hedged(self, kind: str, attempt: Callable[[], Awaitable[T]], delay: float, can_hedge: Optional[Callable[[], bool]]) -> T:
+        primary = asyncio.create_task(attempt())
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and (can_hedge is None or can_hedge()):
+                # 遅い呼び出しの重複を送り、先に成功した方を使う
+                _count("hedges")
+                tasks.append(asyncio.create_task(attempt()))
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            _count("hedge_wins")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+_call_policy: Optional[CallPolicy] = None
+
+
+def get_call_policy() -> CallPolicy:
+    """
+    プロセス共通の呼び出しポリシーを取得する（レイテンシの履歴を共有する）
+    """
+    global _call_policy
+    if _call_policy is None:
+        _call_policy = CallPolicy()
+    return _call_policy
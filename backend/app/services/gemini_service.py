@@ -1,12 +1,28 @@
 from google import genai
 from google.genai import types
 import os
+import io
+import copy
 from pathlib import Path
 import asyncio
+import uuid
+import shutil
+import tempfile
+import resource
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from PIL import Image, ImageDraw, ImageFont
+from typing import Any, Awaitable, Callable, List, Optional
 from dotenv import load_dotenv
-from app.services.prompts import VIDEO_ANALYSIS_PROMPT, IMAGE_ANALYSIS_PROMPT
+from app.services.prompts import (
+    VIDEO_ANALYSIS_PROMPT, IMAGE_ANALYSIS_PROMPT, BATCH_IMAGE_ANALYSIS_PROMPT, KEYFRAME_STRUCTURE_PROMPT,
+    KEYFRAME_LAYOUT, STRIP_LAYOUT, PROMPT_VERSION
+)
+from app.services.analysis_cache import AnalysisCache, get_analysis_cache
+from app.services.metrics import metrics
+from app.services.rate_limiter import RateLimiter, get_rate_limiter
+from app.services.call_policy import CallPolicy, ResponseParseError, current_call_stats, get_call_policy, start_call_tracking
+from app.repositories.clients import get_client_registry
+from app.repositories.gcs_repository import AsyncGCSRepository
 import time
 import logging
 
@@ -26,8 +42,98 @@ console_handler = logging.StreamHandler()
 console_handler.setFormatter(logging.Formatter('%(message)s'))
 logger.addHandler(console_handler)
 
+# Phase 3 で同時に処理するステップ数
+PHASE3_CONCURRENCY = int(os.getenv("PHASE3_CONCURRENCY", "4"))
+# Phase 3 で1回のリクエストにまとめる画像の枚数（1 の場合は1枚ずつ解析する）
+IMAGE_BATCH_SIZE = int(os.getenv("IMAGE_BATCH_SIZE", "1"))
+# Phase 3 で Gemini に送る画像の長辺の最大ピクセル数と JPEG 品質（0 の場合は縮小しない）
+# GCS には元の画像をそのまま保存する
+ANALYSIS_MAX_DIM = int(os.getenv("ANALYSIS_MAX_DIM", "1280"))
+ANALYSIS_JPEG_QUALITY = int(os.getenv("ANALYSIS_JPEG_QUALITY", "85"))
+
+# Phase 1 で動画をリクエストに直接埋め込む（inline）最大サイズ
+# これを超えるローカル動画はGCSに一時アップロードし、URIで参照させる（メモリ使用量を動画サイズに依存させない）
+INLINE_VIDEO_MAX_BYTES = int(os.getenv("INLINE_VIDEO_MAX_BYTES", str(20 * 1024 * 1024)))
+# 一時アップロード先のプレフィックス（バケットのライフサイクルルールで削除する想定。解析後にも削除する）
+VIDEO_STAGING_PREFIX = os.getenv("VIDEO_STAGING_PREFIX", "tmp/phase1")
+# プロキシ動画（PHASE1_PROXY）で Phase 1 を行う場合の media_resolution（low / medium / high、空なら指定しない）
+# 解像度を下げた動画でも、これを下げないと1フレームあたりのトークン数は変わらない
+PROXY_MEDIA_RESOLUTION = os.getenv("PROXY_MEDIA_RESOLUTION", "low")
+# Phase 1 の入力
+#   video:     動画全体を渡す
+#   keyframes: ローカルで検出した画面の切り替わりごとのフレーム（VideoService.detect_scenes）を1枚ずつ渡す
+#   strip:     同じフレームを STRIP_COLUMNS x STRIP_ROWS 枚ずつ1枚の画像に並べて渡す
+# keyframes / strip は候補が見つからない・失敗した場合に video に戻す
+PHASE1_MODE = os.getenv("PHASE1_MODE", "video")
+# keyframes で渡す画像の長辺
+KEYFRAME_MAX_DIM = int(os.getenv("KEYFRAME_MAX_DIM", "768"))
+STRIP_COLUMNS = int(os.getenv("STRIP_COLUMNS", "4"))
+STRIP_ROWS = int(os.getenv("STRIP_ROWS", "4"))
+# strip の1コマの幅
+STRIP_TILE_WIDTH = int(os.getenv("STRIP_TILE_WIDTH", "480"))
+
+def downscale_for_analysis(image_data: bytes, max_dim: int = ANALYSIS_MAX_DIM, quality: int = ANALYSIS_JPEG_QUALITY) -> bytes:
+    """
+    縦横比を保ったまま長辺を max_dim 以下に縮小し、quality で再エンコードした JPEG を返す
+    （元より大きくなる場合・読み込めない場合は元のバイト列を返す）
+    highlight_box / mask_boxes は画像サイズに対して 0-1000 で正規化された座標のため、縮小しても変換は不要
+    """
+    if max_dim <= 0:
+        return image_data
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            # JPEG は縮小しながらデコードする（フル解像度の展開を省く）
+            image.draft("RGB", (max_dim, max_dim))
+            image = image.convert("RGB")
+            image.thumbnail((max_dim, max_dim), Image.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=quality)
+    except Exception as e:
+        print(f"Failed to downscale image for analysis: {e}")
+        return image_data
+    downscaled = output.getvalue()
+    return downscaled if len(downscaled) < len(image_data) else image_data
+
+def build_contact_sheets(images: List[bytes], labels: List[str], columns: int = STRIP_COLUMNS, rows: int = STRIP_ROWS, tile_width: int = STRIP_TILE_WIDTH) -> List[bytes]:
+    """
+    画像を columns x rows 枚ずつ1枚に並べ、各コマの左上にラベルを描いた JPEG のリストを返す
+    """
+    per_sheet = max(columns * rows, 1)
+    font = ImageFont.load_default(size=max(tile_width // 20, 10))
+    sheets = []
+    for offset in range(0, len(images), per_sheet):
+        tiles = []
+        for image_data, label in zip(images[offset:offset + per_sheet], labels[offset:offset + per_sheet]):
+            with Image.open(io.BytesIO(image_data)) as image:
+                image.draft("RGB", (tile_width, tile_width))
+                tile = image.convert("RGB")
+            tile.thumbnail((tile_width, tile_width), Image.LANCZOS)
+            tiles.append((tile, label))
+
+        tile_height = max(tile.height for tile, _ in tiles)
+        sheet_columns = min(columns, len(tiles))
+        sheet_rows = (len(tiles) + sheet_columns - 1) // sheet_columns
+        sheet = Image.new("RGB", (sheet_columns * tile_width, sheet_rows * tile_height), "white")
+        draw = ImageDraw.Draw(sheet)
+        for position, (tile, label) in enumerate(tiles):
+            x, y = (position % sheet_columns) * tile_width, (position // sheet_columns) * tile_height
+            sheet.paste(tile, (x, y))
+            box = draw.textbbox((x, y), label, font=font)
+            draw.rectangle((box[0], box[1], box[2] + 8, box[3] + 8), fill="black")
+            draw.text((x + 4, y + 4), label, fill="yellow", font=font)
+            draw.rectangle((x, y, x + tile_width - 1, y + tile_height - 1), outline="gray")
+
+        output = io.BytesIO()
+        sheet.save(output, format="JPEG", quality=ANALYSIS_JPEG_QUALITY)
+        sheets.append(output.getvalue())
+    return sheets
+
 # --- Pydantic Models ---
 
+class AnalysisFailedError(Exception):
+    """解析を続けられない（Phase 1 でステップが見つからない、Phase 2 で画像を抽出できない）"""
+
+
 class BoundingBox(BaseModel):
     ymin: int
     xmin: int
@@ -38,6 +144,10 @@ class StepStructure(BaseModel):
     timestamp: str = Field(description="MM:SS format, chosen for the cleanest screenshot")
     title: str = Field(description="Short title of the action")
 
+class KeyframeStep(BaseModel):
+    candidate: int = Field(description="Number of the candidate frame used as the screenshot")
+    title: str = Field(description="Short title of the action")
+
 class MaskItem(BaseModel):
     label: str
     box: BoundingBox
@@ -47,6 +157,9 @@ class StepDetail(BaseModel):
     highlight_box: BoundingBox = Field(description="The UI element being interacted with")
     mask_boxes: List[MaskItem] = Field(description="List of PII areas to mask")
 
+class BatchStepDetail(StepDetail):
+    index: int = Field(description="0-based index of the image this result belongs to")
+
 class ManualStep(BaseModel):
     timestamp: str
     title: str
@@ -58,39 +171,101 @@ class ManualStep(BaseModel):
 # --- Service ---
 
 class GeminiService:
-    def __init__(self):
+    def __init__(self, client: Optional[genai.Client] = None, staging_repository: Optional[AsyncGCSRepository] = None, rate_limiter: Optional[RateLimiter] = None, call_policy: Optional[CallPolicy] = None):
         project_id = os.getenv("PROJECT_ID")
-        location = os.getenv("LOCATION", "us-central1")
         
         if not project_id:
             raise ValueError("PROJECT_ID not set in environment variables")
             
-        self.client = genai.Client(
-            vertexai=True,
-            project=project_id,
-            location=location
-        )
+        # 省略時はアプリケーション共有のクライアントを使う
+        self.client = client or get_client_registry().genai
         
         self.model_name = os.getenv("MODEL_NAME", "gemini-3-flash-preview")
         self.temperature = 1.0 if self.model_name == "gemini-3-flash-preview" else 0.0
-
-    async def generate_manual_from_video(self, video_path: str, video_service, manual_id: str, manual_service, gcs_video_uri: Optional[str] = None) -> List[ManualStep]:
+        self.phase3_concurrency = PHASE3_CONCURRENCY
+        self.image_batch_size = max(IMAGE_BATCH_SIZE, 1)
+        self.analysis_max_dim = ANALYSIS_MAX_DIM
+        self.phase1_mode = PHASE1_MODE
+        self.analysis_jpeg_quality = ANALYSIS_JPEG_QUALITY
+        self.analysis_cache = get_analysis_cache()
+        # 大きな動画の一時アップロード先（初回利用時に共有クライアントから作る）
+        self._staging_repository = staging_repository
+        # モデル呼び出しはすべてプロセス共通のレートリミッターを通す
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        # 一時的なエラー・変換エラーのリトライとヘッジ
+        self.call_policy = call_policy or get_call_policy()
+
+    async def generate_manual_from_video(self, video_path: str, video_service, manual_id: str, manual_service, gcs_video_uri: Optional[str] = None, max_concurrency: Optional[int] = None, use_cache: bool = True, video_ready: Optional[Awaitable] = None, video_hash: Optional[str] = None) -> List[ManualStep]:
         """
         Main pipeline with Incremental Firestore Updates:
             1. Analyze video structure -> Update Firestore (Phase 1)
             2. Extract images
-            3. Analyze images -> Update Firestore per step (Phase 3)
+            3. Upload & analyze images concurrently (up to max_concurrency steps)
+               -> Update Firestore in step order (Phase 3)
+        use_cache=False で画像解析キャッシュを使わずに再解析する。
+        video_ready: video_path のダウンロード中の場合に渡す（Phase 1 は gcs_video_uri で先に進め、Phase 2 の前に待つ）
+        video_hash: 動画の内容のハッシュ（Phase 1 用プロキシのキャッシュキー、全ステップ完了時の解析結果の保存キー）
+        Phase 1 / Phase 2 で何も得られなかった場合は AnalysisFailedError を送出する（ステータスは呼び出し元が更新する）
         """
+        # このジョブ内の Gemini 呼び出しのリトライ・ヘッジ回数を集計する
+        call_stats = start_call_tracking()
+        start_time = time.time()
+        try:
+            return await self._generate_manual_from_video(video_path, video_service, manual_id, manual_service, gcs_video_uri, max_concurrency, use_cache, video_ready, video_hash)
+        finally:
+            duration = time.time() - start_time
+            metrics.observe("job.duration_seconds", duration)
+            metrics.observe("job.gemini_retries", call_stats.retries + call_stats.parse_retries)
+            metrics.observe("job.gemini_hedges", call_stats.hedges)
+            logger.info(f"JOB: {manual_id} Duration: {duration:.4f}s, Gemini calls: {call_stats.to_dict()}")
+
+    async def _generate_manual_from_video(self, video_path: str, video_service, manual_id: str, manual_service, gcs_video_uri: Optional[str], max_concurrency: Optional[int], use_cache: bool, video_ready: Optional[Awaitable], video_hash: Optional[str]) -> List[ManualStep]:
         print(f"Starting analysis for: {gcs_video_uri if gcs_video_uri else video_path}")
+        start_time = time.time()
 
         # Phase 1: Video Structure
         print("Phase 1: Analyzing video structure...")
-        structures = await self.analyze_video_structure(gcs_video_uri if gcs_video_uri else video_path)
+        phase1_source = gcs_video_uri if gcs_video_uri else video_path
+        media_resolution = None
+        structures = None
+        use_proxy = getattr(video_service, "phase1_proxy", False)
+        use_keyframes = self.phase1_mode in ("keyframes", "strip")
+        # プロキシだけの場合、gs:// の動画はダウンロードせずに Gemini に直接読ませる
+        if use_keyframes or (use_proxy and not video_path.startswith("gs://")):
+            # ローカルの動画が必要（ダウンロード中の場合は完了を待つ）
+            try:
+                if video_ready is not None:
+                    video_ready = asyncio.ensure_future(video_ready)
+                    await asyncio.shield(video_ready)
+                local_source = video_path
+                if video_path.startswith("gs://"):
+                    # 範囲読み込み（REMOTE_FRAME_EXTRACTION）の場合も、シーン検出は全フレームを読むため全体をダウンロードする
+                    # （Phase 2 もこのファイルから抽出する）
+                    print(f"Downloading {video_path} for {self.phase1_mode} Phase 1")
+                    local_source = await video_service.download_remote(video_path)
+                if use_proxy:
+                    # 低解像度のプロキシで Phase 1 を行う
+                    try:
+                        local_source = await video_service.make_proxy(local_source, video_hash)
+                        phase1_source = local_source
+                        media_resolution = PROXY_MEDIA_RESOLUTION or None
+                    except Exception as e:
+                        # 作れない場合は元の動画で続ける
+                        metrics.incr("proxy.failures")
+                        print(f"Failed to create Phase 1 proxy, using the original video: {e}")
+                if use_keyframes:
+                    structures = await self.analyze_keyframe_structure(local_source, video_service, self.phase1_mode)
+            except Exception as e:
+                metrics.incr("phase1.preprocessing_failures")
+                print(f"Local Phase 1 preprocessing failed: {e}")
+            if use_keyframes and not structures:
+                metrics.incr("phase1.keyframe_fallbacks")
+                print("Keyframe analysis found no steps, analyzing the whole video")
         if not structures:
-            print("Phase 1 failed: No structure found.")
-            # エラー状態更新などが必要だが、一旦終了
-            manual_service.update_manual_status(manual_id, "error")
-            return []
+            structures = await self.analyze_video_structure(phase1_source, media_resolution=media_resolution)
+        if not structures:
+            # ステータスは呼び出し元が更新する（ワーカーはリトライするか error にする）
+            raise AnalysisFailedError("Phase 1 failed: No structure found.")
         
         print(f"Phase 1 complete. Found {len(structures)} steps.")
 
@@ -107,152 +282,479 @@ class GeminiService:
                 "image_url": None
             })
         
-        manual_service.init_manual_steps(manual_id, current_steps)
+        await manual_service.init_manual_steps(manual_id, current_steps)
 
         # Phase 2: Image Extraction
-        manual_service.update_manual_status(manual_id, "extracting_images")
+        await manual_service.update_manual_status(manual_id, "extracting_images")
+
+        if video_ready is not None:
+            await video_ready
         
         steps_for_extraction = [s.model_dump() for s in structures]
         print("Phase 2: Extracting images...")
         
-        # 注意: GCSの動画パスを渡す必要があるが、video_serviceはローカルファイルを期待している。
-        # 現在のvideo_pathはローカルの一時ファイルパスのはずなのでOK。
+        # video_path はローカルの一時ファイルか gs:// URI（必要な範囲だけを読み込んで抽出する）
         steps_with_images = await video_service.extract_frames(video_path, steps_for_extraction)
         
         # Verify images were extracted
-        valid_steps = [s for s in steps_with_images if s.get("image_url")]
+        # インデックスは Phase 1 のステップ番号（current_steps の位置）を保持する
+        valid_steps = [(i, s) for i, s in enumerate(steps_with_images) if s.get("image_url")]
         
         if not valid_steps:
-             print("Phase 2 failed: No images extracted.")
-             manual_service.update_manual_status(manual_id, "error")
-             return []
+            raise AnalysisFailedError("Phase 2 failed: No images extracted.")
 
         print(f"Phase 2 complete. Extracted {len(valid_steps)} images.")
         
         # GCSへの画像アップロードが必要
         # extract_frames は /static/... を返すが、これをGCSに上げてURL更新する必要がある。
-        # ManualService.save_manual のロジックの一部を再利用したいが、
-        # ここでは簡易的に「ここでアップロード」してしまう。
-        # または、今回はFrontendから直接GCS参照できない（Privateバケットなら）が、
-        # Publicバケット前提か、もしくは「詳細解析」のループ内で順次アップロード＆更新を行う。
+        # 「詳細解析」のパイプライン内でステップごとにアップロード＆更新を行う。
         
-        # GCS Repository for image upload
-        from app.repositories.gcs_repository import GCSRepository
-        gcs_repo = GCSRepository()
+        # GCS Repository for image upload (ManualService と同じ共有クライアントを使う)
+        gcs_repo = manual_service.gcs_repository
+
+        # ほぼ同じ画面のフレームは代表の1枚だけをアップロード・解析し、結果を各ステップに配る
+        analysis_steps, duplicates_of = await self._dedup_steps(valid_steps, video_service)
+        dedup_ratio = 1 - len(analysis_steps) / len(valid_steps)
+        metrics.observe("job.dedup_ratio", dedup_ratio)
+        metrics.incr("phase3.dedup_skipped", len(valid_steps) - len(analysis_steps))
+        print(f"Phase 3: {len(analysis_steps)} unique frames for {len(valid_steps)} steps (dedup ratio {dedup_ratio:.0%})")
+        analysis_stats = {
+            "steps": len(valid_steps),
+            "unique_frames": len(analysis_steps),
+            "dedup_ratio": round(dedup_ratio, 3)
+        }
         
-        # Phase 3: Image Analysis Loop & Incremental Update
-        manual_service.update_manual_status(manual_id, "analyzing_details")
-        print("Phase 3: Analyzing images sequentially for real-time updates...")
-        
-        final_steps = []
-        # current_steps (スケルトン) をベースに更新していく
-        
-        for i, step_data in enumerate(valid_steps):
-            image_url = step_data.get("image_url")
-            title = step_data.get("title")
-            timestamp = step_data.get("timestamp")
-
-            # 1. 画像アップロード (Local -> GCS)
-            # ローカルパス解決
-            local_file_path = self.resolve_image_path(image_url)
-            public_image_url = image_url 
-            
+        # Phase 3: Image Analysis Pipeline & Incremental Update
+        await manual_service.update_manual_status(manual_id, "analyzing_details")
+        concurrency = max_concurrency or self.phase3_concurrency
+        print(f"Phase 3: Analyzing images with concurrency {concurrency}...")
+
+        semaphore = asyncio.Semaphore(concurrency)
+        commit_lock = asyncio.Lock()
+        finished = {} # 完了したがまだFirestoreに反映していないステップ
+        pending_indices = [i for i, _ in valid_steps]
+
+        async def commit(step_index: int, step_dict: Optional[dict]):
+            """
+            完了したステップを、先行ステップが全て終わった順にFirestoreへ反映する
+            """
+            async with commit_lock:
+                finished[step_index] = step_dict
+                changed = False
+                while pending_indices and pending_indices[0] in finished:
+                    index = pending_indices.pop(0)
+                    result = finished.pop(index)
+                    if result:
+                        current_steps[index] = result
+                        changed = True
+
+                if changed:
+                    # [Firestore Update] 先頭から連続して完了したステップを反映
+                    await manual_service.update_manual_steps(manual_id, list(current_steps))
+
+        async def commit_group(step_index: int, step_dict: Optional[dict]):
+            """
+            代表のステップと、同じ画面のステップ（タイトル・タイムスタンプだけ差し替える）を反映する
+            """
+            await commit(step_index, step_dict)
+            for member_index, member_data in duplicates_of.get(step_index, []):
+                member_dict = None
+                if step_dict:
+                    member_dict = copy.deepcopy(step_dict)
+                    member_dict["title"] = member_data.get("title")
+                    member_dict["timestamp"] = member_data.get("timestamp")
+                await commit(member_index, member_dict)
+
+        async def run_step(step_index: int, step_data: dict):
+            step_dict = None
             try:
-                if os.path.exists(local_file_path):
-                    filename = os.path.basename(local_file_path)
-                    # manuals/{id}/images/step_X.jpg
-                    gcs_dest_path = f"manuals/{manual_id}/images/{filename}"
-                    
-                    public_image_url = await asyncio.to_thread(
-                        gcs_repo.upload_file,
-                        local_file_path,
-                        gcs_dest_path
-                    )
-                    print(f"Uploaded image to: {public_image_url}")
+                async with semaphore:
+                    step_dict = await self._process_step(step_index, step_data, manual_id, gcs_repo, use_cache)
             except Exception as e:
-                print(f"Image upload failed for step {i}: {e}")
+                # 1ステップの失敗で他のステップを止めない
+                print(f"Phase 3 failed for step {step_index}: {e}")
+            await commit_group(step_index, step_dict)
 
-            # 2. 詳細解析
-            analyzed_step = await self.analyze_single_image(local_file_path, title, timestamp, public_image_url)
-            
-            if analyzed_step:
-                # 3. リスト更新
-                step_dict = analyzed_step.model_dump()
-                
-                # uploadによりURLが変わったので反映
-                step_dict["image_url"] = public_image_url
-                
-                # 既存のリストを置換
-                if i < len(current_steps):
-                    current_steps[i] = step_dict
-                else:
-                    current_steps.append(step_dict)
-                
-                # [Firestore Update] 1ステップごとに更新
-                manual_service.update_manual_steps(manual_id, current_steps)
-
-            # 4. Cleanup local image
+        async def run_batch(batch: List[tuple]):
+            step_dicts = [None] * len(batch)
+            try:
+                async with semaphore:
+                    step_dicts = await self._process_batch(batch, manual_id, gcs_repo, use_cache)
+            except Exception as e:
+                print(f"Phase 3 failed for steps {[i for i, _ in batch]}: {e}")
+            for (step_index, _), step_dict in zip(batch, step_dicts):
+                await commit_group(step_index, step_dict)
+
+        batch_size = self.image_batch_size
+        if batch_size > 1:
+            # K 枚ずつ1回のリクエストで解析する（semaphore はバッチ単位）
+            batches = [analysis_steps[i:i + batch_size] for i in range(0, len(analysis_steps), batch_size)]
+            await asyncio.gather(*(run_batch(batch) for batch in batches))
+        else:
+            await asyncio.gather(*(run_step(i, step_data) for i, step_data in analysis_steps))
+        
+        print("Phase 3 complete.")
+        await manual_service.complete_manual_job(manual_id, current_steps, analysis_stats=analysis_stats)
+        if video_hash:
+            await self._record_job_result(manual_service, video_hash, manual_id, current_steps, time.time() - start_time)
+        return [ManualStep(**s) for s in current_steps if s.get("highlight_box")]
+
+    async def _record_job_result(self, manual_service, video_hash: str, manual_id: str, steps: List[dict], duration: float):
+        """
+        同じ動画の再解析で再利用できるように結果を保存する
+        一部のステップが失敗した結果は保存しない（再利用すると欠けた手順書が使われ続けるため）
+        """
+        if not steps or not all(s.get("highlight_box") for s in steps):
+            print(f"Not recording job result for {manual_id}: some steps did not complete")
+            return
+        call_stats = current_call_stats()
+        # リトライ・ヘッジを含めた実際のリクエスト数
+        gemini_calls = call_stats.calls + call_stats.retries + call_stats.parse_retries + call_stats.hedges if call_stats else 0
+        try:
+            await manual_service.record_job_result(video_hash, PROMPT_VERSION, self.model_name, manual_id, steps, duration, gemini_calls)
+        except Exception as e:
+            print(f"Failed to record job result: {e}")
+
+    async def _dedup_steps(self, valid_steps: List[tuple], video_service) -> tuple:
+        """
+        抽出したフレームを知覚ハッシュでまとめる
+        returns: (解析する代表のステップ, {代表のステップ番号: [(同じ画面のステップ番号, ステップ)]})
+        """
+        if not getattr(video_service, "frame_dedup", False) or len(valid_steps) < 2:
+            return valid_steps, {}
+
+        paths = [self.resolve_image_path(step_data.get("image_url")) for _, step_data in valid_steps]
+        try:
+            representatives = await video_service.group_duplicate_frames(paths)
+        except Exception as e:
+            print(f"Frame dedup failed, analyzing every step: {e}")
+            return valid_steps, {}
+
+        analysis_steps = []
+        duplicates_of = {}
+        for position, ((step_index, step_data), representative) in enumerate(zip(valid_steps, representatives)):
+            if representative == position:
+                analysis_steps.append((step_index, step_data))
+                continue
+            duplicates_of.setdefault(valid_steps[representative][0], []).append((step_index, step_data))
+            # 代表の画像を使うため、重複したフレームはここで削除する
+            try:
+                os.remove(paths[position])
+            except OSError as e:
+                print(f"Failed to delete local image {paths[position]}: {e}")
+        return analysis_steps, duplicates_of
+
+    async def _process_step(self, step_index: int, step_data: dict, manual_id: str, gcs_repo, use_cache: bool = True) -> Optional[dict]:
+        """
+        Phase 3 の1ステップ分: 画像アップロードと詳細解析を並行して行う
+        """
+        image_url = step_data.get("image_url")
+        title = step_data.get("title")
+        timestamp = step_data.get("timestamp")
+
+        # ローカルパス解決
+        local_file_path = self.resolve_image_path(image_url)
+
+        try:
+            # 1. 画像アップロード & 2. 詳細解析（並行）
+            public_image_url, analyzed_step = await asyncio.gather(
+                self._upload_step_image(step_index, local_file_path, image_url, manual_id, gcs_repo),
+                self.analyze_single_image(local_file_path, title, timestamp, image_url, use_cache=use_cache)
+            )
+        finally:
+            # 3. Cleanup local image
             if local_file_path and os.path.exists(local_file_path):
                 try:
                     os.remove(local_file_path)
                     print(f"Deleted local image: {local_file_path}")
                 except Exception as del_err:
                     print(f"Failed to delete local image {local_file_path}: {del_err}")
-        
-        print("Phase 3 complete.")
-        manual_service.complete_manual_job(manual_id, current_steps)
-        return [ManualStep(**s) for s in current_steps]
 
-    async def analyze_video_structure(self, video_path: str) -> List[StepStructure]:
+        if not analyzed_step:
+            return None
+
+        step_dict = analyzed_step.model_dump()
+        # uploadによりURLが変わったので反映
+        step_dict["image_url"] = public_image_url
+        return step_dict
+
+    async def _process_batch(self, batch: List[tuple], manual_id: str, gcs_repo, use_cache: bool = True) -> List[Optional[dict]]:
         """
-        Phase 1: Video to Structure (Timestamps & Titles)
-        Supports local file path or GCS URI (gs://...)
+        Phase 3 の複数ステップ分: 画像アップロードと、まとめた詳細解析を並行して行う
+        batch: (ステップ番号, ステップ) のリスト
         """
-        if video_path.startswith("gs://"):
-             video_part = types.Part.from_uri(
-                file_uri=video_path,
-                mime_type="video/mp4"
-            )
-        else:
-            with open(video_path, "rb") as f:
-                video_data = f.read()
-                
-            video_part = types.Part.from_bytes(
-                data=video_data,
-                mime_type="video/mp4"
+        items = []
+        for _, step_data in batch:
+            items.append({
+                "file_path": self.resolve_image_path(step_data.get("image_url")),
+                "title": step_data.get("title"),
+                "timestamp": step_data.get("timestamp"),
+                "image_url": step_data.get("image_url")
+            })
+
+        try:
+            results = await asyncio.gather(
+                self.analyze_image_batch(items, use_cache=use_cache),
+                *(
+                    self._upload_step_image(step_index, item["file_path"], item["image_url"], manual_id, gcs_repo)
+                    for (step_index, _), item in zip(batch, items)
+                )
             )
+        finally:
+            for item in items:
+                local_file_path = item["file_path"]
+                if local_file_path and os.path.exists(local_file_path):
+                    try:
+                        os.remove(local_file_path)
+                        print(f"Deleted local image: {local_file_path}")
+                    except Exception as del_err:
+                        print(f"Failed to delete local image {local_file_path}: {del_err}")
+
+        analyzed_steps, public_image_urls = results[0], results[1:]
+        step_dicts = []
+        for analyzed_step, public_image_url in zip(analyzed_steps, public_image_urls):
+            if not analyzed_step:
+                step_dicts.append(None)
+                continue
+            step_dict = analyzed_step.model_dump()
+            step_dict["image_url"] = public_image_url
+            step_dicts.append(step_dict)
+        return step_dicts
+
+    async def _upload_step_image(self, step_index: int, local_file_path: str, image_url: str, manual_id: str, gcs_repo) -> str:
+        """
+        画像アップロード (Local -> GCS)。失敗した場合は元の image_url を返す
+        """
+        try:
+            if os.path.exists(local_file_path):
+                filename = os.path.basename(local_file_path)
+                # manuals/{id}/images/step_X.jpg
+                gcs_dest_path = f"manuals/{manual_id}/images/{filename}"
+
+                public_image_url = await gcs_repo.upload_file(
+                    local_file_path,
+                    gcs_dest_path
+                )
+                print(f"Uploaded image to: {public_image_url}")
+                return public_image_url
+        except Exception as e:
+            print(f"Image upload failed for step {step_index}: {e}")
+        return image_url
 
-        prompt = VIDEO_ANALYSIS_PROMPT
-        
+    async def _generate(self, kind: str, contents, config: types.GenerateContentConfig, parse: Optional[Callable[[Any], Any]] = None, parse_retries: Optional[int] = None):
+        """
+        generate_content の呼び出し（一時的なエラーと変換エラーはリトライし、遅い場合はヘッジする）
+        kind: 呼び出しの種類（トークン数の見積もりと指標の名前に使う）
+        parse: レスポンスを結果に変換する関数（変換できない場合は ResponseParseError を送出する）。省略時はレスポンスを返す
+        parse_retries: 変換エラーの最大リトライ回数（省略時はポリシーの設定）
+        """
+        async def attempt():
+            response = await self._generate_once(kind, contents, config)
+            return parse(response) if parse else response
+
+        if self.call_policy is None:
+            return await attempt()
+        return await self.call_policy.call(kind, attempt, self._can_hedge, parse_retries)
+
+    def _can_hedge(self) -> bool:
+        # 過負荷で同時実行数を絞っている間は重複リクエストを送らない
+        if self.rate_limiter is None:
+            return True
+        concurrency = self.rate_limiter.concurrency
+        return concurrency.limit >= concurrency.maximum and concurrency.in_flight < concurrency.limit
+
+    async def _generate_once(self, kind: str, contents, config: types.GenerateContentConfig):
+        """
+        generate_content の1回の呼び出し（RPM/TPM と同時実行数の制限を通す）
+        """
+        if self.rate_limiter is None:
+            return await self.client.aio.models.generate_content(model=self.model_name, contents=contents, config=config)
+
+        async with self.rate_limiter.acquire(kind) as call:
+            if call.queue_seconds >= 0.01:
+                logger.info(f"QUEUE: {kind} waited {call.queue_seconds:.3f}s for rate limit")
+            response = await self.client.aio.models.generate_content(model=self.model_name, contents=contents, config=config)
+            call.record_usage(response.usage_metadata)
+        return response
+
+    @property
+    def staging_repository(self) -> AsyncGCSRepository:
+        if self._staging_repository is None:
+            self._staging_repository = AsyncGCSRepository()
+        return self._staging_repository
+
+    async def _prepare_video_part(self, video_path: str):
+        """
+        動画の渡し方をサイズで選ぶ
+        - gcs_uri: 既にGCS上にある動画はそのURIを使う
+        - inline:  INLINE_VIDEO_MAX_BYTES 以下のローカル動画はバイト列を埋め込む
+        - staged:  それより大きいローカル動画はGCSへストリーミングで一時アップロードしてURIで参照する
+        returns: (Part, 方式, 一時アップロードしたBlob名 or None)
+        """
+        if video_path.startswith("gs://"):
+            return types.Part.from_uri(file_uri=video_path, mime_type="video/mp4"), "gcs_uri", None
+
+        size = os.path.getsize(video_path)
+        metrics.observe("phase1.video_bytes", size)
+        if size > INLINE_VIDEO_MAX_BYTES:
+            ext = os.path.splitext(video_path)[1] or ".mp4"
+            staged_blob = f"{VIDEO_STAGING_PREFIX}/{uuid.uuid4()}{ext}"
+            try:
+                repo = self.staging_repository
+                await repo.upload_file(video_path, staged_blob, content_type="video/mp4", make_public=False)
+                video_uri = f"gs://{repo.bucket_name}/{staged_blob}"
+                return types.Part.from_uri(file_uri=video_uri, mime_type="video/mp4"), "staged", staged_blob
+            except Exception as e:
+                # アップロードできない場合は従来通り埋め込む（解析自体は続ける）
+                print(f"Failed to stage video for Phase 1, sending inline: {e}")
+                metrics.incr("phase1.staging_failures")
+
+        video_data = await asyncio.to_thread(Path(video_path).read_bytes)
+        return types.Part.from_bytes(data=video_data, mime_type="video/mp4"), "inline", None
+
+    async def analyze_video_structure(self, video_path: str, media_resolution: Optional[str] = None) -> List[StepStructure]:
+        """
+        Phase 1: Video to Structure (Timestamps & Titles)
+        Supports local file path or GCS URI (gs://...)
+        media_resolution: "low" / "medium" / "high"（省略時はモデルの既定）
+        """
         start_time = time.time()
         logger.info("START: analyze_video_structure")
 
+        staged_blob = None
         try:
-            # Run blocking API call in thread
-            response = await asyncio.to_thread(
-                self.client.models.generate_content,
-                model=self.model_name,
-                contents=[video_part, prompt],
-                config=types.GenerateContentConfig(
+            video_part, method, staged_blob = await self._prepare_video_part(video_path)
+            metrics.incr(f"phase1.submission.{method}")
+
+            def parse(response) -> List[StepStructure]:
+                if not response.parsed:
+                    raise ResponseParseError(f"No steps in response: {(response.text or '')[:200]}")
+                return response.parsed
+
+            structures = await self._generate(
+                "video_structure",
+                [video_part, VIDEO_ANALYSIS_PROMPT],
+                types.GenerateContentConfig(
                     response_mime_type="application/json",
                     response_schema=list[StepStructure],
                     temperature=self.temperature,
-                )
+                    media_resolution=types.MediaResolution(f"MEDIA_RESOLUTION_{media_resolution.upper()}") if media_resolution else None,
+                ),
+                parse
             )
-            
+            del video_part
+
             duration = time.time() - start_time
-            logger.info(f"END: analyze_video_structure. Duration: {duration:.4f}s")
+            # ru_maxrss はプロセス全体のピーク（Linux では KB 単位）
+            peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            metrics.observe("phase1.peak_rss_mb", peak_rss_mb)
+            logger.info(f"END: analyze_video_structure ({method}). Duration: {duration:.4f}s, Peak RSS: {peak_rss_mb:.1f}MB")
             
-            return response.parsed
+            return structures
         except Exception as e:
+            # リトライしても失敗した場合
+            metrics.incr("phase1.failed")
             logger.error(f"Error in analyze_video_structure: {e}")
             print(f"Error in Phase 1: {e}")
             return []
+        finally:
+            if staged_blob:
+                try:
+                    await self.staging_repository.delete_file(staged_blob)
+                except Exception as e:
+                    print(f"Failed to delete staged video {staged_blob}: {e}")
 
-    async def _analyze_images_parallel(self, steps_with_images: List[dict]) -> List[ManualStep]:
+    async def analyze_keyframe_structure(self, video_path: str, video_service, mode: str = "keyframes") -> List[StepStructure]:
         """
-        Phase 3: Parallel Image Analysis
+        Phase 1（動画全体を渡さない方式）: ローカルで検出した画面の切り替わりごとのクリーンなフレームだけを渡し、
+        グルーピングとタイトル付けを行う。タイムスタンプは選ばれた候補の時刻になる
+        mode: "keyframes"（1枚ずつ）/ "strip"（複数枚を1枚に並べる）
+        returns: 候補が無い・失敗した場合は []
         """
+        start_time = time.time()
+        logger.info(f"START: analyze_keyframe_structure ({mode})")
+        work_dir = tempfile.mkdtemp(prefix="keyframes_")
+        try:
+            candidates = await video_service.detect_scenes(video_path)
+            if not candidates:
+                return []
+
+            frames = await video_service.extract_frames(video_path, [{"timestamp": c["timestamp"]} for c in candidates], output_dir=work_dir)
+            images, kept = [], []
+            for candidate, frame in zip(candidates, frames):
+                if frame.get("image_url"):
+                    with open(os.path.join(work_dir, os.path.basename(frame["image_url"])), "rb") as f:
+                        images.append(f.read())
+                    kept.append(candidate)
+            candidates = kept
+            if not candidates:
+                return []
+
+            if mode == "strip":
+                labels = [f"#{i} {c['timestamp']}" for i, c in enumerate(candidates)]
+                sheets = await asyncio.to_thread(build_contact_sheets, images, labels)
+                contents = [KEYFRAME_STRUCTURE_PROMPT.format(layout=STRIP_LAYOUT)]
+                contents += [types.Part.from_bytes(data=sheet, mime_type="image/jpeg") for sheet in sheets]
+                submitted_bytes = sum(len(sheet) for sheet in sheets)
+            else:
+                keyframes = await asyncio.gather(*(
+                    asyncio.to_thread(downscale_for_analysis, image, KEYFRAME_MAX_DIM, self.analysis_jpeg_quality) for image in images
+                ))
+                contents = [KEYFRAME_STRUCTURE_PROMPT.format(layout=KEYFRAME_LAYOUT)]
+                for i, (candidate, keyframe) in enumerate(zip(candidates, keyframes)):
+                    contents.append(f"候補 {i} ({candidate['timestamp']})")
+                    contents.append(types.Part.from_bytes(data=keyframe, mime_type="image/jpeg"))
+                submitted_bytes = sum(len(keyframe) for keyframe in keyframes)
+            del images
+            metrics.incr(f"phase1.submission.{mode}")
+            metrics.observe("phase1.video_bytes", submitted_bytes)
+            metrics.observe("phase1.keyframe_candidates", len(candidates))
+
+            def parse(response) -> List[StepStructure]:
+                if not response.parsed:
+                    raise ResponseParseError(f"No steps in response: {(response.text or '')[:200]}")
+                structures = []
+                used = set()
+                for step in sorted(response.parsed, key=lambda s: s.candidate):
+                    if not 0 <= step.candidate < len(candidates):
+                        raise ResponseParseError(f"Unknown candidate {step.candidate} (0-{len(candidates) - 1})")
+                    if step.candidate in used:
+                        continue
+                    used.add(step.candidate)
+                    structures.append(StepStructure(timestamp=candidates[step.candidate]["timestamp"], title=step.title))
+                return structures
+
+            structures = await self._generate(
+                "keyframe_structure",
+                contents,
+                types.GenerateContentConfig(
+                    response_mime_type="application/json",
+                    response_schema=list[KeyframeStep],
+                    temperature=self.temperature,
+                ),
+                parse
+            )
+
+            duration = time.time() - start_time
+            logger.info(f"END: analyze_keyframe_structure ({mode}). Duration: {duration:.4f}s, Candidates: {len(candidates)}, Steps: {len(structures)}, Bytes: {submitted_bytes}")
+            return structures
+        except Exception as e:
+            metrics.incr("phase1.keyframe_failed")
+            logger.error(f"Error in analyze_keyframe_structure: {e}")
+            return []
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    async def _analyze_images_parallel(self, steps_with_images: List[dict], max_concurrency: Optional[int] = None) -> List[ManualStep]:
+        """
+        Phase 3: Parallel Image Analysis (up to max_concurrency requests at once)
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.phase3_concurrency)
+
+        async def analyze(file_path, title, timestamp, image_url):
+            async with semaphore:
+                return await self.analyze_single_image(file_path, title, timestamp, image_url)
+
         tasks = []
         for step in steps_with_images:
             image_url = step.get("image_url")
@@ -263,13 +765,17 @@ class GeminiService:
             # Helper to resolve path
             file_path = self.resolve_image_path(image_url)
             
-            tasks.append(self.analyze_single_image(file_path, title, timestamp, image_url))
+            tasks.append(analyze(file_path, title, timestamp, image_url))
 
         results = await asyncio.gather(*tasks)
         # Filter out Nones
         return [r for r in results if r is not None]
 
-    async def analyze_single_image(self, file_path: str, title: str, timestamp: str, image_url: str) -> Optional[ManualStep]:
+    async def analyze_single_image(self, file_path: str, title: str, timestamp: str, image_url: str, use_cache: bool = True) -> Optional[ManualStep]:
+        """
+        Phase 3: 1枚の画像を解析する。
+        use_cache=False の場合はキャッシュを参照せずに必ずGeminiを呼ぶ（結果はキャッシュを更新する）。
+        """
         try:
             if not os.path.exists(file_path):
                  print(f"Image not found: {file_path}")
@@ -278,8 +784,25 @@ class GeminiService:
             with open(file_path, "rb") as f:
                 image_data = f.read()
 
+            cache_key = None
+            if self.analysis_cache:
+                cache_key = AnalysisCache.make_key(image_data, title, self._analysis_version(PROMPT_VERSION), self.model_name, self.temperature)
+                if use_cache:
+                    cached = await asyncio.to_thread(self.analysis_cache.get, cache_key)
+                    if cached:
+                        logger.info(f"CACHE HIT: analyze_single_image for step '{title}'")
+                        detail = StepDetail(**cached)
+                        return ManualStep(
+                            timestamp=timestamp,
+                            title=title,
+                            description=detail.description,
+                            highlight_box=detail.highlight_box,
+                            mask_boxes=detail.mask_boxes,
+                            image_url=image_url
+                        )
+
             image_part = types.Part.from_bytes(
-                data=image_data,
+                data=await self._prepare_analysis_image(image_data),
                 mime_type="image/jpeg"
             )
 
@@ -288,47 +811,176 @@ class GeminiService:
             start_time = time.time()
             logger.info(f"START: analyze_single_image for step '{title}'")
 
-            # Run blocking API call in thread
-            response = await asyncio.to_thread(
-                self.client.models.generate_content,
-                model=self.model_name,
-                contents=[image_part, prompt],
-                config=types.GenerateContentConfig(
+            def parse(response) -> StepDetail:
+                parsed_response = response.parsed
+                if parsed_response is None:
+                    raise ResponseParseError(f"Invalid response for {title}: {(response.text or '')[:200]}")
+                try:
+                    # Create ManualStep and ensure validation passes
+                    ManualStep(
+                        timestamp=timestamp,
+                        title=title,
+                        description=parsed_response.description,
+                        highlight_box=parsed_response.highlight_box,
+                        mask_boxes=parsed_response.mask_boxes,
+                        image_url=image_url
+                    )
+                except Exception as valid_err:
+                    raise ResponseParseError(f"Validation Error creating ManualStep for {title}: {valid_err}") from valid_err
+                return parsed_response
+
+            parsed_response = await self._generate(
+                "image_detail",
+                [image_part, prompt],
+                types.GenerateContentConfig(
                     response_mime_type="application/json",
                     response_schema=StepDetail,
                     temperature=self.temperature,
                     thinking_config=types.ThinkingConfig(thinking_level="low"),
-                )
+                ),
+                parse
             )
             
             duration = time.time() - start_time
             logger.info(f"END: analyze_single_image for step '{title}'. Duration: {duration:.4f}s")
             
-            parsed_response = response.parsed
-            
             # Debug log
-            if parsed_response:
-                print(parsed_response.model_dump())
-            
-            try:
-                # Create ManualStep and ensure validation passes
-                step = ManualStep(
-                    timestamp=timestamp,
-                    title=title,
-                    description=parsed_response.description,
-                    highlight_box=parsed_response.highlight_box,
-                    mask_boxes=parsed_response.mask_boxes,
-                    image_url=image_url
-                )
-                return step
-            except Exception as valid_err:
-                 print(f"Validation Error creating ManualStep for {title}: {valid_err}")
-                 return None
+            print(parsed_response.model_dump())
+
+            step = ManualStep(
+                timestamp=timestamp,
+                title=title,
+                description=parsed_response.description,
+                highlight_box=parsed_response.highlight_box,
+                mask_boxes=parsed_response.mask_boxes,
+                image_url=image_url
+            )
+
+            if cache_key:
+                await asyncio.to_thread(self.analysis_cache.put, cache_key, parsed_response.model_dump())
+            return step
 
         except Exception as e:
-            print(f"Error in Phase 3 for {title}: {e}")
+            # リトライしても失敗した場合（ステップは Phase 1 の骨組みのまま残る）
+            metrics.incr("phase3.failed_steps")
+            logger.error(f"Error in Phase 3 for {title}: {e}")
             return None
     
+    async def analyze_image_batch(self, items: List[dict], use_cache: bool = True) -> List[Optional[ManualStep]]:
+        """
+        Phase 3: 複数の画像を1回のリクエストで解析する。
+        items: file_path / title / timestamp / image_url を持つ辞書のリスト（結果は同じ順番で返す）
+        応答の件数・index が画像と合わない場合などは、1枚ずつの解析にフォールバックする。
+        """
+        results: List[Optional[ManualStep]] = [None] * len(items)
+        pending = [] # (位置, item, 画像データ, キャッシュキー)
+        for position, item in enumerate(items):
+            if not os.path.exists(item["file_path"]):
+                print(f"Image not found: {item['file_path']}")
+                continue
+            with open(item["file_path"], "rb") as f:
+                image_data = f.read()
+
+            cache_key = None
+            if self.analysis_cache:
+                cache_key = AnalysisCache.make_key(image_data, item["title"], self._analysis_version(f"{PROMPT_VERSION}-batch"), self.model_name, self.temperature)
+                if use_cache:
+                    cached = await asyncio.to_thread(self.analysis_cache.get, cache_key)
+                    if cached:
+                        logger.info(f"CACHE HIT: analyze_image_batch for step '{item['title']}'")
+                        results[position] = self._to_manual_step(StepDetail(**cached), item)
+                        continue
+            pending.append((position, item, image_data, cache_key))
+
+        if len(pending) <= 1:
+            for position, item, _, _ in pending:
+                results[position] = await self.analyze_single_image(item["file_path"], item["title"], item["timestamp"], item["image_url"], use_cache=use_cache)
+            return results
+
+        analysis_images = await asyncio.gather(*(self._prepare_analysis_image(image_data) for _, _, image_data, _ in pending))
+        contents = [BATCH_IMAGE_ANALYSIS_PROMPT.format(count=len(pending))]
+        for batch_index, ((_, item, _, _), analysis_image) in enumerate(zip(pending, analysis_images)):
+            contents.append(f"画像 {batch_index}: {item['title']}")
+            contents.append(types.Part.from_bytes(data=analysis_image, mime_type="image/jpeg"))
+
+        def parse(response) -> List[ManualStep]:
+            parsed_response = response.parsed
+            if not parsed_response or len(parsed_response) != len(pending):
+                raise ResponseParseError(f"Expected {len(pending)} results, got {len(parsed_response or [])}")
+            by_index = {detail.index: detail for detail in parsed_response}
+            if sorted(by_index) != list(range(len(pending))):
+                raise ResponseParseError(f"Result indices do not match images: {sorted(by_index)}")
+            try:
+                return [self._to_manual_step(by_index[batch_index], item) for batch_index, (_, item, _, _) in enumerate(pending)]
+            except Exception as valid_err:
+                raise ResponseParseError(f"Validation Error creating ManualStep: {valid_err}") from valid_err
+
+        start_time = time.time()
+        logger.info(f"START: analyze_image_batch for {len(pending)} images")
+        metrics.incr("phase3.batches")
+        metrics.observe("phase3.batch_size", len(pending))
+        try:
+            # 変換できない応答は再送せず、1枚ずつの解析に切り替える
+            steps = await self._generate(
+                "image_batch",
+                contents,
+                types.GenerateContentConfig(
+                    response_mime_type="application/json",
+                    response_schema=list[BatchStepDetail],
+                    temperature=self.temperature,
+                    thinking_config=types.ThinkingConfig(thinking_level="low"),
+                ),
+                parse,
+                parse_retries=0
+            )
+        except Exception as e:
+            metrics.incr("phase3.batch_fallbacks")
+            logger.warning(f"Batch analysis failed, falling back to single images: {e}")
+            singles = await asyncio.gather(*(
+                self.analyze_single_image(item["file_path"], item["title"], item["timestamp"], item["image_url"], use_cache=use_cache)
+                for _, item, _, _ in pending
+            ))
+            for (position, _, _, _), step in zip(pending, singles):
+                results[position] = step
+            return results
+
+        duration = time.time() - start_time
+        logger.info(f"END: analyze_image_batch for {len(pending)} images. Duration: {duration:.4f}s")
+
+        for (position, _, _, cache_key), step in zip(pending, steps):
+            results[position] = step
+            if cache_key:
+                detail = StepDetail(description=step.description, highlight_box=step.highlight_box, mask_boxes=step.mask_boxes)
+                await asyncio.to_thread(self.analysis_cache.put, cache_key, detail.model_dump())
+        return results
+
+    def _analysis_version(self, prompt_version: str) -> str:
+        """
+        解析結果キャッシュのキーに使うバージョン（送る画像の解像度・品質が変われば別の結果として扱う）
+        """
+        if self.analysis_max_dim <= 0:
+            return prompt_version
+        return f"{prompt_version}:{self.analysis_max_dim}px:q{self.analysis_jpeg_quality}"
+
+    async def _prepare_analysis_image(self, image_data: bytes) -> bytes:
+        """
+        Gemini に送る画像（縮小版）を作る
+        """
+        analysis_image = await asyncio.to_thread(downscale_for_analysis, image_data, self.analysis_max_dim, self.analysis_jpeg_quality)
+        metrics.observe("phase3.analysis_image_bytes", len(analysis_image))
+        metrics.incr("phase3.analysis_bytes_saved", len(image_data) - len(analysis_image))
+        return analysis_image
+
+    def _to_manual_step(self, detail: StepDetail, item: dict) -> ManualStep:
+        return ManualStep(
+            timestamp=item["timestamp"],
+            title=item["title"],
+            description=detail.description,
+            highlight_box=detail.highlight_box,
+            mask_boxes=detail.mask_boxes,
+            image_url=item["image_url"]
+        )
+
     def resolve_image_path(self, image_url: str) -> str:
         """
         Resolves the absolute file system path from the image URL.
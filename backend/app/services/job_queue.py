@@ -0,0 +1,292 @@
+# 解析ジョブの永続キュー（SQLite）
+# Webプロセスは enqueue するだけで、解析は別プロセスのワーカー（python -m app.worker）が lease を取って実行する
+# lease の期限（visibility timeout）が切れたジョブは別のワーカーが再取得するため、ワーカーが落ちてもジョブは失われない
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+from typing import Optional, Dict, Any, List
+
+import aiosqlite
+
+from app.services.metrics import metrics
+
+# キューのデータベースファイル（Webとワーカーで同じファイルを使う）
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "/tmp/video_jobs.sqlite3")
+# /analyze をキュー経由で実行する（0 の場合は従来通り BackgroundTasks で Webプロセス内で実行する）
+JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE_ENABLED", "1") == "1"
+# lease の有効期間（秒）。実行中はワーカーがこの1/3ごとに延長する
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))
+# 1ジョブの最大試行回数
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# リトライ間隔（秒）。試行ごとに倍にし、JOB_RETRY_BACKOFF_MAX で打ち切る
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "10"))
+JOB_RETRY_BACKOFF_MAX = float(os.getenv("JOB_RETRY_BACKOFF_MAX", "600"))
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at);
+"""
+
+
+def retry_delay(attempts: int) -> float:
+    """attempts 回目の失敗後に待つ秒数（指数バックオフ）"""
+    return min(JOB_RETRY_BACKOFF_MAX, JOB_RETRY_BACKOFF * (2 ** max(attempts - 1, 0)))
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    return job
+
+
+class JobAlreadyActiveError(Exception):
+    """同じIDのジョブが待機中・実行中のため追加できない"""
+
+
+class JobQueue:
+    """
+    SQLite に保存するジョブキュー
+    複数プロセスから同じファイルを開いても、取得（claim）は BEGIN IMMEDIATE で直列化されるため同じジョブを二重に取らない
+    """
+    def __init__(self, path: str = JOB_QUEUE_PATH, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._db: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self) -> aiosqlite.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # トランザクションは自分で管理する（isolation_level=None）
+            db = await aiosqlite.connect(self.path, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute("PRAGMA busy_timeout=5000")
+            await db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def _write(self, sql: str, params: tuple) -> int:
+        async with self._lock:
+            db = await self._connect()
+            cursor = await db.execute(sql, params)
+            return cursor.rowcount
+
+    async def enqueue(self, job_id: str, kind: str, payload: Dict[str, Any], max_attempts: Optional[int] = None) -> bool:
+        """
+        ジョブを追加する。同じIDのジョブが待機中・実行中の場合は何もしない（終了済みなら再実行する）
+        returns: 追加（再投入）した場合は True
+        """
+        now = time.time()
+        changed = await self._write(
+            """
+            INSERT INTO jobs (id, kind, payload, status, attempts, max_attempts, available_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                kind = excluded.kind, payload = excluded.payload, status = excluded.status, attempts = 0,
+                max_attempts = excluded.max_attempts, available_at = excluded.available_at, lease_owner = NULL,
+                lease_expires_at = NULL, last_error = NULL, updated_at = excluded.updated_at, started_at = NULL, finished_at = NULL
+            WHERE jobs.status IN (?, ?)
+            """,
+            (job_id, kind, json.dumps(payload, ensure_ascii=False), QUEUED, max_attempts or self.max_attempts, now, now, now, SUCCEEDED, FAILED)
+        )
+        if changed:
+            metrics.incr("job_queue.enqueued")
+        return bool(changed)
+
+    async def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        実行可能なジョブを1つ取り出して lease を取る（lease が切れた実行中のジョブも対象）
+        """
+        now = time.time()
+        async with self._lock:
+            db = await self._connect()
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute(
+                    """
+                    SELECT * FROM jobs
+                    WHERE ((status = ? AND available_at <= ?) OR (status = ? AND lease_expires_at < ?))
+                      AND attempts < max_attempts
+                    ORDER BY available_at LIMIT 1
+                    """,
+                    (QUEUED, now, RUNNING, now)
+                )
+                row = await cursor.fetchone()
+                if row is None:
+                    await db.execute("COMMIT")
+                    return None
+                if row["status"] == RUNNING:
+                    metrics.incr("job_queue.lease_expired")
+                await db.execute(
+                    """
+                    UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?,
+                        started_at = COALESCE(started_at, ?), updated_at = ?
+                    WHERE id = ?
+                    """,
+                    (RUNNING, worker_id, now + self.visibility_timeout, now, now, row["id"])
+                )
+                await db.execute("COMMIT")
+            except BaseException:
+                await db.execute("ROLLBACK")
+                raise
+
+        job = _row_to_job(row)
+        job["status"] = RUNNING
+        job["attempts"] += 1
+        # 待ち時間（投入または前回の失敗から実行開始まで）
+        metrics.observe("job_queue.wait_seconds", max(now - job["available_at"], 0))
+        return job
+
+    async def reap_expired(self) -> List[Dict[str, Any]]:
+        """
+        lease が切れたまま最大試行回数に達したジョブ（ワーカーが毎回落ちるジョブ）を失敗にする
+        returns: 失敗にしたジョブ
+        """
+        now = time.time()
+        async with self._lock:
+            db = await self._connect()
+            cursor = await db.execute(
+                "SELECT * FROM jobs WHERE status = ? AND lease_expires_at < ? AND attempts >= max_attempts",
+                (RUNNING, now)
+            )
+            rows = await cursor.fetchall()
+            for row in rows:
+                await db.execute(
+                    "UPDATE jobs SET status = ?, last_error = ?, lease_owner = NULL, lease_expires_at = NULL, finished_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+                    (FAILED, "lease expired", now, now, row["id"], RUNNING)
+                )
+        if rows:
+            metrics.incr("job_queue.failed", len(rows))
+        return [_row_to_job(row) for row in rows]
+
+    async def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """
+        実行中のジョブの lease を延長する
+        returns: 他のワーカーに lease を取られていた場合は False
+        """
+        now = time.time()
+        return bool(await self._write(
+            "UPDATE jobs SET lease_expires_at = ?, updated_at = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+            (now + self.visibility_timeout, now, job_id, RUNNING, worker_id)
+        ))
+
+    async def complete(self, job_id: str, worker_id: str) -> bool:
+        now = time.time()
+        changed = await self._write(
+            "UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires_at = NULL, finished_at = ?, updated_at = ? WHERE id = ? AND lease_owner = ?",
+            (SUCCEEDED, now, now, job_id, worker_id)
+        )
+        if changed:
+            metrics.incr("job_queue.succeeded")
+        return bool(changed)
+
+    async def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """
+        失敗を記録する。試行回数が残っていればバックオフ後に再実行する
+        returns: リトライする場合は True
+        """
+        now = time.time()
+        async with self._lock:
+            db = await self._connect()
+            cursor = await db.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND lease_owner = ?", (job_id, worker_id))
+            row = await cursor.fetchone()
+            if row is None:
+                return False
+            retry = row["attempts"] < row["max_attempts"]
+            if retry:
+                await db.execute(
+                    "UPDATE jobs SET status = ?, available_at = ?, last_error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                    (QUEUED, now + retry_delay(row["attempts"]), error, now, job_id)
+                )
+            else:
+                await db.execute(
+                    "UPDATE jobs SET status = ?, last_error = ?, lease_owner = NULL, lease_expires_at = NULL, finished_at = ?, updated_at = ? WHERE id = ?",
+                    (FAILED, error, now, now, job_id)
+                )
+        metrics.incr("job_queue.retried" if retry else "job_queue.failed")
+        return retry
+
+    async def release(self, job_id: str, worker_id: str) -> bool:
+        """
+        ワーカーの停止で中断したジョブを試行回数を消費せずにキューへ戻す
+        """
+        now = time.time()
+        changed = await self._write(
+            "UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), available_at = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ? WHERE id = ? AND lease_owner = ?",
+            (QUEUED, now, now, job_id, worker_id)
+        )
+        if changed:
+            metrics.incr("job_queue.released")
+        return bool(changed)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        async with self._lock:
+            db = await self._connect()
+            cursor = await db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = await cursor.fetchone()
+        return _row_to_job(row) if row else None
+
+    async def stats(self) -> Dict[str, int]:
+        """状態ごとのジョブ数"""
+        async with self._lock:
+            db = await self._connect()
+            cursor = await db.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status")
+            rows = await cursor.fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+
+def new_worker_id() -> str:
+    return f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+_job_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """
+    プロセス共通のキューを取得する
+    """
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
+
+
+async def close_job_queue():
+    global _job_queue
+    if _job_queue is not None:
+        await _job_queue.close()
+        _job_queue = None
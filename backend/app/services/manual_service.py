@@ -1,28 +1,99 @@
 import asyncio
 import os
 import json
+import copy
+import time
+import hashlib
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 from google.cloud import firestore
 
-from app.repositories.firestore_repository import FirestoreRepository
-from app.repositories.gcs_repository import GCSRepository
+from app.repositories.firestore_repository import AsyncFirestoreRepository
+from app.repositories.gcs_repository import AsyncGCSRepository
+from app.services.metrics import metrics
 
-class ManualService:
+# 解析済みジョブの結果（動画のハッシュ単位）を保存するコレクション
+JOB_RESULTS_COLLECTION = "job_results"
+
+# 解析中の進捗（ステータス・ステップ）をFirestoreへ書き込む最短間隔（ミリ秒）
+PROGRESS_FLUSH_INTERVAL_MS = int(os.getenv("PROGRESS_FLUSH_INTERVAL_MS", "1000"))
+# このステータスになったら即時に書き込む
+TERMINAL_STATUSES = {"completed", "error"}
+
+# 解析中ステップの保存形式
+#   embedded:      マニュアルのドキュメント内に steps 配列として保存（従来方式）
+#   subcollection: users/{uid}/manuals/{id}/steps/{index} に1ステップ1ドキュメントで保存し、
+#                  マニュアルのドキュメントには集計値とステータスのみを持つ
+STEPS_LAYOUT = os.getenv("STEPS_LAYOUT", "embedded")
+
+# save_manual で同時に行うアップロード数
+SAVE_UPLOAD_CONCURRENCY = int(os.getenv("SAVE_UPLOAD_CONCURRENCY", "8"))
+# save_manual で既にバケットにある画像・動画の扱い
+#   copy:      サーバー側コピー（rewrite）で manuals/{id}_{timestamp}/ 以下に複製する
+#   reference: コピーせずに既存のオブジェクトをそのまま参照する
+SAVE_ASSET_REUSE = os.getenv("SAVE_ASSET_REUSE", "copy")
+
+
+class VideoSourceError(ValueError):
+    """save_manual に渡された動画の参照先を使えない（バケット外のURLでファイルも無い）"""
+
+
+def _image_destination(full_id: str, source: str) -> str:
+    """
+    保存先の画像パス（別の場所にある同名の画像が上書きし合わないよう、元のパスのハッシュを付ける）
+    """
+    digest = hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+    return f"manuals/{full_id}/images/{digest}_{os.path.basename(source)}"
+
+class _ProgressBuffer:
+    """
+    1ジョブ分の未反映の変更
+    """
     def __init__(self):
-        self.firestore_repository = FirestoreRepository()
-        self.gcs_repository = GCSRepository()
+        self.lock = asyncio.Lock()
+        self.pending: Dict[str, Any] = {}
+        self.pending_since = 0.0
+        self.written: Dict[str, Any] = {} # 最後に書き込んだ値（同じ値の再書き込みを省く）
+        self.last_flush = 0.0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def merge(self, data: Dict[str, Any]):
+        # 呼び出し元はリスト（steps）をその場で書き換えるため、比較・書き込み用に値を複製して持つ
+        # （参照のままだと written と常に等しくなり、以降の変更が書き込まれない）
+        data = copy.deepcopy(data)
+        for key, value in data.items():
+            if key not in self.pending and self.written.get(key) == value:
+                metrics.incr("progress.skipped_fields")
+                continue
+            if not self.pending:
+                self.pending_since = time.monotonic()
+            self.pending[key] = value
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+class ManualService:
+    # ジョブごとの進捗バッファ（リクエストごとにインスタンスが作られるためクラスで共有する）
+    # バッファはイベントループ上でのみ操作するため、辞書自体のロックは不要
+    _progress_buffers: Dict[str, _ProgressBuffer] = {}
+
+    def __init__(self, firestore_repository: Optional[AsyncFirestoreRepository] = None, gcs_repository: Optional[AsyncGCSRepository] = None):
+        self.firestore_repository = firestore_repository or AsyncFirestoreRepository()
+        self.gcs_repository = gcs_repository or AsyncGCSRepository()
         self.app_dir = Path(__file__).resolve().parent.parent
+        self.steps_layout = STEPS_LAYOUT
 
     # --- 閲覧・取得系 ---
 
-    def get_public_manual(self, manual_id: str) -> Optional[Dict[str, Any]]:
+    async def get_public_manual(self, manual_id: str) -> Optional[Dict[str, Any]]:
         """
         公開されているマニュアルを取得する
         """
         # 1. Firestoreからメタデータを検索 (Collection Group Query)
-        docs = self.firestore_repository.find_in_collection_group("manuals", "id", "==", manual_id)
+        docs = await self.firestore_repository.find_in_collection_group("manuals", "id", "==", manual_id)
         
         if not docs:
             return None
@@ -33,13 +104,20 @@ class ManualService:
         if not manual_data.get("is_public", False):
             return None
 
+        # ステップをサブコレクションに保存している場合は1回のクエリで組み立てる
+        if manual_data.get("steps_layout") == "subcollection":
+            return {
+                **manual_data,
+                "steps": await self.get_manual_steps(manual_data["path"])
+            }
+
         # 2. GCSから詳細JSON（手順ステップ）を取得
         json_path = manual_data.get("gcs_json_path")
         if not json_path:
             return None
 
         try:
-            steps_json_str = self.gcs_repository.read_file(json_path)
+            steps_json_str = await self.gcs_repository.read_file(json_path)
             steps = json.loads(steps_json_str)
             
             return {
@@ -50,63 +128,139 @@ class ManualService:
             print(f"Error reading manual detail: {e}")
             return None
 
+    async def get_manual_steps(self, manual_path: str) -> List[Dict[str, Any]]:
+        """
+        サブコレクション形式で保存されたステップを index 順に取得する
+        manual_path: users/{uid}/manuals/{id}
+        """
+        docs = await self.firestore_repository.query_collection(f"{manual_path}/steps", order_by="index")
+        return [{k: v for k, v in doc.items() if k not in ("id", "index")} for doc in docs]
+
     # --- 保存・更新系 ---
 
-    async def save_manual(self, steps: List[Dict], manual_id: str, video_path: str = None) -> Dict[str, Any]:
+    async def save_manual(self, steps: List[Dict], manual_id: str, video_path: str = None, video_url: str = None) -> Dict[str, Any]:
         """
         画像、動画、および手順書JSONをGCSにアップロードし、Firestoreにメタデータを保存する
+        アップロードは SAVE_UPLOAD_CONCURRENCY 本まで並行に行い、公開設定とロールバック時の削除はバッチでまとめて送る
+        画像URLや video_url が既にバケット内のオブジェクトを指す場合は、アップロードせずに
+        SAVE_ASSET_REUSE に従ってサーバー側でコピーするか、そのまま参照する
         """
-        updated_steps = []
+        timings: Dict[str, float] = {}
+        phase_start = time.monotonic()
+
+        def lap(name: str):
+            nonlocal phase_start
+            now = time.monotonic()
+            timings[name] = round((now - phase_start) * 1000, 1)
+            metrics.observe(f"save_manual.{name}_ms", timings[name])
+            phase_start = now
+
+        source_video_blob = self.gcs_repository.blob_name_from_url(video_url)
+        has_video_file = bool(video_path and os.path.exists(video_path))
+        if video_url and not source_video_blob and not has_video_file:
+            # 参照もアップロードもできない動画のパスを保存しない
+            raise VideoSourceError(f"video_url is not an object in bucket {self.gcs_repository.bucket_name}: {video_url}")
+
+        updated_steps = [step.copy() for step in steps]
         now_timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         full_id = f"{manual_id}_{now_timestamp}"
+        gcs_video_path = f"manuals/{full_id}/video.mp4"
+        json_path = f"manuals/{full_id}/manual.json"
+
+        semaphore = asyncio.Semaphore(SAVE_UPLOAD_CONCURRENCY)
+        uploaded: List[str] = [] # ロールバック対象（参照しただけのオブジェクトは含めない）
+
+        async def upload(local_path: str, gcs_dest_path: str) -> str:
+            async with semaphore:
+                # 公開設定は後でまとめて行う
+                public_url = await self.gcs_repository.upload_file(local_path, gcs_dest_path, make_public=False)
+                uploaded.append(gcs_dest_path)
+                return public_url
 
-        # 1. 各ステップの画像をアップロードしてURLを置換
-        for step in steps:
-            new_step = step.copy()
-            image_url = step.get("image_url")
+        async def copy(source_blob: str, gcs_dest_path: str) -> str:
+            async with semaphore:
+                public_url = await self.gcs_repository.copy_file(source_blob, gcs_dest_path, make_public=False)
+                uploaded.append(gcs_dest_path)
+                metrics.incr("save_manual.assets_copied")
+                return public_url
 
-            if image_url and image_url.startswith("/static/"):
+        # 同じ画像を使うステップ（重複フレームをまとめたステップなど）は、コピー・アップロードを1回にする
+        image_transfers: Dict[str, asyncio.Future] = {}
+
+        def transfer_once(source: str, start) -> asyncio.Future:
+            if source not in image_transfers:
+                image_transfers[source] = asyncio.ensure_future(start())
+            return image_transfers[source]
+
+        async def upload_step_image(new_step: Dict):
+            image_url = new_step.get("image_url")
+            source_blob = self.gcs_repository.blob_name_from_url(image_url)
+            if source_blob:
+                # 解析時にアップロード済みの画像
+                if SAVE_ASSET_REUSE == "copy":
+                    dest = _image_destination(full_id, source_blob)
+                    new_step["image_url"] = await transfer_once(source_blob, lambda: copy(source_blob, dest))
+                else:
+                    metrics.incr("save_manual.assets_referenced")
+            elif image_url and image_url.startswith("/static/"):
                 # ローカルの相対パスを絶対パスに変換
                 relative_path = image_url.lstrip("/")
                 local_path = str(self.app_dir / relative_path)
 
                 if os.path.exists(local_path):
-                    filename = os.path.basename(local_path)
-                    gcs_dest_path = f"manuals/{full_id}/images/{filename}"
-
-                    # アップロード実行 (非同期実行のためにスレッドへ)
-                    public_url = await asyncio.to_thread(
-                        self.gcs_repository.upload_file,
-                        local_path,
-                        gcs_dest_path
-                    )
-                    new_step["image_url"] = public_url
-            
-            updated_steps.append(new_step)
+                    dest = _image_destination(full_id, local_path)
+                    new_step["image_url"] = await transfer_once(local_path, lambda: upload(local_path, dest))
 
-        # 2. GCSに動画をアップロード
-        gcs_video_path = f"manuals/{full_id}/video.mp4"
-        if video_path and os.path.exists(video_path):
+        async def upload_video():
             try:
-                await asyncio.to_thread(
-                    self.gcs_repository.upload_file,
-                    video_path,
-                    gcs_video_path
-                )
+                await upload(video_path, gcs_video_path)
             except Exception as gcs_err:
                 print(f"GCS Video Upload Error: {gcs_err}")
-                raise gcs_err
+                raise
 
-        # 3. 手順情報をJSONとしてアップロード
-        json_content = json.dumps(updated_steps, ensure_ascii=False, indent=2)
-        json_path = f"manuals/{full_id}/manual.json"
+        async def reuse_video(source_blob: str):
+            nonlocal gcs_video_path
+            try:
+                if SAVE_ASSET_REUSE == "copy":
+                    await copy(source_blob, gcs_video_path)
+                else:
+                    # 存在確認のみ（保存後に参照先が無いマニュアルを作らない）
+                    await self.gcs_repository.get_metadata(source_blob)
+                    gcs_video_path = source_blob
+                    metrics.incr("save_manual.assets_referenced")
+            except Exception as gcs_err:
+                if not (video_path and os.path.exists(video_path)):
+                    print(f"GCS Video Reuse Error: {gcs_err}")
+                    raise
+                # 再利用できない場合は送られてきたファイルをアップロードする
+                print(f"GCS Video Reuse Error, uploading instead: {gcs_err}")
+                await upload_video()
 
-        await asyncio.to_thread(
-            self.gcs_repository.upload_structure_content, 
-            json_content, 
-            json_path, 
-            "application/json"
-        )
+        try:
+            # 1. 各ステップの画像と動画を並行にアップロード・コピー（画像はURLを置換）
+            uploads = [upload_step_image(step) for step in updated_steps]
+            if source_video_blob:
+                uploads.append(reuse_video(source_video_blob))
+            elif has_video_file:
+                uploads.append(upload_video())
+            results = await asyncio.gather(*uploads, return_exceptions=True)
+            errors = [r for r in results if isinstance(r, BaseException)]
+            if errors:
+                raise errors[0]
+            lap("upload_assets")
+
+            # 2. 手順情報をJSONとしてアップロード（画像のURLが確定してから）
+            json_content = json.dumps(updated_steps, ensure_ascii=False, indent=2)
+            await self.gcs_repository.upload_structure_content(json_content, json_path, "application/json", make_public=False)
+            uploaded.append(json_path)
+            lap("upload_json")
+
+            # 3. アップロードしたファイルをまとめて公開
+            await self.gcs_repository.make_public_batch(list(uploaded))
+            lap("publish")
+        except Exception:
+            await self._rollback_uploads(uploaded)
+            raise
 
         # 4. Firestore にメタデータを保存
         metadata = {
@@ -127,17 +281,15 @@ class ManualService:
             user_id = "test-user-001"
             collection_path = f"users/{user_id}/manuals"
             
-            await asyncio.to_thread(
-                self.firestore_repository.create_document,
+            await self.firestore_repository.create_document(
                 collection_path,
                 full_id,
                 metadata
             )
+            lap("firestore")
         except Exception as e:
             # 失敗時はロールバック（GCS削除）
-            await asyncio.to_thread(self.gcs_repository.delete_file, json_path)
-            if video_path:
-                await asyncio.to_thread(self.gcs_repository.delete_file, gcs_video_path)
+            await self._rollback_uploads(uploaded)
             print(f"Firestore Error: {e}")
             raise e
 
@@ -145,14 +297,29 @@ class ManualService:
             "id": full_id,
             "json_path": json_path,
             "video_path": gcs_video_path,
-            "image_count": len([s for s in updated_steps if "http" in s.get("image_url", "")])
+            "image_count": len([s for s in updated_steps if "http" in s.get("image_url", "")]),
+            "timings_ms": timings
         }
 
+    async def _rollback_uploads(self, blob_names: List[str]):
+        """
+        保存に失敗したときにアップロード済みのファイルをまとめて削除する
+        """
+        if not blob_names:
+            return
+        try:
+            failed = await self.gcs_repository.delete_files(list(blob_names))
+            if failed:
+                print(f"Rollback failed for: {failed}")
+        except Exception as e:
+            print(f"Rollback Error: {e}")
+
     # --- 新しい分析フロー（Firestore段階更新）用 ---
 
-    def create_manual_job(self, manual_id: str, title: str, video_path: str = None) -> str:
+    async def create_manual_job(self, manual_id: str, title: str, video_path: str = None, status: str = "analyzing_structure") -> str:
         """
         解析ジョブの初期レコードを作成
+        status: キューに積んでワーカーの実行を待つ場合は "queued"
         """
         # 1. メタデータ初期化
         now = firestore.SERVER_TIMESTAMP
@@ -160,48 +327,79 @@ class ManualService:
             "id": manual_id,
             "manual_id": manual_id,
             "title": title, # 仮タイトル
-            "status": "analyzing_structure", # ステータス: 構造解析中
-            "steps": [], # 空配列
+            "status": status, # ステータス: 構造解析中 (analyzing_structure) / 実行待ち (queued)
+            "steps_layout": self.steps_layout,
             "video_path": video_path, # GCSパス
             "is_public": False,
             "created_at": now,
             "updated_at": now
         }
+        if self.steps_layout == "subcollection":
+            metadata["step_count"] = 0
+            metadata["completed_step_count"] = 0
+        else:
+            metadata["steps"] = [] # 空配列
         
         # 2. Firestore作成
         # ログインユーザーのID (現状は固定/あとで引数にする)
         user_id = "test-user-001"
         collection_path = f"users/{user_id}/manuals"
-        
-        self.firestore_repository.create_document(
-            collection_path,
-            manual_id,
-            metadata
-        )
+
+        # 同じIDで以前に解析した進捗（バッファ・ステップ）は引き継がない
+        self._discard_progress(manual_id)
+        if self.steps_layout == "subcollection":
+            # 前回の方がステップが多かった場合に古いステップが残らないよう、同じバッチで削除する
+            await self.firestore_repository.batch_write(
+                sets=[(collection_path, manual_id, metadata)],
+                deletes=await self._step_documents(collection_path, manual_id)
+            )
+        else:
+            await self.firestore_repository.create_document(
+                collection_path,
+                manual_id,
+                metadata
+            )
         return manual_id
 
-    def update_manual_status(self, manual_id: str, status: str):
-        """ステータスのみ更新"""
+    async def reset_manual_job(self, manual_id: str, status: str = "analyzing_structure"):
+        """
+        ジョブの再試行を始める前に、前回の試行で書き込んだステップを消してステータスを戻す
+        （別のワーカーで再試行される場合も、前回の途中までのステップが残らないようにする）
+        """
         user_id = "test-user-001"
         collection_path = f"users/{user_id}/manuals"
-        self.firestore_repository.update_document(collection_path, manual_id, {
-            "status": status,
-            "updated_at": firestore.SERVER_TIMESTAMP
-        })
 
-    def init_manual_steps(self, manual_id: str, steps_structure: List[Dict]):
+        self._discard_progress(manual_id)
+        data = {"status": status, "updated_at": firestore.SERVER_TIMESTAMP}
+        deletes = []
+        if self.steps_layout == "subcollection":
+            data["step_count"] = 0
+            data["completed_step_count"] = 0
+            deletes = await self._step_documents(collection_path, manual_id)
+        else:
+            data["steps"] = []
+        await self.firestore_repository.batch_write(updates=[(collection_path, manual_id, data)], deletes=deletes)
+
+    async def _step_documents(self, collection_path: str, manual_id: str) -> List[tuple]:
+        """
+        サブコレクションに保存済みのステップの (collection, document_id) 一覧
+        """
+        steps_path = f"{collection_path}/{manual_id}/steps"
+        return [(steps_path, doc["id"]) for doc in await self.firestore_repository.query_collection(steps_path)]
+
+    async def update_manual_status(self, manual_id: str, status: str):
+        """ステータスのみ更新（completed / error の場合は即時書き込み）"""
+        await self._buffer_progress(manual_id, {"status": status}, final=status in TERMINAL_STATUSES)
+
+    async def init_manual_steps(self, manual_id: str, steps_structure: List[Dict]):
         """
         Phase 1完了時: ステップの骨組み（タイトル・タイムスタンプ）を保存
         """
-        user_id = "test-user-001"
-        collection_path = f"users/{user_id}/manuals"
-        
         # 配列をそのまま保存
-        self.firestore_repository.update_document(collection_path, manual_id, {
+        await self._buffer_progress(manual_id, {
             "steps": steps_structure,
             "step_count": len(steps_structure),
             "status": "extracting_images", # 次のステータスへ
-            "updated_at": firestore.SERVER_TIMESTAMP
         })
 
     def update_step_detail(self, manual_id: str, step_index: int, step_data: Dict):
@@ -220,46 +418,206 @@ class ManualService:
         """
         pass # 下記 update_all_steps を使う
 
-    def update_manual_steps(self, manual_id: str, all_steps: List[Dict], status: str = None):
+    async def update_manual_steps(self, manual_id: str, all_steps: List[Dict], status: str = None):
         """
         ステップ配列全体を更新する（進捗反映用）
+        書き込みはバッファされ、PROGRESS_FLUSH_INTERVAL_MS ごとにまとめて反映される
         """
-        user_id = "test-user-001"
-        collection_path = f"users/{user_id}/manuals"
-        
-        data = {
-            "steps": all_steps,
-            "updated_at": firestore.SERVER_TIMESTAMP
-        }
+        data = {"steps": all_steps}
         if status:
             data["status"] = status
 
-        self.firestore_repository.update_document(collection_path, manual_id, data)
+        await self._buffer_progress(manual_id, data, final=status in TERMINAL_STATUSES)
+
+    async def complete_manual_job(self, manual_id: str, final_steps: List[Dict], analysis_stats: Optional[Dict[str, Any]] = None):
+        """
+        全工程完了（未反映の変更と合わせて即時書き込み）
+        analysis_stats: 解析の集計（ステップ数・解析したフレーム数・重複率）
+        """
+        data = {
+            "steps": final_steps,
+            "status": "completed",
+        }
+        if analysis_stats is not None:
+            data["analysis_stats"] = analysis_stats
+        await self._buffer_progress(manual_id, data, final=True)
 
-    def complete_manual_job(self, manual_id: str, final_steps: List[Dict]):
+    async def flush_progress(self, manual_id: str):
         """
-        全工程完了
+        未反映の進捗を即時に書き込む
+        """
+        buffer = ManualService._progress_buffers.get(manual_id)
+        if buffer:
+            await self._flush_progress(manual_id, buffer)
+
+    # --- 進捗書き込みのバッファリング（write-behind） ---
+
+    def _discard_progress(self, manual_id: str):
+        """
+        未反映の進捗と前回書き込んだ値を捨てる（ジョブを作り直すとき）
+        """
+        buffer = ManualService._progress_buffers.pop(manual_id, None)
+        if buffer:
+            buffer.cancel_timer()
+
+    async def _buffer_progress(self, manual_id: str, data: Dict[str, Any], final: bool = False):
+        """
+        変更をジョブごとのバッファにマージし、最短 PROGRESS_FLUSH_INTERVAL_MS 間隔で書き込む。
+        final=True の場合はバッファを即時に書き込んで破棄する。
+        """
+        metrics.incr("progress.updates")
+
+        buffer = ManualService._progress_buffers.get(manual_id)
+        if buffer is None:
+            buffer = _ProgressBuffer()
+            ManualService._progress_buffers[manual_id] = buffer
+        if final:
+            ManualService._progress_buffers.pop(manual_id, None)
+
+        # 書き込み中（ロック保持中）でもマージはでき、次の書き込みにまとめられる
+        buffer.merge(data)
+
+        if final:
+            buffer.cancel_timer()
+            flush_now = True
+        else:
+            wait = PROGRESS_FLUSH_INTERVAL_MS / 1000 - (time.monotonic() - buffer.last_flush)
+            flush_now = wait <= 0 and not buffer.lock.locked()
+            if not flush_now and buffer.timer is None:
+                # 間隔が空いていない場合は残り時間後にまとめて書き込む
+                buffer.timer = asyncio.get_running_loop().call_later(
+                    max(wait, 0), self._schedule_flush, manual_id, buffer
+                )
+
+        if flush_now:
+            await self._flush_progress(manual_id, buffer)
+
+    def _schedule_flush(self, manual_id: str, buffer: "_ProgressBuffer"):
+        buffer.timer = None
+        task = asyncio.ensure_future(self._flush_progress(manual_id, buffer))
+        # 遅延書き込みの失敗は次回の書き込みで再送されるので、ここでは例外を回収するだけ
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _flush_progress(self, manual_id: str, buffer: "_ProgressBuffer"):
+        async with buffer.lock:
+            buffer.cancel_timer()
+            if not buffer.pending:
+                return
+
+            data = buffer.pending
+            buffer.pending = {}
+            pending_since = buffer.pending_since
+
+            # ロックを保持したまま書き込み、同じジョブの書き込み順序を保つ
+            start_time = time.monotonic()
+            try:
+                await self._write_progress(manual_id, data, buffer.written.get("steps"))
+            except Exception as e:
+                print(f"Progress flush failed for {manual_id}: {e}")
+                # 次回の書き込みで再送する（新しい変更を優先）
+                buffer.pending = {**data, **buffer.pending}
+                raise
+            finally:
+                buffer.last_flush = time.monotonic()
+
+            buffer.written.update(data)
+            metrics.incr("progress.writes")
+            metrics.observe("progress.flush_latency_ms", (buffer.last_flush - start_time) * 1000)
+            metrics.observe("progress.flush_delay_ms", (start_time - pending_since) * 1000)
+
+    async def _write_progress(self, manual_id: str, data: Dict[str, Any], previous_steps: Optional[List[Dict]] = None):
+        """
+        進捗をFirestoreに書き込む（保存形式に応じて steps の書き方を切り替える）
+        previous_steps: 前回書き込んだ steps（subcollection 形式では差分のみ書き込む）
         """
         user_id = "test-user-001"
         collection_path = f"users/{user_id}/manuals"
-        
-        self.firestore_repository.update_document(collection_path, manual_id, {
-            "steps": final_steps,
+        data = {**data, "updated_at": firestore.SERVER_TIMESTAMP}
+
+        if self.steps_layout != "subcollection" or "steps" not in data:
+            await self.firestore_repository.update_document(collection_path, manual_id, data)
+            return
+
+        # 変更のあったステップだけを1ステップ1ドキュメントでバッチ書き込みし、
+        # マニュアル本体には集計値のみを残す
+        steps = data.pop("steps")
+        previous_steps = previous_steps or []
+        steps_path = f"{collection_path}/{manual_id}/steps"
+
+        sets = [
+            (steps_path, str(index), {**step, "index": index})
+            for index, step in enumerate(steps)
+            if index >= len(previous_steps) or previous_steps[index] != step
+        ]
+        deletes = [(steps_path, str(index)) for index in range(len(steps), len(previous_steps))]
+
+        data["step_count"] = len(steps)
+        data["completed_step_count"] = len([s for s in steps if s.get("highlight_box")])
+
+        await self.firestore_repository.batch_write(
+            sets=sets,
+            updates=[(collection_path, manual_id, data)],
+            deletes=deletes
+        )
+
+    # --- 同一動画の解析結果の再利用 ---
+
+    def _job_result_id(self, video_hash: str, prompt_version: str, model_name: str) -> str:
+        return f"{video_hash}_{prompt_version}_{model_name}".replace("/", "_")
+
+    async def find_job_result(self, video_hash: str, prompt_version: str, model_name: str) -> Optional[Dict[str, Any]]:
+        """
+        同じ動画・プロンプト・モデルで完了済みの解析結果を探す
+        """
+        return await self.firestore_repository.get_document(
+            JOB_RESULTS_COLLECTION,
+            self._job_result_id(video_hash, prompt_version, model_name)
+        )
+
+    async def record_job_result(self, video_hash: str, prompt_version: str, model_name: str, manual_id: str, steps: List[Dict], duration: float, gemini_calls: int):
+        """
+        完了した解析結果を動画のハッシュをキーに保存する
+        """
+        await self.firestore_repository.create_document(
+            JOB_RESULTS_COLLECTION,
+            self._job_result_id(video_hash, prompt_version, model_name),
+            {
+                "video_hash": video_hash,
+                "prompt_version": prompt_version,
+                "model_name": model_name,
+                "source_manual_id": manual_id,
+                "steps": steps,
+                "step_count": len(steps),
+                "duration_seconds": duration,
+                "gemini_calls": gemini_calls,
+                "created_at": firestore.SERVER_TIMESTAMP
+            }
+        )
+
+    async def apply_job_result(self, manual_id: str, job_result: Dict[str, Any]):
+        """
+        保存済みの解析結果（構成・各ステップ詳細・GCS画像の参照）を新しいマニュアルにコピーして完了にする
+        """
+        steps = job_result.get("steps", [])
+        # 通常の完了と同じく進捗バッファを通し、未反映の進捗の後に書き込んでバッファを破棄する
+        await self._buffer_progress(manual_id, {
+            "steps": steps,
+            "step_count": len(steps),
             "status": "completed",
-            "updated_at": firestore.SERVER_TIMESTAMP
-        })
+            "reused_from": job_result.get("source_manual_id")
+        }, final=True)
 
-    def update_visibility(self, user_id: str, manual_id: str, is_public: bool) -> bool:
+    async def update_visibility(self, user_id: str, manual_id: str, is_public: bool) -> bool:
         """
         公開状態を更新
         """
         try:
             collection_path = f"users/{user_id}/manuals"
-            doc = self.firestore_repository.get_document(collection_path, manual_id)
+            doc = await self.firestore_repository.get_document(collection_path, manual_id)
             if not doc:
                 return False
 
-            self.firestore_repository.update_document(collection_path, manual_id, {
+            await self.firestore_repository.update_document(collection_path, manual_id, {
                 "is_public": is_public,
                 "updated_at": firestore.SERVER_TIMESTAMP
             })
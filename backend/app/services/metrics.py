@@ -0,0 +1,45 @@
+# プロセス内のパフォーマンス指標（カウンタ・計測値）を集計するクラス
+import threading
+from typing import Dict, Any
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._observations: Dict[str, Dict[str, float]] = {}
+
+    # カウンタの加算
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    # 計測値（レイテンシなど）の記録
+    def observe(self, name: str, value: float) -> None:
+        """
+        count / total / max / last を保持する
+        """
+        with self._lock:
+            stats = self._observations.get(name)
+            if stats is None:
+                stats = {"count": 0, "total": 0.0, "max": value, "last": value}
+                self._observations[name] = stats
+            stats["count"] += 1
+            stats["total"] += value
+            stats["max"] = max(stats["max"], value)
+            stats["last"] = value
+
+    # 現在値のスナップショット
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            observations = {
+                name: {**stats, "avg": stats["total"] / stats["count"] if stats["count"] else 0.0}
+                for name, stats in self._observations.items()
+            }
+            return {
+                "counters": dict(self._counters),
+                "observations": observations
+            }
+
+
+metrics = Metrics()
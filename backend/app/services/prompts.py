@@ -1,3 +1,6 @@
+# プロンプトを変更したら更新する（解析結果キャッシュのキーに含まれる）
+PROMPT_VERSION = "1"
+
 VIDEO_ANALYSIS_PROMPT = """
 あなたは熟練のテクニカルライターです。動画を分析し、ユーザーマニュアル用の「操作手順タイトル」と「スクリーンショット用タイムスタンプ」を抽出してください。
 
@@ -67,3 +70,40 @@ IMAGE_ANALYSIS_PROMPT = """
 
 文体は「〜をクリックします」「〜を入力します」という敬体（です・ます）で統一してください。
 """
+
+# 複数の画像をまとめて解析する場合のプロンプト（IMAGE_BATCH_SIZE > 1）
+# 各画像の直前に「画像 i: 操作タイトル」を渡し、画像ごとに IMAGE_ANALYSIS_PROMPT の指示を適用させる
+BATCH_IMAGE_ANALYSIS_PROMPT = """
+これから {count} 枚のUIスクリーンショットを順番に渡します。各画像の直前に「画像 i: 操作タイトル」を付けています（i は 0 から始まる番号）。
+各画像を独立に分析し、以下の指示を画像ごとに適用してください。指示中の「操作タイトル」は、その画像に付けたタイトルのことです。
+
+## 出力要件（複数画像）
+- 画像と同じ順番で、ちょうど {count} 件のリストを出力してください。
+- 各要素の index には、対応する画像の番号 i を入れてください。
+- ある画像の内容（ボタンや個人情報の位置）を、別の画像の結果に混ぜないでください。
+""" + IMAGE_ANALYSIS_PROMPT.replace("「{title}」", "（その画像の操作タイトル）")
+
+# Phase 1 を動画全体ではなく、ローカルで検出した画面の切り替わりごとのフレームで行う場合のプロンプト（PHASE1_MODE=keyframes / strip）
+KEYFRAME_STRUCTURE_PROMPT = """
+あなたは熟練のテクニカルライターです。画面録画から自動で検出した「画面が切り替わった後の静止フレーム（候補）」を時系列順に渡します。
+{layout}
+これらを、ユーザーマニュアル用の操作手順にまとめてください。
+
+## 1. グルーピング指示（粒度の調整）
+**「1つの画面フォーム=1つのステップ」として扱ってください。**
+- 同じ画面が続く候補（フォームの入力途中の状態など）は1つのステップにまとめてください。
+- 画面全体が遷移する、または重要なモーダル/ダイアログが開閉する候補のみ、新しいステップとして切り分けてください。
+- 操作と関係のない候補（ローディング画面、一瞬だけ表示された画面など）は使わないでください。
+
+## 2. スクリーンショットの選定
+各ステップについて、スクリーンショットとして最も適した候補を1つ選んでください。
+- **ベストショット**: 全ての項目が入力済みで、かつ「送信/登録ボタン」をクリックする前の候補。
+- **除外対象**: ブラウザの「パスワードを保存しますか？」ポップアップ、オートコンプリートのリスト、ツールチップ、ローディングスピナーで画面が隠れている候補。
+
+## 出力要件
+KeyframeStep オブジェクトのリストを時系列順に出力してください。
+candidate には選んだ候補の番号、title には簡潔な日本語の操作タイトルを入れてください。
+"""
+
+KEYFRAME_LAYOUT = "各画像の直前に「候補 番号 (時刻)」を付けています。"
+STRIP_LAYOUT = "候補は複数枚ずつ1枚の画像に並べており、各コマの左上に「#番号 時刻」を表示しています（左上から右へ、上から下への順）。"
@@ -0,0 +1,326 @@
+# Gemini 呼び出しのレート制御
+# - リクエスト数/分 (RPM) とトークン数/分 (TPM) のトークンバケットで送信ペースをクォータ以下に保つ
+# - 同時実行数は AIMD で調整する（成功ごとに少しずつ増やし、429/503 を受けたら半分にする）
+# - GEMINI_RATE_LIMIT_DB を指定するとバケットを SQLite で共有し、複数プロセス（Web・ワーカー）の合計で制限する
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, AsyncIterator
+
+from app.services.metrics import metrics
+
+# 0 の場合は制限しない
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "600"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "4000000"))
+# 同時実行数の上限・下限（AIMD はこの範囲で調整する）
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_MIN_CONCURRENCY = int(os.getenv("GEMINI_MIN_CONCURRENCY", "1"))
+# 429/503 で同時実行数を半分にした後、次に減らすまでの間隔（同じ混雑で何度も半減させない）
+GEMINI_BACKOFF_COOLDOWN = float(os.getenv("GEMINI_BACKOFF_COOLDOWN", "2.0"))
+# プロセス間でバケットを共有する SQLite ファイル（未指定ならプロセス内のみ）
+GEMINI_RATE_LIMIT_DB = os.getenv("GEMINI_RATE_LIMIT_DB")
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+
+# 実際の使用量を観測するまでの呼び出し種別ごとのトークン数の見積もり
+DEFAULT_TOKEN_ESTIMATES = {
+    "video_structure": 30000,
+    "image_detail": 2000,
+    "image_batch": 8000,
+    "keyframe_structure": 20000,
+}
+DEFAULT_TOKEN_ESTIMATE = 2000
+
+# バケットが capacity まで回復する時間（秒）
+BUCKET_WINDOW_SECONDS = 60.0
+
+# 過負荷とみなすHTTPステータス
+OVERLOAD_STATUS_CODES = {429, 503}
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """google-genai の APIError（code）や httpx のエラー（response.status_code）から 429/503 を判定する"""
+    code = getattr(error, "code", None)
+    if code is None:
+        response = getattr(error, "response", None)
+        code = getattr(response, "status_code", None)
+    return code in OVERLOAD_STATUS_CODES
+
+
+def _refill(level: float, updated: float, now: float, capacity: float) -> float:
+    # BUCKET_WINDOW_SECONDS（1分）で capacity まで回復する
+    return min(capacity, level + (now - updated) * capacity / BUCKET_WINDOW_SECONDS)
+
+
+class TokenBucket:
+    """
+    1分あたり capacity まで取り出せるバケット（プロセス内）
+    取り出しは到着順（asyncio.Lock は FIFO）で、足りない場合は回復するまで待つ
+    """
+    def __init__(self, name: str, capacity: float):
+        self.name = name
+        self.capacity = float(capacity)
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._state_lock = threading.Lock()
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def _lock(self) -> asyncio.Lock:
+        # asyncio のプリミティブはイベントループごとに作る（テストやワーカーでループが変わっても使えるように）
+        loop_id = id(asyncio.get_running_loop())
+        lock = self._locks.get(loop_id)
+        if lock is None:
+            lock = self._locks[loop_id] = asyncio.Lock()
+        return lock
+
+    def _try_take(self, amount: float) -> float:
+        """取り出せた場合は 0、足りない場合は待つべき秒数を返す"""
+        with self._state_lock:
+            now = time.monotonic()
+            self._level = _refill(self._level, self._updated, now, self.capacity)
+            self._updated = now
+            if self._level >= amount:
+                self._level -= amount
+                return 0.0
+            return (amount - self._level) * BUCKET_WINDOW_SECONDS / self.capacity
+
+    async def _try_take_async(self, amount: float) -> float:
+        return self._try_take(amount)
+
+    async def take(self, amount: float):
+        # 1回で取り出せる量は capacity まで（それ以上の見積もりは capacity として扱う）
+        amount = min(amount, self.capacity)
+        async with self._lock():
+            while True:
+                wait = await self._try_take_async(amount)
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+
+    def adjust(self, delta: float):
+        """
+        見積もりと実際の使用量の差を反映する（delta > 0 で追加消費、< 0 で返却）
+        超過分は負の残高として次の呼び出しを待たせる
+        """
+        with self._state_lock:
+            self._level = max(-self.capacity, min(self.capacity, self._level - delta))
+
+    async def adjust_async(self, delta: float):
+        self.adjust(delta)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    残量を SQLite に保存し、同じファイルを使う全プロセスで共有するバケット
+    """
+    def __init__(self, name: str, capacity: float, path: str):
+        super().__init__(name, capacity)
+        self.path = path
+        db = self._connect()
+        try:
+            db.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)")
+        finally:
+            db.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _update(self, amount: float, allow_debt: bool) -> float:
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = db.execute("SELECT level, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            level = _refill(row[0], row[1], now, self.capacity) if row else self.capacity
+            wait = 0.0
+            if allow_debt:
+                level = max(-self.capacity, min(self.capacity, level - amount))
+            elif level >= amount:
+                level -= amount
+            else:
+                wait = (amount - level) * BUCKET_WINDOW_SECONDS / self.capacity
+            db.execute(
+                "INSERT INTO buckets (name, level, updated) VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE SET level = excluded.level, updated = excluded.updated",
+                (self.name, level, now)
+            )
+            db.execute("COMMIT")
+            return wait
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    async def _try_take_async(self, amount: float) -> float:
+        return await asyncio.to_thread(self._update, amount, False)
+
+    def adjust(self, delta: float):
+        try:
+            self._update(delta, True)
+        except sqlite3.Error as e:
+            print(f"Rate limiter adjust failed: {e}")
+
+    async def adjust_async(self, delta: float):
+        # SQLite のロック待ちでイベントループを止めないようにスレッドで行う
+        await asyncio.to_thread(self.adjust, delta)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD で上限を変える同時実行数の制限
+    成功: limit += 1/limit（上限まで少しずつ増やす）、過負荷: limit *= 0.5（GEMINI_BACKOFF_COOLDOWN に1回まで）
+    """
+    def __init__(self, maximum: int, minimum: int = 1, cooldown: float = GEMINI_BACKOFF_COOLDOWN):
+        self.maximum = max(maximum, 1)
+        self.minimum = max(min(minimum, self.maximum), 1)
+        self.cooldown = cooldown
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._conditions: Dict[int, asyncio.Condition] = {}
+
+    def _condition(self) -> asyncio.Condition:
+        loop_id = id(asyncio.get_running_loop())
+        condition = self._conditions.get(loop_id)
+        if condition is None:
+            condition = self._conditions[loop_id] = asyncio.Condition()
+        return condition
+
+    async def acquire(self):
+        condition = self._condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        condition = self._condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_overload(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * 0.5)
+        metrics.incr("rate_limiter.decreases")
+
+
+class RateLimitedCall:
+    """
+    1回の呼び出しの情報（待ち時間・トークン数）
+    """
+    def __init__(self, kind: str, estimated_tokens: int, queue_seconds: float = 0.0):
+        self.kind = kind
+        self.estimated_tokens = estimated_tokens
+        self.queue_seconds = queue_seconds
+        self.tokens_used: Optional[int] = None
+
+    def record_usage(self, usage_metadata):
+        """レスポンスの usage_metadata から実際のトークン数を記録する"""
+        total = getattr(usage_metadata, "total_token_count", None) if usage_metadata is not None else None
+        if total:
+            self.tokens_used = int(total)
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rpm: int = GEMINI_RPM,
+        tpm: int = GEMINI_TPM,
+        max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+        min_concurrency: int = GEMINI_MIN_CONCURRENCY,
+        shared_path: Optional[str] = GEMINI_RATE_LIMIT_DB
+    ):
+        def bucket(name: str, capacity: int) -> Optional[TokenBucket]:
+            if capacity <= 0:
+                return None
+            return SharedTokenBucket(name, capacity, shared_path) if shared_path else TokenBucket(name, capacity)
+
+        self.requests = bucket("gemini_requests", rpm)
+        self.tokens = bucket("gemini_tokens", tpm)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_concurrency)
+        self._estimates: Dict[str, float] = dict(DEFAULT_TOKEN_ESTIMATES)
+
+    def estimate_tokens(self, kind: str) -> int:
+        return int(self._estimates.get(kind, DEFAULT_TOKEN_ESTIMATE))
+
+    async def _record_tokens(self, call: RateLimitedCall):
+        if call.tokens_used is None:
+            return
+        # 見積もりとの差をバケットに反映し、次回の見積もりを実測値の移動平均にする
+        if self.tokens:
+            await self.tokens.adjust_async(call.tokens_used - call.estimated_tokens)
+        previous = self._estimates.get(call.kind)
+        self._estimates[call.kind] = call.tokens_used if previous is None else previous * 0.8 + call.tokens_used * 0.2
+        metrics.incr("rate_limiter.tokens", call.tokens_used)
+
+    @asynccontextmanager
+    async def acquire(self, kind: str, estimated_tokens: Optional[int] = None) -> AsyncIterator[RateLimitedCall]:
+        """
+        同時実行枠とバケットを確保してから呼び出しを行う
+            async with limiter.acquire("image_detail") as call:
+                response = await ...
+                call.record_usage(response.usage_metadata)
+        """
+        estimate = estimated_tokens or self.estimate_tokens(kind)
+        start_time = time.monotonic()
+        await self.concurrency.acquire()
+        try:
+            if self.requests:
+                await self.requests.take(1)
+            if self.tokens:
+                await self.tokens.take(estimate)
+        except BaseException:
+            await self.concurrency.release()
+            raise
+
+        call = RateLimitedCall(kind, estimate, time.monotonic() - start_time)
+        metrics.observe("rate_limiter.queue_seconds", call.queue_seconds)
+        metrics.observe(f"rate_limiter.{kind}.queue_seconds", call.queue_seconds)
+        try:
+            yield call
+        except Exception as e:
+            if is_overload_error(e):
+                metrics.incr("rate_limiter.overloads")
+                self.concurrency.on_overload()
+            raise
+        else:
+            self.concurrency.on_success()
+        finally:
+            # 同時実行枠を先に返す（使用量の反映中に中断されても枠を失わない）
+            await self.concurrency.release()
+            metrics.observe("rate_limiter.concurrency_limit", self.concurrency.limit)
+            await self._record_tokens(call)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            **{f"estimate.{kind}": round(value) for kind, value in self._estimates.items()}
+        }
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """
+    プロセス共通のレートリミッターを取得する（無効化されている場合は None）
+    """
+    global _rate_limiter
+    if not RATE_LIMIT_ENABLED:
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+        return _rate_limiter
@@ -0,0 +1,83 @@
+# アップロードされたファイル（UploadFile）をイベントループを止めずにディスクへ保存する
+# チャンクごとの書き込みとハッシュ計算はスレッドで行い、その間も他のリクエストを処理できるようにする
+import os
+import time
+import asyncio
+import hashlib
+from typing import Optional, BinaryIO
+
+from fastapi import UploadFile
+
+from app.services.metrics import metrics
+
+# 受け付けるアップロードの最大サイズ（バイト）
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(2 * 1024 * 1024 * 1024)))
+# 1回に読み書きするサイズ
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+
+class UploadTooLargeError(Exception):
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        super().__init__(f"Upload exceeds the maximum size of {max_bytes} bytes")
+
+
+class StoredUpload:
+    """
+    保存済みのアップロードファイル（後続の処理にパス・ハッシュ・サイズを渡す）
+    """
+    def __init__(self, path: str, size: int, sha256: str, filename: Optional[str] = None, content_type: Optional[str] = None):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+        self.content_type = content_type
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _write_chunk(f: BinaryIO, digest, chunk: bytes):
+    # hashlib は大きなデータではGILを解放するため、書き込みと合わせてスレッドで行う
+    digest.update(chunk)
+    f.write(chunk)
+
+
+async def save_upload(upload: UploadFile, destination_path: str, max_bytes: int = MAX_UPLOAD_BYTES, chunk_size: int = UPLOAD_CHUNK_SIZE) -> StoredUpload:
+    """
+    UploadFile をチャンクごとに destination_path へ書き込み、同時に SHA-256 とサイズを計算する
+    max_bytes を超えた場合は途中のファイルを削除して UploadTooLargeError を送出する
+    """
+    # サイズが分かっている場合は書き込む前に弾く
+    if upload.size is not None and upload.size > max_bytes:
+        metrics.incr("upload.rejected")
+        raise UploadTooLargeError(max_bytes)
+
+    start_time = time.monotonic()
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        f = await asyncio.to_thread(open, destination_path, "wb")
+        try:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    metrics.incr("upload.rejected")
+                    raise UploadTooLargeError(max_bytes)
+                await asyncio.to_thread(_write_chunk, f, digest, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+    except BaseException:
+        # 書きかけのファイルは残さない
+        if os.path.exists(destination_path):
+            os.remove(destination_path)
+        raise
+
+    metrics.incr("upload.bytes", size)
+    metrics.observe("upload.seconds", time.monotonic() - start_time)
+    return StoredUpload(destination_path, size, digest.hexdigest(), upload.filename, upload.content_type)
@@ -1,81 +1,913 @@
 import subprocess
 import os
+import io
+import re
+import time
+import shutil
+import uuid
+import hashlib
+import bisect
 import asyncio
+import tempfile
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.services.metrics import metrics
+
+try:
+    import av
+except ImportError: # PyAV が無い環境では ffmpeg サブプロセスのみを使う
+    av = None
+
+# Frame extraction strategy
+#   per_step: 1ステップごとに ffmpeg を起動する（従来方式）
+#   batch:    1回の ffmpeg 実行で全ステップのフレームを書き出す
+#   decoder:  プロセス内の PyAV デコーダ + キーフレームインデックスで書き出す
+#   auto:     PyAV があれば decoder、無ければタイムスタンプの平均間隔が
+#             FRAME_BATCH_MAX_GAP 秒以下なら batch、それ以外は per_step
+FRAME_EXTRACTION_MODE = os.getenv("FRAME_EXTRACTION_MODE", "auto")
+# batch は区間全体をデコードするため、タイムスタンプが疎な長尺動画ではシークの方が速い
+FRAME_BATCH_MAX_GAP = float(os.getenv("FRAME_BATCH_MAX_GAP", "3.0"))
+# 同時に開いておくデコーダ（動画）の数
+DECODER_CACHE_SIZE = int(os.getenv("DECODER_CACHE_SIZE", "4"))
+# 動画ごとに保持するエンコード済みフレーム（JPEG）の数。再解析やスクラブ時はデコード不要になる
+FRAME_CACHE_SIZE = int(os.getenv("FRAME_CACHE_SIZE", "64"))
+# gs:// の動画を全体ダウンロードせずに、必要な範囲だけ読み込んでフレームを抽出する
+# （PyAV が無い・コンテナがシークできない場合は全体をダウンロードしてから抽出する）
+REMOTE_FRAME_EXTRACTION = os.getenv("REMOTE_FRAME_EXTRACTION", "1") == "1"
+
+# Phase 1（構造解析）には低解像度・低fpsのプロキシ動画を使う（フレーム抽出は元の動画から行う）
+# ステップの検出には大まかな画面の変化が分かれば良いため、アップロード量・一時アップロード時間・動画トークンを減らせる
+PHASE1_PROXY = os.getenv("PHASE1_PROXY", "0") == "1"
+# プロキシの保存先（同じ動画の再解析ではトランスコードを省く）
+PROXY_CACHE_DIR = os.getenv("PROXY_CACHE_DIR", "/tmp/video_proxies")
+# 保存先の上限（超えたら古いものから削除する）
+PROXY_CACHE_MAX_BYTES = int(os.getenv("PROXY_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+PROXY_MAX_HEIGHT = int(os.getenv("PROXY_MAX_HEIGHT", "480"))
+PROXY_FPS = float(os.getenv("PROXY_FPS", "2"))
+PROXY_CRF = int(os.getenv("PROXY_CRF", "32"))
+
+# シーンチェンジ検出（Phase 1 の keyframes / strip モードで使う）
+# 縮小したグレースケールのフレームを SCENE_SAMPLE_FPS で読み、前のフレームから変化した画素の割合で画面の切り替わりを判定する
+SCENE_SAMPLE_FPS = float(os.getenv("SCENE_SAMPLE_FPS", "4"))
+SCENE_FRAME_SIZE = os.getenv("SCENE_FRAME_SIZE", "160x90")
+# 変化したとみなす画素値の差（0-255）
+SCENE_PIXEL_DELTA = int(os.getenv("SCENE_PIXEL_DELTA", "24"))
+# 変化した画素の割合がこれを超えたフレームを切り替わり中とみなす
+SCENE_THRESHOLD = float(os.getenv("SCENE_THRESHOLD", "0.05"))
+# 前後のフレームとの変化がこれ以下のフレームを静止（クリーン）とみなす
+SCENE_STABLE_THRESHOLD = float(os.getenv("SCENE_STABLE_THRESHOLD", "0.002"))
+# これより短い区間（アニメーション・ローディング中など）は候補にしない（秒）
+SCENE_MIN_DURATION = float(os.getenv("SCENE_MIN_DURATION", "1.0"))
+# 候補の最大数（超えた場合は切り替わりの大きいものを残す）
+SCENE_MAX_CANDIDATES = int(os.getenv("SCENE_MAX_CANDIDATES", "80"))
+
+# 抽出したフレームの知覚ハッシュ（dHash）で、ほぼ同じ画面のステップの解析・アップロードを1回にまとめる
+# まとめたステップは代表のステップの解析結果を使うため、既定では無効（同じ画面で操作だけが違う手順を見分けられない場合がある）
+FRAME_DEDUP = os.getenv("FRAME_DEDUP", "0") == "1"
+# dHash の1辺（FRAME_HASH_SIZE^2 ビット）
+FRAME_HASH_SIZE = int(os.getenv("FRAME_HASH_SIZE", "16"))
+# 同じ画面の候補とみなすハミング距離
+FRAME_DEDUP_MAX_DISTANCE = int(os.getenv("FRAME_DEDUP_MAX_DISTANCE", "8"))
+# 候補はカラーの縮小画像（FRAME_DEDUP_THUMBNAIL）で確認し、いずれかのチャンネルが FRAME_DEDUP_PIXEL_DELTA を超えて
+# 変化した画素の割合がこれ以下なら同じ画面とする
+# （ハッシュはグレースケールのため、明るさの近い別の色の画面や、入力内容だけが違う画面をまとめてしまうことがある）
+FRAME_DEDUP_MAX_CHANGE = float(os.getenv("FRAME_DEDUP_MAX_CHANGE", "0.0002"))
+FRAME_DEDUP_THUMBNAIL = os.getenv("FRAME_DEDUP_THUMBNAIL", "128x72")
+# 変化したとみなす画素値の差（0-255。JPEG の圧縮ノイズより大きくする）
+FRAME_DEDUP_PIXEL_DELTA = int(os.getenv("FRAME_DEDUP_PIXEL_DELTA", "24"))
+
+# showinfo フィルタのログから出力フレームの時刻を拾う
+_PTS_TIME_PATTERN = re.compile(r"Parsed_showinfo.*?pts_time:\s*(-?[\d.]+)")
+
+
+def _split_gcs_uri(uri: str) -> Tuple[str, str]:
+    bucket_name, _, blob_name = uri[len("gs://"):].partition("/")
+    return bucket_name, blob_name
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _prune_proxy_cache(keep: str):
+    """
+    プロキシの合計サイズが PROXY_CACHE_MAX_BYTES を超えていれば、最後に使った時刻が古いものから削除する
+    """
+    entries = []
+    for name in os.listdir(PROXY_CACHE_DIR):
+        path = os.path.join(PROXY_CACHE_DIR, name)
+        if name.endswith(".tmp.mp4") or path == keep:
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= PROXY_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            metrics.incr("proxy.evictions")
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+# 同じプロキシを同時に作らないためのロック（パスごと）と、それを待っている・保持している呼び出しの数
+# 数が 0 になるまで削除しない（待っている呼び出しと新しい呼び出しが別のロックを使わないように）
+_proxy_locks: Dict[str, list] = {}
+
+
+def seconds_to_timestamp(seconds: float) -> str:
+    """
+    秒を "MM:SS"（端数がある場合は "MM:SS.s"）形式にする
+    """
+    minutes, secs = divmod(round(seconds, 1), 60)
+    if secs % 1:
+        return f"{int(minutes):02d}:{secs:04.1f}"
+    return f"{int(minutes):02d}:{int(secs):02d}"
+
+
+def frame_change_ratios(video_path: str, fps: float = SCENE_SAMPLE_FPS, size: str = SCENE_FRAME_SIZE, pixel_delta: int = SCENE_PIXEL_DELTA, chunk_frames: int = 256) -> np.ndarray:
+    """
+    fps ごとに縮小したグレースケールのフレームを ffmpeg から読み、前のフレームから変化した画素の割合を返す
+    （ratios[i] はフレーム i-1 → i の変化。ratios[0] は 0）。メモリは chunk_frames フレーム分だけ使う
+    """
+    width, height = (int(v) for v in size.split("x"))
+    frame_bytes = width * height
+    command = [
+        "ffmpeg", "-loglevel", "error",
+        "-i", video_path,
+        "-vf", f"fps={fps:g},scale={width}:{height}:flags=area,format=gray",
+        "-f", "rawvideo", "-pix_fmt", "gray",
+        "-"
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    ratios = [np.zeros(1, dtype=np.float32)]
+    previous = None
+    try:
+        while True:
+            data = process.stdout.read(frame_bytes * chunk_frames)
+            count = len(data) // frame_bytes
+            if count == 0:
+                break
+            frames = np.frombuffer(data[:count * frame_bytes], dtype=np.uint8).reshape(count, height, width).astype(np.int16)
+            if previous is not None:
+                frames = np.concatenate((previous, frames))
+            changed = np.abs(np.diff(frames, axis=0)) > pixel_delta
+            ratios.append(changed.mean(axis=(1, 2), dtype=np.float32))
+            previous = frames[-1:]
+        stderr = process.stderr.read()
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
+    if previous is None:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(ratios)
+
+
+def find_scene_candidates(ratios: np.ndarray, fps: float = SCENE_SAMPLE_FPS, threshold: float = SCENE_THRESHOLD, stable_threshold: float = SCENE_STABLE_THRESHOLD, min_duration: float = SCENE_MIN_DURATION, max_candidates: int = SCENE_MAX_CANDIDATES) -> List[dict]:
+    """
+    変化率の列から、画面が切り替わった後の安定した区間と、その区間のクリーンなフレームを求める
+    クリーンなフレームは区間内で前後のフレームとの変化が stable_threshold 以下の最後のフレーム
+    （次の操作の直前。無ければ区間内で最も変化の小さいフレーム）
+    returns: [{"timestamp", "seconds", "start", "end", "score"}]（score は区間の直前の切り替わりの大きさ）
+    """
+    if len(ratios) == 0:
+        return []
+
+    changing = ratios > threshold
+    # 切り替わり中でないフレームが続く区間 [start, end)
+    edges = np.diff(np.concatenate(([1], changing.astype(np.int8), [1])))
+    starts = np.flatnonzero(edges == -1)
+    ends = np.flatnonzero(edges == 1)
+    keep = (ends - starts) / fps >= min_duration
+    starts, ends = starts[keep], ends[keep]
+
+    # 前後のフレームとの変化がどちらも小さいフレーム
+    next_ratios = np.append(ratios[1:], 0)
+    quiet = (ratios <= stable_threshold) & (next_ratios <= stable_threshold)
+
+    candidates = []
+    previous_end = 0
+    for start, end in zip(starts, ends):
+        quiet_frames = np.flatnonzero(quiet[start:end])
+        if len(quiet_frames):
+            clean = start + quiet_frames[-1]
+        else:
+            segment = ratios[start:end]
+            clean = start + len(segment) - 1 - int(np.argmin(segment[::-1]))
+        score = float(ratios[previous_end:start + 1].max()) if start > 0 else 1.0
+        seconds = float(clean / fps)
+        candidates.append({
+            "timestamp": seconds_to_timestamp(seconds),
+            "seconds": seconds,
+            "start": float(start / fps),
+            "end": float(end / fps),
+            "score": score
+        })
+        previous_end = end
+
+    if len(candidates) > max_candidates:
+        # 切り替わりの大きいものを残す（時系列順は保つ）
+        ranked = sorted(range(len(candidates)), key=lambda i: candidates[i]["score"], reverse=True)[:max_candidates]
+        candidates = [candidates[i] for i in sorted(ranked)]
+    return candidates
+
+
+def frame_signature(image_path: str, hash_size: int = FRAME_HASH_SIZE, thumbnail_size: str = FRAME_DEDUP_THUMBNAIL) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    dHash のビット列（横に隣り合う画素の大小）と、確認用のカラーの縮小画像を返す
+    """
+    width, height = (int(v) for v in thumbnail_size.split("x"))
+    with Image.open(image_path) as image:
+        image.draft("RGB", (width * 2, height * 2))
+        rgb = image.convert("RGB")
+    pixels = np.asarray(rgb.convert("L").resize((hash_size + 1, hash_size), Image.BOX), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    thumbnail = np.asarray(rgb.resize((width, height), Image.BOX), dtype=np.int16)
+    return bits, thumbnail
+
+
+def find_duplicate_frames(image_paths: List[str], max_distance: int = FRAME_DEDUP_MAX_DISTANCE, max_change: float = FRAME_DEDUP_MAX_CHANGE, pixel_delta: int = FRAME_DEDUP_PIXEL_DELTA) -> List[int]:
+    """
+    ほぼ同じ画面の画像をまとめる
+    returns: 各画像の代表（同じ画面の最初の画像）の位置。読み込めない画像は自分自身を代表にする
+    """
+    representatives = list(range(len(image_paths)))
+    rep_positions: List[int] = []
+    rep_bits: List[np.ndarray] = []
+    rep_thumbnails: List[np.ndarray] = []
+    for position, image_path in enumerate(image_paths):
+        try:
+            bits, thumbnail = frame_signature(image_path)
+        except Exception as e:
+            print(f"Failed to hash frame {image_path}: {e}")
+            continue
+
+        if rep_positions:
+            # ハミング距離はまとめて計算し、近いものだけ縮小画像で確認する
+            distances = np.count_nonzero(np.stack(rep_bits) != bits, axis=1)
+            for candidate in np.flatnonzero(distances <= max_distance):
+                changed = np.mean(np.abs(rep_thumbnails[candidate] - thumbnail).max(axis=2) > pixel_delta)
+                if changed <= max_change:
+                    representatives[position] = rep_positions[candidate]
+                    break
+        if representatives[position] == position:
+            rep_positions.append(position)
+            rep_bits.append(bits)
+            rep_thumbnails.append(thumbnail)
+    return representatives
+
+
+def timestamp_to_seconds(timestamp: str) -> float:
+    """
+    "MM:SS" / "HH:MM:SS" / "SS(.fff)" 形式のタイムスタンプを秒に変換する
+    """
+    seconds = 0.0
+    for part in timestamp.strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+class _DecoderEntry:
+    """
+    1本の動画に対する常駐デコーダとキーフレーム/PTSインデックス
+    source にはローカルのパスか、シーク可能なファイルオブジェクト（GCSRangeReader）を渡す。
+    build_index=False の場合は全パケットの走査を省き、コンテナ自体のインデックスでシークする
+    （リモートの動画で全体を読み込まないため）。
+    """
+    def __init__(self, source, file_key: tuple, build_index: bool = True):
+        self.file_key = file_key
+        self.lock = threading.Lock()
+        # 使用中の数と、キャッシュから外されたか（どちらも _decoder_cache_lock で保護する）
+        # 使用中のデコーダは閉じず、最後の利用者が返却したときに閉じる
+        self.users = 0
+        self.evicted = False
+        self.reader = None if isinstance(source, str) else source
+        self.container = av.open(source)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.time_base = float(self.stream.time_base)
+        # ffmpeg CLI と同じく、タイムスタンプはファイル先頭からの相対時間として扱う
+        self.start_pts = self.stream.start_time or 0
+
+        # 初回のみパケットを走査（デコードはしない）してインデックスを作る
+        self.frame_pts: Optional[List[int]] = [] if build_index else None
+        self.keyframe_pts: List[int] = []
+        for packet in (self.container.demux(self.stream) if build_index else ()):
+            if packet.pts is None:
+                continue
+            self.frame_pts.append(packet.pts)
+            if packet.is_keyframe:
+                self.keyframe_pts.append(packet.pts)
+        if build_index:
+            self.frame_pts.sort()
+            self.keyframe_pts.sort()
+
+        self._frames = None # 直前のデコード位置から再開するためのイテレータ
+        self._last_pts = None
+        self._jpeg_cache: "OrderedDict[int, bytes]" = OrderedDict()
+
+    def jpeg_at(self, seconds: float) -> Optional[bytes]:
+        """
+        指定時刻以降の最初のフレームをJPEGで返す（範囲外なら None）
+        """
+        target_pts = self._target_pts(seconds)
+        if target_pts is None:
+            return None
+
+        cached = self._jpeg_cache.get(target_pts)
+        if cached is not None:
+            self._jpeg_cache.move_to_end(target_pts)
+            return cached
+
+        frame = self._decode_until(target_pts)
+        if frame is None:
+            return None
+
+        buffer = io.BytesIO()
+        frame.to_image().save(buffer, format="JPEG", quality=95)
+        data = buffer.getvalue()
+
+        self._jpeg_cache[target_pts] = data
+        while len(self._jpeg_cache) > FRAME_CACHE_SIZE:
+            self._jpeg_cache.popitem(last=False)
+        return data
+
+    def _target_pts(self, seconds: float) -> Optional[int]:
+        if self.frame_pts is None:
+            # インデックスが無い場合は時刻から計算する（範囲外はデコード時に判定）
+            return self.start_pts + round(seconds / self.time_base)
+        target_index = bisect.bisect_left(self.frame_pts, self.start_pts + round(seconds / self.time_base))
+        if target_index >= len(self.frame_pts):
+            return None
+        return self.frame_pts[target_index]
+
+    def _decode_until(self, target_pts: int):
+        """
+        target_pts のフレームまでデコードして返す
+        """
+        if self.frame_pts is None:
+            # コンテナのインデックスで target_pts 以前のキーフレームにシークする
+            self.container.seek(target_pts, stream=self.stream, backward=True, any_frame=False)
+            self._frames = None
+            for frame in self.container.decode(self.stream):
+                if frame.pts is not None and frame.pts >= target_pts:
+                    return frame
+            return None
+
+        keyframe_index = bisect.bisect_right(self.keyframe_pts, target_pts) - 1
+        keyframe_pts = self.keyframe_pts[max(keyframe_index, 0)] if self.keyframe_pts else self.frame_pts[0]
+
+        # 直前の位置が同じGOP内で手前にあればシークせずにデコードを続ける
+        if self._frames is None or self._last_pts is None or not (keyframe_pts <= self._last_pts < target_pts):
+            self.container.seek(keyframe_pts, stream=self.stream, backward=True, any_frame=False)
+            self._frames = self.container.decode(self.stream)
+
+        for frame in self._frames:
+            if frame.pts is None:
+                continue
+            self._last_pts = frame.pts
+            if frame.pts >= target_pts:
+                return frame
+
+        self._frames = None
+        return None
+
+    def close(self):
+        self.container.close()
+        if self.reader is not None:
+            self.reader.close()
+
+
+_decoder_cache: "OrderedDict[str, _DecoderEntry]" = OrderedDict()
+_decoder_cache_lock = threading.Lock()
+# 動画ごとのデコーダ作成のロック（同じ動画の初回利用が重なっても、インデックスの作成は1回にする）
+_decoder_build_locks: Dict[str, threading.Lock] = {}
+
+# リモート抽出に失敗して全体をダウンロードした動画（gs:// URI -> ローカルパス）
+_remote_downloads: Dict[str, str] = {}
+_remote_downloads_lock = threading.Lock()
+
+
+def _get_decoder(video_path: str, gcs_repository=None) -> _DecoderEntry:
+    """
+    動画ごとのデコーダを取得する（初回のみインデックスを作成しキャッシュ、ファイルが変わったら作り直す）
+    gs:// の場合は範囲読み込みのファイルオブジェクトで開き、インデックスは作らない
+    取得したデコーダは使用中として数えるため、_checkout_decoder から使う
+    """
+    remote = video_path.startswith("gs://")
+    if remote:
+        # 範囲読み込みは generation を固定しているため、キャッシュ済みのデコーダはメタデータを確認せずに使う
+        # （オブジェクトが置き換えられると読み込みが失敗し、_checkout_decoder がキャッシュから外す）
+        bucket_name, blob_name = _split_gcs_uri(video_path)
+        file_key = None
+    else:
+        stat = os.stat(video_path)
+        file_key = (stat.st_size, stat.st_mtime_ns)
+
+    def cached() -> Optional[_DecoderEntry]:
+        with _decoder_cache_lock:
+            entry = _decoder_cache.get(video_path)
+            if entry and (file_key is None or entry.file_key == file_key):
+                _decoder_cache.move_to_end(video_path)
+                entry.users += 1
+                return entry
+            return None
+
+    entry = cached()
+    if entry:
+        return entry
+
+    with _decoder_cache_lock:
+        build_lock = _decoder_build_locks.setdefault(video_path, threading.Lock())
+    with build_lock:
+        # 待っている間に他のスレッドが作成していればそれを使う
+        entry = cached()
+        if entry:
+            return entry
+
+        if remote:
+            metadata = gcs_repository.get_metadata(blob_name, bucket_name)
+            file_key = (metadata["size"], metadata["generation"])
+            reader = gcs_repository.open_range_reader(blob_name, bucket_name, generation=metadata["generation"], size=metadata["size"])
+            try:
+                new_entry = _DecoderEntry(reader, file_key, build_index=False)
+            except Exception:
+                reader.close()
+                raise
+        else:
+            new_entry = _DecoderEntry(video_path, file_key)
+        metrics.incr("decoder.builds")
+
+        with _decoder_cache_lock:
+            stale = _decoder_cache.pop(video_path, None)
+            _decoder_cache[video_path] = new_entry
+            new_entry.users += 1
+            evicted = [stale] if stale else []
+            while len(_decoder_cache) > DECODER_CACHE_SIZE:
+                evicted.append(_decoder_cache.popitem(last=False)[1])
+            unused = _retire_decoders(evicted)
+
+    _close_decoders(unused)
+    return new_entry
+
+
+def _retire_decoders(entries: List[_DecoderEntry]) -> List[_DecoderEntry]:
+    """
+    キャッシュから外したデコーダに印を付け、すぐに閉じてよいもの（使用中でないもの）を返す
+    _decoder_cache_lock を保持して呼ぶ
+    """
+    for entry in entries:
+        entry.evicted = True
+    return [entry for entry in entries if entry.users == 0]
+
+
+def _close_decoders(entries: List[_DecoderEntry]):
+    for entry in entries:
+        with entry.lock:
+            entry.close()
+
+
+@contextmanager
+def _checkout_decoder(video_path: str, gcs_repository=None):
+    """
+    デコーダを使用中として取得し、使い終わったら返却する
+    使用中にキャッシュから外された場合は、最後の利用者の返却時に閉じる
+    """
+    entry = _get_decoder(video_path, gcs_repository)
+    try:
+        yield entry
+    except Exception:
+        if video_path.startswith("gs://"):
+            # 固定した generation が読めない（動画が置き換えられた）場合などは、次回メタデータから作り直す
+            with _decoder_cache_lock:
+                if _decoder_cache.get(video_path) is entry:
+                    del _decoder_cache[video_path]
+                    entry.evicted = True
+        raise
+    finally:
+        with _decoder_cache_lock:
+            entry.users -= 1
+            unused = [entry] if entry.evicted and entry.users == 0 else []
+        _close_decoders(unused)
+
 
 class VideoService:
-    def __init__(self):
-        pass
+    def __init__(self, extraction_mode: Optional[str] = None, gcs_repository=None, phase1_proxy: Optional[bool] = None):
+        self.extraction_mode = extraction_mode or FRAME_EXTRACTION_MODE
+        self.phase1_proxy = PHASE1_PROXY if phase1_proxy is None else phase1_proxy
+        self.frame_dedup = FRAME_DEDUP
+        # gs:// の動画を読むときに使う（初回利用時に共有クライアントから作る）
+        self._gcs_repository = gcs_repository
+
+    @property
+    def gcs_repository(self):
+        if self._gcs_repository is None:
+            from app.repositories.gcs_repository import GCSRepository
+            self._gcs_repository = GCSRepository()
+        return self._gcs_repository
+
+    async def make_proxy(self, video_path: str, cache_key: Optional[str] = None) -> str:
+        """
+        Phase 1 用のプロキシ動画（PROXY_MAX_HEIGHT 以下・PROXY_FPS・音声なし）を作成し、そのパスを返す。
+        タイムスタンプは元の動画と同じ時間軸のまま（fps フィルタはフレームを間引くだけ）。
+        cache_key: 動画の内容のハッシュ（省略時はファイルから計算する）
+        """
+        if cache_key is None:
+            cache_key = await asyncio.to_thread(_file_sha256, video_path)
+        proxy_path = os.path.join(PROXY_CACHE_DIR, f"{cache_key}_{PROXY_MAX_HEIGHT}p_{PROXY_FPS:g}fps_crf{PROXY_CRF}.mp4")
+
+        holder = _proxy_locks.setdefault(proxy_path, [asyncio.Lock(), 0])
+        holder[1] += 1
+        try:
+            async with holder[0]:
+                if os.path.exists(proxy_path):
+                    # 最後に使った時刻を更新する（古いものから削除するため）
+                    os.utime(proxy_path)
+                    metrics.incr("proxy.cache_hits")
+                    return proxy_path
+
+                metrics.incr("proxy.cache_misses")
+                os.makedirs(PROXY_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{proxy_path}.{uuid.uuid4().hex}.tmp.mp4"
+                command = [
+                    "ffmpeg", "-loglevel", "error",
+                    "-i", video_path,
+                    # 高さは偶数にする（yuv420p の制約）。元より大きくはしない
+                    "-vf", f"fps={PROXY_FPS:g},scale=-2:'trunc(min({PROXY_MAX_HEIGHT},ih)/2)*2'",
+                    "-an",
+                    "-c:v", "libx264", "-preset", "veryfast", "-crf", str(PROXY_CRF),
+                    "-pix_fmt", "yuv420p",
+                    "-movflags", "+faststart",
+                    "-y", tmp_path
+                ]
+                start_time = time.time()
+                try:
+                    await asyncio.to_thread(
+                        subprocess.run,
+                        command,
+                        check=True,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE
+                    )
+                    os.replace(tmp_path, proxy_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
 
-    async def extract_frames(self, video_path: str, steps: list, output_dir: str = "app/static/images", start_index: int = 0):
+                original_size = os.path.getsize(video_path)
+                proxy_size = os.path.getsize(proxy_path)
+                metrics.observe("proxy.transcode_seconds", time.time() - start_time)
+                metrics.incr("proxy.bytes_saved", max(original_size - proxy_size, 0))
+                print(f"Created Phase 1 proxy: {proxy_path} ({original_size} -> {proxy_size} bytes, {time.time() - start_time:.2f}s)")
+                await asyncio.to_thread(_prune_proxy_cache, proxy_path)
+                return proxy_path
+        finally:
+            holder[1] -= 1
+            if holder[1] == 0:
+                _proxy_locks.pop(proxy_path, None)
+
+    async def detect_scenes(self, video_path: str) -> List[dict]:
+        """
+        ローカルの動画から画面の切り替わりを検出し、候補のタイムスタンプとクリーンなフレームの時刻を返す（find_scene_candidates）
+        """
+        start_time = time.time()
+        ratios = await asyncio.to_thread(frame_change_ratios, video_path)
+        candidates = find_scene_candidates(ratios)
+        duration = time.time() - start_time
+        metrics.observe("scene_detection.seconds", duration)
+        metrics.observe("scene_detection.candidates", len(candidates))
+        print(f"Detected {len(candidates)} scene candidates in {len(ratios) / SCENE_SAMPLE_FPS:.0f}s of video ({duration:.2f}s)")
+        return candidates
+
+    async def group_duplicate_frames(self, image_paths: List[str]) -> List[int]:
+        """
+        抽出済みのフレームを知覚ハッシュで比較し、各フレームの代表の位置を返す（find_duplicate_frames）
+        """
+        return await asyncio.to_thread(find_duplicate_frames, image_paths)
+
+    async def extract_frames(self, video_path: str, steps: list, output_dir: str = "app/static/images", start_index: int = 0, mode: Optional[str] = None):
         """
         Extracts frames from the video at the given timestamps.
-        
+
         Args:
-            video_path: Path to the input video file.
+            video_path: Path to the input video file, or a gs:// URI (read by byte ranges).
             steps: List of step dictionaries containing 'timestamp'.
             output_dir: Directory to save extracted images.
             start_index: The starting index for step numbering (default: 0).
-            
+            mode: "per_step", "batch", "decoder" or "auto" (default: FRAME_EXTRACTION_MODE).
+
         Returns:
             List of steps with an added 'image_url' field.
         """
-        
+
         # Ensure output directory exists
         os.makedirs(output_dir, exist_ok=True)
-        
-        updated_steps = []
-        
+
+        mode = mode or self.extraction_mode
+
+        # (step, timestamp, image_filename) の組を作る
+        targets = []
         for i, step in enumerate(steps):
             current_index = start_index + i
             timestamp = step.get("timestamp")
             if not timestamp:
-                updated_steps.append(step)
                 continue
-                
+
             # Create a safe filename
             # cleaner timestamp for filename
             clean_ts = timestamp.replace(":", "-").replace(".", "_")
             image_filename = f"step_{current_index + 1}_{clean_ts}.jpg"
-            image_path = os.path.join(output_dir, image_filename)
-            
-            # Construct FFmpeg command
-            # -ss before -i for faster seeking
-            # -vframes 1 to extract strictly one frame
-            # -y to overwrite existing file
-            command = [
-                "ffmpeg",
-                "-ss", timestamp,
-                "-i", video_path,
-                "-vframes", "1",
-                "-q:v", "2", # High quality jpeg
-                "-y",
-                image_path
-            ]
-            
+            targets.append((step, timestamp, image_filename))
+
+        results = None
+        if video_path.startswith("gs://"):
+            with _remote_downloads_lock:
+                downloaded = _remote_downloads.get(video_path)
+            if downloaded and os.path.exists(downloaded):
+                # Phase 1 などで全体をダウンロード済みなら範囲読み込みはしない
+                video_path = downloaded
+            elif targets and REMOTE_FRAME_EXTRACTION and av is not None:
+                try:
+                    results = await asyncio.to_thread(self._extract_frames_decoder, video_path, targets, output_dir)
+                    metrics.incr("remote_video.extractions")
+                except Exception as e:
+                    print(f"Remote frame extraction failed, downloading the whole video: {e}")
+            if results is None and video_path.startswith("gs://"):
+                # シークできないコンテナなどは全体をダウンロードしてローカルと同じ方法で抽出する
+                video_path = await asyncio.to_thread(self._download_remote, video_path)
+
+        if mode == "auto":
+            if av is not None:
+                mode = "decoder"
+            else:
+                mode = "batch" if self._is_dense(targets) else "per_step"
+
+        if results is None and mode == "decoder" and targets:
             try:
-                # Run blocking subprocess in thread
-                await asyncio.to_thread(
-                    subprocess.run,
-                    command,
-                    check=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
-                
-                # Assuming static files are served from /static/images/
-                # We hardcode the URL path to match the mount point in main.py
-                # This assumes output_dir ends in "images" or is the mounted directory.
-                
-                # For MVP, we know endpoints.py passes app/static/images
-                # and main.py mounts app/static to /static.
-                # So the file at app/static/images/foo.jpg is accessible at /static/images/foo.jpg
-                
+                results = await asyncio.to_thread(self._extract_frames_decoder, video_path, targets, output_dir)
+            except Exception as e:
+                # コンテナを開けない等の場合は ffmpeg に戻す
+                print(f"Decoder frame extraction failed, falling back to ffmpeg: {e}")
+                metrics.incr("decoder.fallbacks")
+                mode = "batch" if self._is_dense(targets) else "per_step"
+
+        if results is None:
+            # 1フレームだけなら従来の高速シークの方が速い
+            if mode == "batch" and len(targets) > 1:
+                results = await self._extract_frames_batch(video_path, targets, output_dir)
+            else:
+                results = {}
+                for _, timestamp, image_filename in targets:
+                    image_path = os.path.join(output_dir, image_filename)
+                    results[image_filename] = await self._extract_frame_single(video_path, timestamp, image_path)
+
+        for step, _, image_filename in targets:
+            # Assuming static files are served from /static/images/
+            # We hardcode the URL path to match the mount point in main.py
+            # This assumes output_dir ends in "images" or is the mounted directory.
+
+            # For MVP, we know endpoints.py passes app/static/images
+            # and main.py mounts app/static to /static.
+            # So the file at app/static/images/foo.jpg is accessible at /static/images/foo.jpg
+            if results.get(image_filename):
                 step["image_url"] = f"/static/images/{image_filename}"
-                
-            except subprocess.CalledProcessError as e:
-                print(f"Error extracting frame at {timestamp}: {e}")
+            else:
                 step["image_url"] = None # Indicate failure or use placeholder
-                
-            updated_steps.append(step)
-            
-        return updated_steps
+
+        return steps
+
+    def release(self, video_path: str):
+        """
+        動画のデコーダとインデックスを破棄する（一時ファイル削除時に呼ぶ）
+        gs:// の場合は全体ダウンロードした一時ファイルも削除する
+        """
+        with _remote_downloads_lock:
+            local_path = _remote_downloads.pop(video_path, None)
+        for path in (video_path, local_path):
+            if path is None:
+                continue
+            with _decoder_cache_lock:
+                entry = _decoder_cache.pop(path, None)
+                _decoder_build_locks.pop(path, None)
+                unused = _retire_decoders([entry] if entry else [])
+            _close_decoders(unused)
+        if local_path and os.path.exists(local_path):
+            os.remove(local_path)
+
+    async def download_remote(self, video_uri: str) -> str:
+        """
+        gs:// の動画全体をローカルに用意する（全フレームを読む Phase 1 の前処理用。release で削除する）
+        以降の extract_frames はこのファイルから抽出する
+        """
+        return await asyncio.to_thread(self._download_remote, video_uri, "remote_video.phase1_downloads")
+
+    def _download_remote(self, video_uri: str, metric: str = "remote_video.fallback_downloads") -> str:
+        """
+        gs:// の動画全体をローカルの一時ファイルにダウンロードする（release で削除する）
+        """
+        with _remote_downloads_lock:
+            local_path = _remote_downloads.get(video_uri)
+        if local_path and os.path.exists(local_path):
+            return local_path
+
+        bucket_name, blob_name = _split_gcs_uri(video_uri)
+        fd, local_path = tempfile.mkstemp(suffix=os.path.splitext(blob_name)[1] or ".mp4")
+        try:
+            with os.fdopen(fd, "wb") as f, self.gcs_repository.open_range_reader(blob_name, bucket_name) as reader:
+                shutil.copyfileobj(reader, f, 8 * 1024 * 1024)
+        except Exception:
+            os.remove(local_path)
+            raise
+
+        metrics.incr(metric)
+        metrics.incr("remote_video.bytes_fetched", os.path.getsize(local_path))
+        with _remote_downloads_lock:
+            _remote_downloads[video_uri] = local_path
+        return local_path
+
+    def _extract_frames_decoder(self, video_path: str, targets: list, output_dir: str) -> Dict[str, bool]:
+        """
+        常駐デコーダでフレームを書き出す（スレッド内で実行）。
+        キーフレームインデックスから直前のキーフレームにシークし、目的のフレームまでだけデコードする。
+        """
+        if av is None:
+            raise RuntimeError("PyAV is not installed")
+
+        results: Dict[str, bool] = {}
+        requests = []
+        for _, timestamp, image_filename in targets:
+            try:
+                requests.append((timestamp_to_seconds(timestamp), timestamp, image_filename))
+            except ValueError:
+                print(f"Invalid timestamp for frame extraction: {timestamp}")
+                results[image_filename] = False
+
+        with _checkout_decoder(video_path, self.gcs_repository if video_path.startswith("gs://") else None) as entry, entry.lock:
+            fetched_before = entry.reader.bytes_fetched if entry.reader else 0
+            # 時刻順に処理すると同じGOP内ではシークが不要になる
+            for seconds, timestamp, image_filename in sorted(requests):
+                data = entry.jpeg_at(seconds)
+                if data is None:
+                    print(f"Error extracting frame at {timestamp}: out of range")
+                    results[image_filename] = False
+                    continue
+                with open(os.path.join(output_dir, image_filename), "wb") as f:
+                    f.write(data)
+                results[image_filename] = True
+
+            if entry.reader:
+                metrics.incr("remote_video.bytes_fetched", entry.reader.bytes_fetched - fetched_before)
+
+        return results
+
+    def _is_dense(self, targets: list) -> bool:
+        """
+        タイムスタンプの平均間隔が FRAME_BATCH_MAX_GAP 以下かどうか
+        """
+        try:
+            times = sorted(timestamp_to_seconds(timestamp) for _, timestamp, _ in targets)
+        except ValueError:
+            return False
+        if len(times) < 2:
+            return False
+        return (times[-1] - times[0]) / (len(times) - 1) <= FRAME_BATCH_MAX_GAP
+
+    async def _extract_frame_single(self, video_path: str, timestamp: str, image_path: str) -> bool:
+        """
+        1つのタイムスタンプについて ffmpeg を起動してフレームを書き出す
+        """
+        # Construct FFmpeg command
+        # -ss before -i for faster seeking
+        # -vframes 1 to extract strictly one frame
+        # -y to overwrite existing file
+        command = [
+            "ffmpeg",
+            "-ss", timestamp,
+            "-i", video_path,
+            "-vframes", "1",
+            "-q:v", "2", # High quality jpeg
+            "-y",
+            image_path
+        ]
+
+        # 前回の同名ファイルが残っていると、書き出されなかったことを判定できない
+        if os.path.exists(image_path):
+            os.remove(image_path)
+
+        try:
+            # Run blocking subprocess in thread
+            await asyncio.to_thread(
+                subprocess.run,
+                command,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        except subprocess.CalledProcessError as e:
+            print(f"Error extracting frame at {timestamp}: {e}")
+            return False
+
+        # 動画の長さを超えたタイムスタンプでも ffmpeg は正常終了し、ファイルを書き出さない
+        if not os.path.exists(image_path) or os.path.getsize(image_path) == 0:
+            print(f"No frame at {timestamp} (past the end of the video?)")
+            return False
+        return True
+
+    async def _extract_frames_batch(self, video_path: str, targets: list, output_dir: str) -> Dict[str, bool]:
+        """
+        1回の ffmpeg 実行（1回のデコード）で全タイムスタンプのフレームを書き出す。
+
+        select フィルタで「各タイムスタンプ以降の最初のフレーム」を選択し、
+        showinfo のログから実際に書き出されたフレームの時刻を取得して各ステップに割り当てる。
+        """
+        results: Dict[str, bool] = {}
+        seconds_by_filename = {}
+        for _, timestamp, image_filename in targets:
+            try:
+                seconds_by_filename[image_filename] = timestamp_to_seconds(timestamp)
+            except ValueError:
+                print(f"Invalid timestamp for frame extraction: {timestamp}")
+                results[image_filename] = False
+
+        if not seconds_by_filename:
+            return results
+
+        times = sorted(set(seconds_by_filename.values()))
+        # 最初のタイムスタンプまでは入力シークで読み飛ばす（以降の時刻は seek 位置からの相対値になる）
+        seek = times[0]
+        relative_times = [t - seek for t in times]
+
+        # 先頭フレームは prev_pts が NAN になるので isnan で拾う
+        select_expr = "+".join(
+            f"(isnan(prev_pts)+lt(prev_pts*TB\\,{t:.3f}))*gte(pts*TB\\,{t:.3f})"
+            for t in relative_times
+        )
+
+        work_dir = os.path.join(output_dir, f"batch_{uuid.uuid4().hex}")
+        os.makedirs(work_dir, exist_ok=True)
+
+        command = [
+            "ffmpeg",
+            "-ss", f"{seek:.3f}",
+            "-t", f"{relative_times[-1] + 1:.3f}", # 最後のタイムスタンプ以降はデコードしない
+            "-i", video_path,
+            "-an", "-sn",
+            "-vf", f"select='{select_expr}',showinfo",
+            "-fps_mode", "vfr",
+            "-q:v", "2", # High quality jpeg
+            "-y",
+            os.path.join(work_dir, "frame_%04d.jpg")
+        ]
+
+        try:
+            completed = await asyncio.to_thread(
+                subprocess.run,
+                command,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            frame_times = [
+                float(t) for t in _PTS_TIME_PATTERN.findall(completed.stderr.decode("utf-8", errors="replace"))
+            ]
+
+            for image_filename, seconds in seconds_by_filename.items():
+                # タイムスタンプ以降の最初の出力フレームを割り当てる
+                frame_index = bisect.bisect_left(frame_times, seconds - seek - 1e-3)
+                frame_path = os.path.join(work_dir, f"frame_{frame_index + 1:04d}.jpg")
+                if frame_index < len(frame_times) and os.path.exists(frame_path):
+                    shutil.copyfile(frame_path, os.path.join(output_dir, image_filename))
+                    results[image_filename] = True
+                else:
+                    print(f"Error extracting frame at {seconds:.3f}s: no frame selected")
+                    results[image_filename] = False
+
+        except subprocess.CalledProcessError as e:
+            # バッチ抽出に失敗した場合はステップごとの抽出にフォールバック
+            print(f"Batch frame extraction failed, falling back to per-step: {e}")
+            for _, timestamp, image_filename in targets:
+                if image_filename in seconds_by_filename:
+                    image_path = os.path.join(output_dir, image_filename)
+                    results[image_filename] = await self._extract_frame_single(video_path, timestamp, image_path)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        return results
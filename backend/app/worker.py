@@ -0,0 +1,191 @@
+# 解析ジョブのワーカー
+#   python -m app.worker [--concurrency N]
+# Webプロセスが JobQueue に積んだジョブを取り出して実行する。Webとは独立に台数・並列数を変えられる
+# SIGTERM / SIGINT を受けると新しいジョブを取らずに実行中のジョブの完了を待ち（WORKER_DRAIN_TIMEOUT まで）、
+# 終わらなかったジョブは試行回数を消費せずにキューへ戻す
+import os
+import time
+import signal
+import asyncio
+import argparse
+import logging
+from typing import Dict, Any, Callable, Awaitable, Optional
+
+from app.services.job_queue import JobQueue, get_job_queue, close_job_queue, new_worker_id
+from app.services.metrics import metrics
+
+logger = logging.getLogger("performance")
+
+# 1ワーカープロセスで同時に実行するジョブ数
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+# キューが空のときのポーリング間隔（秒）
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# 停止時に実行中のジョブを待つ最大時間（秒）
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "600"))
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+FailureHandler = Callable[[Dict[str, Any], bool], Awaitable[None]]
+
+
+class Worker:
+    def __init__(
+        self,
+        queue: JobQueue,
+        handlers: Dict[str, JobHandler],
+        concurrency: int = WORKER_CONCURRENCY,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        drain_timeout: float = WORKER_DRAIN_TIMEOUT,
+        on_failure: Optional[FailureHandler] = None
+    ):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.drain_timeout = drain_timeout
+        self.on_failure = on_failure
+        self.worker_id = new_worker_id()
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        """新しいジョブの取得をやめる（実行中のジョブは続ける）"""
+        if not self._stopping.is_set():
+            print(f"Worker {self.worker_id}: draining...")
+            self._stopping.set()
+
+    async def run(self):
+        print(f"Worker {self.worker_id}: started with concurrency {self.concurrency}")
+        slots = [asyncio.create_task(self._slot()) for _ in range(self.concurrency)]
+        reaper = asyncio.create_task(self._reap())
+        try:
+            await self._stopping.wait()
+            _, pending = await asyncio.wait(slots, timeout=self.drain_timeout)
+            if pending:
+                print(f"Worker {self.worker_id}: drain timeout, returning {len(pending)} job(s) to the queue")
+        finally:
+            for task in slots + [reaper]:
+                task.cancel()
+            await asyncio.gather(*slots, reaper, return_exceptions=True)
+        print(f"Worker {self.worker_id}: stopped")
+
+    async def _wait_or_stop(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _slot(self):
+        while not self._stopping.is_set():
+            try:
+                job = await self.queue.claim(self.worker_id)
+            except Exception as e:
+                print(f"Worker {self.worker_id}: claim failed: {e}")
+                job = None
+            if job is None:
+                await self._wait_or_stop(self.poll_interval)
+                continue
+            await self._execute(job)
+
+    async def _reap(self):
+        # lease が切れたまま試行回数を使い切ったジョブ（実行中にワーカーが落ち続けたもの）を失敗にする
+        while True:
+            await asyncio.sleep(max(self.poll_interval, self.queue.visibility_timeout / 3))
+            try:
+                for job in await self.queue.reap_expired():
+                    print(f"Job {job['id']} failed: lease expired after {job['attempts']} attempt(s)")
+                    await self._notify_failure(job, False)
+            except Exception as e:
+                print(f"Worker {self.worker_id}: reap failed: {e}")
+
+    async def _heartbeat(self, job: Dict[str, Any], task: asyncio.Task):
+        while True:
+            await asyncio.sleep(self.queue.visibility_timeout / 3)
+            if not await self.queue.heartbeat(job["id"], self.worker_id):
+                # lease が切れて別のワーカーが取得した（二重に実行しないよう止める）
+                print(f"Job {job['id']}: lease lost, cancelling")
+                task.cancel()
+                return
+
+    async def _execute(self, job: Dict[str, Any]):
+        handler = self.handlers.get(job["kind"])
+        print(f"Worker {self.worker_id}: running job {job['id']} ({job['kind']}, attempt {job['attempts']}/{job['max_attempts']})")
+        start_time = time.monotonic()
+        task = asyncio.create_task(handler(job["payload"])) if handler else None
+        heartbeat = asyncio.create_task(self._heartbeat(job, task)) if task else None
+        try:
+            if task is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+            await asyncio.shield(task)
+            await self.queue.complete(job["id"], self.worker_id)
+            metrics.observe("job_queue.run_seconds", time.monotonic() - start_time)
+            print(f"Worker {self.worker_id}: job {job['id']} succeeded in {time.monotonic() - start_time:.1f}s")
+        except asyncio.CancelledError:
+            if not asyncio.current_task().cancelling():
+                # ジョブ側だけが止められた = lease を失った（キューの状態は新しい所有者に任せる）
+                metrics.incr("job_queue.lease_lost")
+                return
+            # 停止（drain timeout）による中断: ジョブを止めてキューへ戻す
+            if task is not None and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            await self.queue.release(job["id"], self.worker_id)
+            raise
+        except Exception as e:
+            retry = await self.queue.fail(job["id"], self.worker_id, f"{type(e).__name__}: {e}")
+            logger.warning(f"Job {job['id']} failed (attempt {job['attempts']}, retry={retry}): {e}")
+            print(f"Worker {self.worker_id}: job {job['id']} failed (retry={retry}): {e}")
+            await self._notify_failure(job, retry)
+        finally:
+            if heartbeat:
+                heartbeat.cancel()
+
+    async def _notify_failure(self, job: Dict[str, Any], retry: bool):
+        if self.on_failure:
+            try:
+                await self.on_failure(job, retry)
+            except Exception as e:
+                print(f"Failed to report failure of job {job['id']}: {e}")
+
+
+async def main(concurrency: int):
+    from app.api.deps import build_manual_service, build_gemini_service
+    from app.repositories.clients import init_client_registry, close_client_registry
+    from app.routers.video import process_video_analysis, VIDEO_ANALYSIS_JOB
+
+    clients = init_client_registry()
+
+    async def analyze_video(payload: Dict[str, Any]):
+        manual_service = build_manual_service(clients)
+        # 再試行の場合は前回の試行のステップを消してから始める
+        await manual_service.reset_manual_job(payload["manual_id"], "analyzing_structure")
+        await process_video_analysis(
+            payload["video_url"],
+            payload["manual_id"],
+            payload["title"],
+            manual_service,
+            build_gemini_service(clients)
+        )
+
+    async def on_failure(job: Dict[str, Any], retry: bool):
+        # リトライする場合は実行待ちに戻し、最後の試行が失敗したら error にする
+        manual_id = job["payload"].get("manual_id", job["id"])
+        manual_service = build_manual_service(clients)
+        await manual_service.update_manual_status(manual_id, "queued" if retry else "error")
+        await manual_service.flush_progress(manual_id)
+
+    worker = Worker(get_job_queue(), {VIDEO_ANALYSIS_JOB: analyze_video}, concurrency=concurrency, on_failure=on_failure)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        await close_job_queue()
+        await close_client_registry()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Video analysis job worker")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="Jobs to run at the same time")
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))
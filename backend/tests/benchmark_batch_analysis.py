@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import subprocess
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+from app.services.video_service import VideoService
+from app.services.gemini_service import GeminiService
+from app.services.metrics import metrics
+
+# Config
+WORK_DIR = "/tmp/batch_analysis_benchmark"
+
+
+class UsageRecorder:
+    """
+    generate_content の呼び出し回数とトークン数を数える
+    """
+    def __init__(self, models):
+        self.models = models
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    async def generate_content(self, **kwargs):
+        response = await self.models.generate_content(**kwargs)
+        self.requests += 1
+        usage = response.usage_metadata
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_token_count or 0
+            self.output_tokens += (usage.candidates_token_count or 0) + (getattr(usage, "thoughts_token_count", None) or 0)
+        return response
+
+
+def make_video(minutes: int) -> str:
+    """ffmpeg の testsrc で合成動画を作成する（--video 未指定時）"""
+    path = os.path.join(WORK_DIR, f"video_{minutes}min.mp4")
+    if os.path.exists(path):
+        return path
+
+    print(f"Generating {minutes} min test video...")
+    subprocess.run([
+        "ffmpeg", "-loglevel", "error",
+        "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=30",
+        "-t", str(minutes * 60),
+        "-c:v", "libx264", "-preset", "ultrafast",
+        "-pix_fmt", "yuv420p",
+        "-y", path
+    ], check=True)
+    return path
+
+
+async def extract_steps(video_path: str, step_count: int, interval: int) -> list:
+    """interval 秒ごとのフレームをステップとして抽出する"""
+    output_dir = os.path.join(WORK_DIR, "frames")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    steps = []
+    for i in range(step_count):
+        seconds = i * interval + 1
+        steps.append({"timestamp": f"{seconds // 60:02d}:{seconds % 60:02d}", "title": f"手順 {i + 1}"})
+    result = await VideoService().extract_frames(video_path, steps, output_dir=output_dir)
+    # image_url は /static/images/... になるため、実際のファイルの場所を別に持つ
+    for step in result:
+        if step.get("image_url"):
+            step["file_path"] = os.path.join(output_dir, os.path.basename(step["image_url"]))
+    return [s for s in result if s.get("image_url")]
+
+
+async def run_once(service: GeminiService, steps: list, batch_size: int, concurrency: int):
+    items = [{
+        "file_path": s["file_path"],
+        "title": s["title"],
+        "timestamp": s["timestamp"],
+        "image_url": s["image_url"]
+    } for s in steps]
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze(batch):
+        async with semaphore:
+            if batch_size == 1:
+                item = batch[0]
+                return [await service.analyze_single_image(item["file_path"], item["title"], item["timestamp"], item["image_url"], use_cache=False)]
+            return await service.analyze_image_batch(batch, use_cache=False)
+
+    start = time.time()
+    results = await asyncio.gather(*(analyze(batch) for batch in batches))
+    duration = time.time() - start
+    analyzed = sum(1 for batch in results for step in batch if step)
+    return duration, analyzed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Phase 3 image analysis: one request per image vs K images per request")
+    parser.add_argument("--video", help="Screen recording to sample frames from (default: synthetic testsrc video)")
+    parser.add_argument("--steps", type=int, default=24)
+    parser.add_argument("--interval", type=int, default=2, help="seconds between sampled frames")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    os.makedirs(WORK_DIR, exist_ok=True)
+    video_path = args.video or make_video(1)
+    steps = await extract_steps(video_path, args.steps, args.interval)
+
+    service = GeminiService()
+    service.analysis_cache = None
+    recorder = UsageRecorder(service.client.aio.models)
+    service.client = type("Client", (), {"aio": type("Aio", (), {"models": recorder})()})()
+
+    print(f"--- Configuration ---")
+    print(f"Video: {video_path}")
+    print(f"Steps: {len(steps)}")
+    print(f"Concurrency: {args.concurrency}")
+    print(f"Model: {service.model_name}")
+
+    rows = []
+    for batch_size in args.sizes:
+        recorder.reset()
+        fallbacks_before = metrics.snapshot()["counters"].get("phase3.batch_fallbacks", 0)
+        duration, analyzed = await run_once(service, steps, batch_size, args.concurrency)
+        fallbacks = metrics.snapshot()["counters"].get("phase3.batch_fallbacks", 0) - fallbacks_before
+        rows.append((batch_size, duration, analyzed, recorder.requests, recorder.prompt_tokens, recorder.output_tokens, fallbacks))
+
+    print(f"\n--- Results ---")
+    print(f"{'K':>3} {'time':>8} {'analyzed':>9} {'requests':>9} {'in tokens':>10} {'out tokens':>11} {'tokens/step':>12} {'fallbacks':>10}")
+    for batch_size, duration, analyzed, requests, prompt_tokens, output_tokens, fallbacks in rows:
+        per_step = (prompt_tokens + output_tokens) / analyzed if analyzed else 0
+        print(f"{batch_size:>3} {duration:>7.2f}s {analyzed:>9} {requests:>9} {prompt_tokens:>10} {output_tokens:>11} {per_step:>12.0f} {fallbacks:>10}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import subprocess
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+from app.services import video_service
+from app.services.video_service import VideoService
+
+# Config
+WORK_DIR = "/tmp/frame_extraction_benchmark"
+MODES = ["per_step", "batch"]
+if video_service.av is not None:
+    MODES.append("decoder")
+
+
+def make_video(minutes: int) -> str:
+    """ffmpeg の testsrc で指定長の合成動画を作成する（作成済みなら再利用）"""
+    path = os.path.join(WORK_DIR, f"video_{minutes}min.mp4")
+    if os.path.exists(path):
+        return path
+
+    print(f"Generating {minutes} min test video...")
+    subprocess.run([
+        "ffmpeg", "-loglevel", "error",
+        "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=30",
+        "-t", str(minutes * 60),
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", "250",
+        "-pix_fmt", "yuv420p",
+        "-y", path
+    ], check=True)
+    return path
+
+
+def make_steps(minutes: int, step_count: int) -> list:
+    """動画全体に均等に並んだステップを作成する"""
+    duration = minutes * 60
+    steps = []
+    for i in range(step_count):
+        seconds = int(duration * (i + 0.5) / step_count)
+        steps.append({
+            "timestamp": f"{seconds // 60:02d}:{seconds % 60:02d}",
+            "title": f"Step {i + 1}"
+        })
+    return steps
+
+
+async def run_once(video_path: str, steps: list, mode: str) -> float:
+    output_dir = os.path.join(WORK_DIR, f"frames_{mode}")
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    start = time.time()
+    result = await VideoService().extract_frames(video_path, [s.copy() for s in steps], output_dir=output_dir, mode=mode)
+    duration = time.time() - start
+
+    extracted = len([s for s in result if s.get("image_url")])
+    if extracted != len(steps):
+        print(f"  ⚠️ {mode}: extracted {extracted}/{len(steps)} frames")
+    return duration
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Per-step vs batch vs decoder frame extraction benchmark")
+    parser.add_argument("--minutes", type=int, nargs="+", default=[1, 10, 60])
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    os.makedirs(WORK_DIR, exist_ok=True)
+
+    print(f"--- Configuration ---")
+    print(f"Videos: {args.minutes} min")
+    print(f"Steps: {args.steps}")
+    print(f"Repeat: {args.repeat}")
+    print(f"---------------------")
+
+    rows = []
+    for minutes in args.minutes:
+        video_path = make_video(minutes)
+        steps = make_steps(minutes, args.steps)
+        for mode in MODES:
+            durations = [await run_once(video_path, steps, mode) for _ in range(args.repeat)]
+            first, best = durations[0], min(durations)
+            rows.append((minutes, mode, first, best))
+            print(f"{minutes:>3} min | {mode:<8} | first {first:.3f}s | best {best:.3f}s | {first / args.steps * 1000:.1f} ms/step")
+
+    print("\n[Summary]")
+    print("(decoder: 'first' includes building the keyframe index, 'best' is a repeat extraction)")
+    print(f"{'video':>7} | {'mode':<8} | {'first':>8} | {'best':>8} | {'per step':>9}")
+    for minutes, mode, first, best in rows:
+        print(f"{minutes:>4}min | {mode:<8} | {first:>7.3f}s | {best:>7.3f}s | {first / args.steps * 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+# Config
+WORK_DIR = "/tmp/proxy_phase1_benchmark"
+os.environ["PROXY_CACHE_DIR"] = os.path.join(WORK_DIR, "proxies")
+
+from app.services import gemini_service
+from app.services.video_service import VideoService, timestamp_to_seconds
+from app.services.gemini_service import GeminiService
+
+# 同じ操作とみなすタイムスタンプのずれ（秒）
+MATCH_TOLERANCE = 2.0
+
+
+class UsageRecorder:
+    """
+    generate_content の入力トークン数を数える
+    """
+    def __init__(self, models):
+        self.models = models
+        self.prompt_tokens = 0
+
+    async def generate_content(self, **kwargs):
+        response = await self.models.generate_content(**kwargs)
+        usage = response.usage_metadata
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_token_count or 0
+        return response
+
+
+def compare(reference: list, candidate: list):
+    """
+    reference の各ステップに最も近い candidate のタイムスタンプとの差
+    returns: (平均のずれ秒, MATCH_TOLERANCE 以内に見つかった割合)
+    """
+    if not reference or not candidate:
+        return float("nan"), 0.0
+    times = [timestamp_to_seconds(s.timestamp) for s in candidate]
+    diffs = [min(abs(timestamp_to_seconds(s.timestamp) - t) for t in times) for s in reference]
+    return statistics.mean(diffs), sum(1 for d in diffs if d <= MATCH_TOLERANCE) / len(diffs)
+
+
+async def run_phase1(service: GeminiService, recorder: UsageRecorder, source: str, media_resolution):
+    tokens_before = recorder.prompt_tokens
+    start = time.time()
+    structures = await service.analyze_video_structure(source, media_resolution=media_resolution)
+    return time.time() - start, recorder.prompt_tokens - tokens_before, structures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Phase 1 on the original recording vs a low-resolution proxy")
+    parser.add_argument("--video", required=True, help="Screen recording (local file)")
+    parser.add_argument("--runs", type=int, default=2)
+    args = parser.parse_args()
+
+    os.makedirs(WORK_DIR, exist_ok=True)
+    service = GeminiService()
+    recorder = UsageRecorder(service.client.aio.models)
+    service.client = type("Client", (), {"aio": type("Aio", (), {"models": recorder})()})()
+    video_service = VideoService(phase1_proxy=True)
+
+    start = time.time()
+    proxy_path = await video_service.make_proxy(args.video)
+    transcode_seconds = time.time() - start
+
+    print(f"--- Configuration ---")
+    print(f"Video: {args.video} ({os.path.getsize(args.video) / 1024 / 1024:.1f} MB)")
+    print(f"Proxy: {proxy_path} ({os.path.getsize(proxy_path) / 1024 / 1024:.2f} MB, transcode {transcode_seconds:.2f}s)")
+    print(f"Proxy media_resolution: {gemini_service.PROXY_MEDIA_RESOLUTION or 'default'}")
+    print(f"Model: {service.model_name}")
+
+    results = {"original": [], "proxy": []}
+    for i in range(args.runs):
+        results["original"].append(await run_phase1(service, recorder, args.video, None))
+        results["proxy"].append(await run_phase1(service, recorder, proxy_path, gemini_service.PROXY_MEDIA_RESOLUTION or None))
+
+    # 1回目の元動画の結果を基準にする（元動画同士の比較がモデルの揺らぎの目安）
+    reference = results["original"][0][2]
+    print(f"\n--- Results (reference: original run 1, {len(reference)} steps) ---")
+    print(f"{'source':>10} {'run':>4} {'phase1':>8} {'tokens':>9} {'steps':>6} {'mean diff':>10} {'matched':>8}")
+    for name, runs in results.items():
+        for i, (duration, tokens, structures) in enumerate(runs):
+            if name == "original" and i == 0:
+                print(f"{name:>10} {i + 1:>4} {duration:>7.2f}s {tokens:>9} {len(structures):>6} {'-':>10} {'-':>8}")
+                continue
+            mean_diff, matched = compare(reference, structures)
+            print(f"{name:>10} {i + 1:>4} {duration:>7.2f}s {tokens:>9} {len(structures):>6} {mean_diff:>9.2f}s {matched:>7.0%}")
+
+    for name, runs in results.items():
+        print(f"{name}: avg Phase 1 {statistics.mean(r[0] for r in runs):.2f}s, avg tokens {statistics.mean(r[1] for r in runs):.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
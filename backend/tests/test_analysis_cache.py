@@ -0,0 +1,115 @@
+import os
+import sys
+import asyncio
+import tempfile
+
+from PIL import Image
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+os.environ.setdefault("PROJECT_ID", "analysis-cache-test")
+
+from app.services.analysis_cache import AnalysisCache
+from app.services.gemini_service import GeminiService, StepDetail, BoundingBox
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+def entry(i: int) -> dict:
+    return {"description": f"step {i}", "padding": "x" * 100}
+
+
+def test_lru():
+    """
+    上限を超えたら最も長く使われていないものから捨てる
+    """
+    size = len(b'{"description": "step 0", "padding": "' + b"x" * 100 + b'"}')
+    cache = AnalysisCache(max_bytes=size * 3, disk_dir=None)
+    for i in range(3):
+        cache.put(f"key{i}", entry(i))
+    cache.get("key0") # key0 を最近使ったことにする
+    cache.put("key3", entry(3))
+
+    check("LRU keeps the recently used entry", cache.get("key0") == entry(0))
+    check("LRU evicts the least recently used entry", cache.get("key1") is None)
+    check("LRU counts evictions", cache.stats()["evictions"] == 1, str(cache.stats()))
+
+    cache.put("huge", {"description": "x" * (size * 4)})
+    check("Entries larger than the limit are not kept in memory", cache.get("huge") is None and cache.get("key3") == entry(3))
+
+
+def test_disk_tier(disk_dir: str):
+    """
+    ディスクに保存した結果は、新しいプロセス（インスタンス）からも読める
+    """
+    AnalysisCache(disk_dir=disk_dir).put("key", entry(1))
+
+    cache = AnalysisCache(disk_dir=disk_dir)
+    check("Disk tier serves entries written by another instance", cache.get("key") == entry(1))
+    check("Disk hit is counted", cache.stats()["disk_hits"] == 1, str(cache.stats()))
+    cache.get("key")
+    check("Disk hit is promoted to memory", cache.stats()["disk_hits"] == 1 and cache.stats()["hits"] == 2, str(cache.stats()))
+
+
+class FakeResponse:
+    def __init__(self, parsed):
+        self.parsed = parsed
+        self.text = ""
+
+
+def make_service(cache: AnalysisCache, name: str):
+    """
+    Gemini を呼ぶ代わりに呼び出し回数を数えるサービス（説明文にサービス名を入れる）
+    """
+    service = GeminiService(client=object())
+    service.analysis_cache = cache
+    service.calls = 0
+
+    async def generate(kind, contents, config, parse):
+        service.calls += 1
+        box = BoundingBox(ymin=1, xmin=2, ymax=3, xmax=4)
+        return parse(FakeResponse(StepDetail(description=f"{name} call {service.calls}", highlight_box=box, mask_boxes=[])))
+
+    service._generate = generate
+    return service
+
+
+async def test_opt_out(work_dir: str):
+    """
+    use_cache=False はメモリ・ディスクのどちらも参照せずに Gemini を呼ぶ（結果はキャッシュを更新する）
+    """
+    image_path = os.path.join(work_dir, "frame.jpg")
+    Image.new("RGB", (64, 36), (200, 100, 50)).save(image_path)
+    disk_dir = os.path.join(work_dir, "opt_out")
+
+    service = make_service(AnalysisCache(disk_dir=disk_dir), "first")
+    first = await service.analyze_single_image(image_path, "Click", "00:01", "/static/images/a.jpg")
+    cached = await service.analyze_single_image(image_path, "Click", "00:01", "/static/images/a.jpg")
+    check("Cached result is reused", service.calls == 1 and cached.description == first.description, f"{service.calls} calls")
+
+    # メモリは空でディスクには結果がある状態（再起動後）
+    service = make_service(AnalysisCache(disk_dir=disk_dir), "opt-out")
+    fresh = await service.analyze_single_image(image_path, "Click", "00:01", "/static/images/a.jpg", use_cache=False)
+    stats = service.analysis_cache.stats()
+    check("Opt-out calls Gemini", service.calls == 1 and fresh.description == "opt-out call 1", f"{service.calls} calls")
+    check("Opt-out bypasses both cache tiers", stats["hits"] == 0 and stats["disk_hits"] == 0 and stats["misses"] == 0, str(stats))
+
+    service = make_service(AnalysisCache(disk_dir=disk_dir), "after")
+    refreshed = await service.analyze_single_image(image_path, "Click", "00:01", "/static/images/a.jpg")
+    check("Opt-out result replaces the cached one", service.calls == 0 and refreshed.description == "opt-out call 1", refreshed.description)
+
+
+async def main():
+    test_lru()
+    with tempfile.TemporaryDirectory() as work_dir:
+        test_disk_tier(os.path.join(work_dir, "disk"))
+        await test_opt_out(work_dir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
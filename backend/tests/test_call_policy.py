@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+
+from PIL import Image
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+os.environ.setdefault("PROJECT_ID", "call-policy-test")
+
+from app.services.call_policy import CallPolicy, start_call_tracking
+from app.services.gemini_service import GeminiService, StepDetail, StepStructure, BoundingBox
+
+
+class ServerError(Exception):
+    def __init__(self, code: int):
+        self.code = code
+        super().__init__(f"{code} server error")
+
+
+DETAIL = StepDetail(
+    description="ボタンをクリックします",
+    highlight_box=BoundingBox(ymin=10, xmin=10, ymax=20, xmax=20),
+    mask_boxes=[]
+)
+
+
+class FakeModels:
+    """
+    outcomes の順に結果を返すモデル（使い切ったら成功）
+    outcome: 例外 / "unparsed"（スキーマに合わないレスポンス） / 秒数（成功までの時間）
+    """
+    def __init__(self, outcomes=None, parsed=DETAIL, latency=None):
+        self.outcomes = list(outcomes or [])
+        self.parsed = parsed
+        self.latency = latency or (lambda: 0.0)
+        self.calls = 0
+
+    async def generate_content(self, model, contents, config):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else self.latency()
+        if isinstance(outcome, Exception):
+            raise outcome
+        parsed = None if outcome == "unparsed" else self.parsed
+        if isinstance(outcome, float):
+            await asyncio.sleep(outcome)
+        return type("Response", (), {"parsed": parsed, "text": "{}", "usage_metadata": None})()
+
+
+def make_service(models: FakeModels, policy: CallPolicy) -> GeminiService:
+    client = type("Client", (), {"aio": type("Aio", (), {"models": models})()})()
+    service = GeminiService(client=client, rate_limiter=None, call_policy=policy)
+    service.rate_limiter = None
+    service.analysis_cache = None
+    return service
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+def percentile(values, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def test_retries(image_path: str):
+    policy = CallPolicy(max_retries=3, parse_retries=2, retry_base=0.01, retry_max=0.05)
+
+    # 一時的なエラーはリトライで回復する
+    stats = start_call_tracking()
+    models = FakeModels([ServerError(503), ServerError(429)])
+    step = await make_service(models, policy).analyze_single_image(image_path, "Click", "00:01", "/static/x.jpg")
+    check("Transient errors are retried", step is not None and models.calls == 3, f"{models.calls} calls")
+    check("Retries are counted for the job", stats.retries == 2 and stats.failures == 0, str(stats.to_dict()))
+
+    # スキーマに合わないレスポンスは回数を限ってリトライする
+    stats = start_call_tracking()
+    models = FakeModels(["unparsed"])
+    step = await make_service(models, policy).analyze_single_image(image_path, "Click", "00:01", "/static/x.jpg")
+    check("Parse failure is retried", step is not None and stats.parse_retries == 1, str(stats.to_dict()))
+
+    stats = start_call_tracking()
+    models = FakeModels(["unparsed"] * 10)
+    step = await make_service(models, policy).analyze_single_image(image_path, "Click", "00:01", "/static/x.jpg")
+    check("Parse retries are bounded", step is None and models.calls == 3 and stats.failures == 1, f"{models.calls} calls")
+
+    # 一時的でないエラーはリトライしない
+    models = FakeModels([ValueError("bad request")])
+    step = await make_service(models, policy).analyze_single_image(image_path, "Click", "00:01", "/static/x.jpg")
+    check("Permanent errors are not retried", step is None and models.calls == 1, f"{models.calls} calls")
+
+    # Phase 1 も空のレスポンスで終わらせずに再送する
+    models = FakeModels(["unparsed", ServerError(500)], parsed=[StepStructure(timestamp="00:01", title="Click")])
+    structures = await make_service(models, policy).analyze_video_structure("gs://bucket/video.mp4")
+    check("Phase 1 recovers from empty and 5xx responses", len(structures) == 1 and models.calls == 3, f"{models.calls} calls")
+
+
+async def run_tail(image_path: str, hedge: bool, calls: int, concurrency: int):
+    # 5% の呼び出しだけが極端に遅いモデル
+    rng = random.Random(1)
+    models = FakeModels(latency=lambda: 1.0 if rng.random() < 0.05 else rng.uniform(0.02, 0.05))
+    policy = CallPolicy(retry_base=0.01, hedge=hedge, hedge_percentile=90)
+    service = make_service(models, policy)
+    semaphore = asyncio.Semaphore(concurrency)
+    durations = []
+
+    async def call():
+        async with semaphore:
+            start = time.monotonic()
+            await service.analyze_single_image(image_path, "Click", "00:01", "/static/x.jpg")
+            durations.append(time.monotonic() - start)
+
+    # レイテンシの履歴が溜まるまではヘッジしないため、先に履歴を作ってから計測する
+    await asyncio.gather(*(call() for _ in range(50)))
+    durations.clear()
+    models.calls = 0
+
+    stats = start_call_tracking()
+    await asyncio.gather(*(call() for _ in range(calls)))
+    return durations, stats, models.calls
+
+
+async def test_hedging(image_path: str):
+    plain, _, plain_calls = await run_tail(image_path, hedge=False, calls=300, concurrency=10)
+    hedged, stats, hedged_calls = await run_tail(image_path, hedge=True, calls=300, concurrency=10)
+    print(f"p50/p99 without hedging: {percentile(plain, 50):.3f}s / {percentile(plain, 99):.3f}s ({plain_calls} requests)")
+    print(f"p50/p99 with hedging:    {percentile(hedged, 50):.3f}s / {percentile(hedged, 99):.3f}s ({hedged_calls} requests)")
+    print(f"Job call stats: {stats.to_dict()}")
+    check("Hedging cuts p99 latency", percentile(hedged, 99) < percentile(plain, 99) / 2)
+    check("Hedges are counted for the job", stats.hedges > 0 and stats.hedge_wins > 0)
+    check("Hedging adds few extra requests", hedged_calls - 300 <= 300 * 0.15, f"{hedged_calls - 300} extra")
+
+
+async def main():
+    with tempfile.NamedTemporaryFile(suffix=".jpg") as image:
+        Image.new("RGB", (64, 36), "white").save(image, format="JPEG")
+        image.flush()
+        await test_retries(image.name)
+        await test_hedging(image.name)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+import os
+import sys
+import asyncio
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+# 認証情報なしで作れるクライアント（GCS）はローカルのエミュレータ向けに作る
+os.environ["STORAGE_EMULATOR_HOST"] = "http://127.0.0.1:9"
+os.environ.setdefault("PROJECT_ID", "client-registry-test")
+os.environ.setdefault("BUCKET_NAME", "client-registry-test")
+
+from app.repositories import clients
+from app.repositories.clients import ClientRegistry, init_client_registry, get_client_registry, close_client_registry
+from app.api.deps import build_manual_service
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+class FakeClient:
+    """Firestore / Gemini クライアントの代わり（close の呼び出しを記録する）"""
+    def __init__(self, fail: bool = False):
+        self.closed = False
+        self.fail = fail
+        self.aio = self
+
+    def close(self):
+        if self.fail:
+            raise RuntimeError("close failed")
+        self.closed = True
+
+    async def aclose(self):
+        self.closed = True
+
+
+async def test_lazy_shared_clients():
+    """
+    クライアントは初回利用時に1つだけ作られ、以降は同じものが返る
+    """
+    registry = ClientRegistry()
+    check("No client is created up front", registry._storage is None and registry._storage_http is None)
+
+    storage_client = registry.storage
+    storage_http = registry.storage_http
+    check("Storage client is shared", registry.storage is storage_client)
+    check("Storage HTTP client is shared", registry.storage_http is storage_http)
+    check("Emulator needs no credentials", registry.storage_credentials is None)
+    check("Emulator host is the API base", registry.storage_api_base == "http://127.0.0.1:9", registry.storage_api_base)
+
+    # 同時に初回利用しても作成は1回
+    registry = ClientRegistry()
+    created = await asyncio.gather(*(asyncio.to_thread(lambda: registry.storage) for _ in range(8)))
+    check("Concurrent first use creates one client", all(client is created[0] for client in created))
+    await registry.aclose()
+
+
+async def test_aclose():
+    """
+    aclose は作成済みのクライアントをすべて閉じ、閉じた後の利用では作り直す
+    """
+    registry = ClientRegistry()
+    storage_http = registry.storage_http
+    registry.storage
+    session_closed = []
+    storage_session = registry._storage_session
+    storage_session.close = lambda: session_closed.append(True)
+    firestore_client, async_firestore_client, genai_client = FakeClient(fail=True), FakeClient(), FakeClient()
+    registry._firestore, registry._async_firestore, registry._genai = firestore_client, async_firestore_client, genai_client
+
+    await registry.aclose()
+    check("Storage HTTP client is closed", storage_http.is_closed)
+    check("Storage session is closed", session_closed == [True])
+    check("A failing close does not stop the others", async_firestore_client.closed and genai_client.closed)
+    check("All clients are released", all(c is None for c in (registry._firestore, registry._async_firestore, registry._genai, registry._storage, registry._storage_http)))
+
+    reopened = registry.storage_http
+    check("Clients are recreated after aclose", reopened is not storage_http and not reopened.is_closed)
+    await registry.aclose()
+
+    await ClientRegistry().aclose()
+    check("aclose without any client is a no-op", True)
+
+
+async def test_process_registry():
+    """
+    プロセス共有のレジストリ（lifespan で作成・終了）とサービスの組み立て
+    """
+    registry = init_client_registry()
+    check("init returns the shared registry", init_client_registry() is registry and get_client_registry() is registry)
+
+    registry._async_firestore = FakeClient()
+    manual_service = build_manual_service(registry)
+    check("Services use the shared Firestore client", manual_service.firestore_repository.db is registry._async_firestore)
+    check("Services use the shared storage HTTP client", manual_service.gcs_repository.http is registry.storage_http)
+
+    storage_http = registry.storage_http
+    await close_client_registry()
+    check("close_client_registry closes the clients", storage_http.is_closed)
+    check("close_client_registry clears the shared registry", clients._registry is None)
+    check("get_client_registry creates a new registry after close", get_client_registry() is not registry)
+    await close_client_registry()
+
+
+async def main():
+    await test_lazy_shared_clients()
+    await test_aclose()
+    await test_process_registry()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+from app.services.video_service import frame_signature, find_duplicate_frames
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+def dhash(image_path: str) -> str:
+    """画像の dHash（16進）"""
+    bits, _ = frame_signature(image_path)
+    return np.packbits(bits).tobytes().hex()
+
+
+def screen(path: str, background: str, typed: str = "", quality: int = 90):
+    """ダイアログと入力欄のある画面を保存する"""
+    image = Image.new("RGB", (1280, 720), background)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([100, 100, 1180, 620], fill="white")
+    draw.rectangle([120, 200, 600, 240], outline="black")
+    draw.text((130, 210), typed, fill="black")
+    image.save(path, format="JPEG", quality=quality)
+    return path
+
+
+def main():
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = lambda name: os.path.join(work_dir, f"{name}.jpg")
+        frames = [
+            screen(path("form"), "#cc6633"),
+            # 同じ画面の再エンコード（JPEG のノイズだけが違う）
+            screen(path("form_again"), "#cc6633", quality=70),
+            # 入力内容だけが違う画面
+            screen(path("form_typed"), "#cc6633", typed="abcdefghij"),
+            # グレースケールでは明るさがほぼ同じ、別の色の画面
+            screen(path("done"), "#33cc66"),
+        ]
+        frames.append(os.path.join(work_dir, "missing.jpg"))
+
+        representatives = find_duplicate_frames(frames)
+        print(f"Representatives: {representatives}")
+        check("Re-encoded frame is grouped with the original", representatives[1] == 0)
+        check("Frame with typed text is analyzed separately", representatives[2] == 2)
+        check("Frame with a different color is analyzed separately", representatives[3] == 3)
+        check("Unreadable frame is kept as its own representative", representatives[4] == 4)
+
+        # 画素値の差のしきい値は重複判定専用の設定（シーンチェンジ検出の SCENE_PIXEL_DELTA とは別）
+        loose = find_duplicate_frames(frames[:3], pixel_delta=255)
+        check("Pixel delta controls the thumbnail check", loose == [0, 0, 0], str(loose))
+
+        check("dHash is stable for the same screen", dhash(frames[0]) == dhash(frames[1]), dhash(frames[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os
+import sys
+import asyncio
+import tempfile
+import subprocess
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+from app.services import video_service
+from app.services.video_service import VideoService
+from app.services.metrics import metrics
+
+MODES = ["per_step", "batch"]
+if video_service.av is not None:
+    MODES.append("decoder")
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+def make_video(path: str, seconds: int = 5):
+    """ffmpeg の testsrc で短い合成動画を作成する"""
+    subprocess.run([
+        "ffmpeg", "-loglevel", "error",
+        "-f", "lavfi", "-i", "testsrc=size=640x360:rate=30",
+        "-t", str(seconds),
+        "-c:v", "libx264", "-preset", "ultrafast",
+        "-pix_fmt", "yuv420p",
+        "-y", path
+    ], check=True)
+
+
+async def test_past_end(video_path: str, work_dir: str):
+    """
+    動画の長さを超えたタイムスタンプは、どのモードでも image_url=None になる
+    """
+    for mode in MODES:
+        output_dir = os.path.join(work_dir, f"frames_{mode}")
+        steps = [{"timestamp": "00:01", "title": "In range"}, {"timestamp": "00:30", "title": "Past the end"}]
+        result = await VideoService().extract_frames(video_path, steps, output_dir=output_dir, mode=mode)
+        written = os.listdir(output_dir) if os.path.isdir(output_dir) else []
+        check(f"[{mode}] In-range timestamp has an image", result[0].get("image_url") is not None, str(written))
+        check(f"[{mode}] Past-end timestamp has no image", result[1].get("image_url") is None, str(result[1].get("image_url")))
+
+
+def counter(name: str) -> int:
+    return metrics.snapshot()["counters"].get(name, 0)
+
+
+async def test_concurrent_first_use(work_dir: str, calls: int = 8):
+    """
+    Phase 3 のステップごとの抽出と同じく、同じ動画の初回利用が重なっても
+    デコーダの作成は1回で、使用中のデコーダが閉じられて ffmpeg に戻ることがない
+    """
+    video_path = os.path.join(work_dir, "concurrent.mp4")
+    make_video(video_path, seconds=10)
+    output_dir = os.path.join(work_dir, "frames_concurrent")
+    builds_before, fallbacks_before = counter("decoder.builds"), counter("decoder.fallbacks")
+
+    service = VideoService()
+    results = await asyncio.gather(*(
+        service.extract_frames(video_path, [{"timestamp": f"00:0{i}", "title": f"Step {i}"}], output_dir=output_dir, start_index=i, mode="decoder")
+        for i in range(calls)
+    ))
+    extracted = sum(1 for steps in results if steps[0].get("image_url"))
+    check("Concurrent first use builds one decoder", counter("decoder.builds") - builds_before == 1, f"{counter('decoder.builds') - builds_before} builds")
+    check("Concurrent first use does not fall back to ffmpeg", counter("decoder.fallbacks") - fallbacks_before == 0, f"{counter('decoder.fallbacks') - fallbacks_before} fallbacks")
+    check("Every concurrent step has an image", extracted == calls, f"{extracted}/{calls}")
+    service.release(video_path)
+
+
+async def test_eviction_while_in_use(work_dir: str, videos: int = 4):
+    """
+    キャッシュに入りきらない数の動画を同時に抽出しても、使用中のデコーダは閉じられない
+    """
+    video_service.DECODER_CACHE_SIZE, cache_size = 1, video_service.DECODER_CACHE_SIZE
+    try:
+        paths = []
+        for i in range(videos):
+            paths.append(os.path.join(work_dir, f"evict_{i}.mp4"))
+            make_video(paths[-1], seconds=10)
+        fallbacks_before = counter("decoder.fallbacks")
+
+        service = VideoService()
+        steps = [{"timestamp": f"00:0{i}", "title": f"Step {i}"} for i in range(1, 9)]
+        results = await asyncio.gather(*(
+            service.extract_frames(path, [dict(s) for s in steps], output_dir=os.path.join(work_dir, f"frames_evict_{i}"), mode="decoder")
+            for i, path in enumerate(paths)
+        ))
+        extracted = sum(1 for result in results for step in result if step.get("image_url"))
+        check("Evicting a decoder in use does not fall back", counter("decoder.fallbacks") - fallbacks_before == 0, f"{counter('decoder.fallbacks') - fallbacks_before} fallbacks")
+        check("Every step of every video has an image", extracted == videos * len(steps), f"{extracted}/{videos * len(steps)}")
+        for path in paths:
+            service.release(path)
+    finally:
+        video_service.DECODER_CACHE_SIZE = cache_size
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as work_dir:
+        video_path = os.path.join(work_dir, "video.mp4")
+        make_video(video_path)
+        await test_past_end(video_path, work_dir)
+        if video_service.av is not None:
+            await test_concurrent_first_use(work_dir)
+            await test_eviction_while_in_use(work_dir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+import os
+import re
+import sys
+import asyncio
+from urllib.parse import unquote
+
+import httpx
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+os.environ["BUCKET_NAME"] = "fake-bucket"
+
+from app.repositories import gcs_repository
+from app.repositories.gcs_repository import AsyncGCSRepository
+
+RESPONSE_BOUNDARY = "batch_response_abc"
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+def object_name(path: str) -> str:
+    return unquote(path.split("/o/", 1)[1].split("/", 1)[0])
+
+
+class FakeBatchServer:
+    """
+    JSON API のバッチエンドポイントを実装した httpx のトランスポート
+    statuses にオブジェクト名ごとのHTTPステータスを渡す（省略時は 200）
+    レスポンスのパートは実際の GCS と同じく順不同になりうるため、逆順で返す
+    batch_status を渡すとバッチ自体がそのステータスで失敗する（エミュレータの再現）
+    """
+    def __init__(self, statuses: dict = None, batch_status: int = None, omit: set = ()):
+        self.statuses = statuses or {}
+        self.batch_status = batch_status
+        self.omit = set(omit)
+        self.batches = []  # 受け取ったバッチごとの [(content_id, method, path, body)]
+        self.singles = []  # 個別に受け取った (method, path)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path != "/batch/storage/v1":
+            self.singles.append((request.method, request.url.path))
+            return httpx.Response(self.statuses.get(object_name(request.url.path), 200), json={})
+        if self.batch_status:
+            return httpx.Response(self.batch_status)
+
+        boundary = re.search(r"boundary=([^;]+)", request.headers["content-type"]).group(1)
+        body = request.content.decode("utf-8")
+        calls = []
+        for part in body.split(f"--{boundary}")[1:]:
+            if part.startswith("--"):
+                break
+            content_id = re.search(r"Content-ID: <(\d+)>", part).group(1)
+            method, path = re.search(r"\r\n\r\n(\w+) (\S+) HTTP/1\.1", part).groups()
+            calls.append((int(content_id), method, path, part.rsplit("\r\n\r\n", 1)[1].strip()))
+        self.batches.append(calls)
+
+        parts = []
+        for content_id, method, path, _ in reversed(calls):
+            if content_id in self.omit:
+                continue
+            status = self.statuses.get(object_name(path), 200)
+            parts.append(
+                f"--{RESPONSE_BOUNDARY}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                "{}\r\n"
+            )
+        content = "".join(parts) + f"--{RESPONSE_BOUNDARY}--\r\n"
+        return httpx.Response(200, content=content.encode("utf-8"), headers={"Content-Type": f'multipart/mixed; boundary="{RESPONSE_BOUNDARY}"'})
+
+
+def make_repository(server: FakeBatchServer) -> AsyncGCSRepository:
+    http = httpx.AsyncClient(transport=httpx.MockTransport(server.handle))
+    return AsyncGCSRepository(http, credentials=None, api_base="http://fake-gcs")
+
+
+async def test_request_format():
+    """
+    各呼び出しが Content-ID 付きのパートになり、メソッド・パス・本文が入る
+    """
+    server = FakeBatchServer()
+    repository = make_repository(server)
+    names = ["images/a.jpg", "images/b c.jpg", "video.mp4"]
+    failed = await repository.make_public_batch(names)
+    check("All calls succeed", failed == [], str(failed))
+    check("One batch request is sent", len(server.batches) == 1 and not server.singles)
+    calls = server.batches[0]
+    check("Parts are numbered in call order", [c[0] for c in calls] == [0, 1, 2])
+    check("Parts carry the ACL call", all(c[1] == "POST" and c[2].endswith("/acl") for c in calls))
+    check("Object names are encoded in the path", [object_name(c[2]) for c in calls] == names, str([c[2] for c in calls]))
+    check("Parts carry the JSON body", all('"allUsers"' in c[3] for c in calls))
+
+
+async def test_partial_failure():
+    """
+    順不同のレスポンスを Content-ID で呼び出しに対応付け、失敗したパートだけを返す
+    """
+    server = FakeBatchServer(statuses={"b.jpg": 403, "d.jpg": 500})
+    failed = await make_repository(server).make_public_batch(["a.jpg", "b.jpg", "c.jpg", "d.jpg"])
+    check("Only failed parts are reported", failed == ["b.jpg", "d.jpg"], str(failed))
+
+    server = FakeBatchServer(omit={1})
+    failed = await make_repository(server).make_public_batch(["a.jpg", "b.jpg", "c.jpg"])
+    check("A part missing from the response counts as failed", failed == ["b.jpg"], str(failed))
+
+    server = FakeBatchServer(statuses={"gone.jpg": 404, "locked.jpg": 403})
+    failed = await make_repository(server).delete_files(["a.jpg", "gone.jpg", "locked.jpg"])
+    check("Deleting a missing object counts as deleted", failed == ["locked.jpg"], str(failed))
+    check("Deletes are sent as DELETE on the object", all(c[1] == "DELETE" and not c[2].endswith("/acl") for c in server.batches[0]))
+
+
+async def test_chunking():
+    """
+    1回のバッチに入れられる件数を超える呼び出しは複数のバッチに分ける
+    """
+    server = FakeBatchServer(statuses={"149.jpg": 403})
+    names = [f"{i}.jpg" for i in range(gcs_repository.MAX_BATCH_CALLS + 50)]
+    failed = await make_repository(server).delete_files(names)
+    check("Calls are split into batches of MAX_BATCH_CALLS", [len(b) for b in server.batches] == [gcs_repository.MAX_BATCH_CALLS, 50])
+    check("Content-ID restarts in each batch", [c[0] for c in server.batches[1]] == list(range(50)))
+    check("Statuses of later batches map to their calls", failed == ["149.jpg"], str(failed))
+
+
+async def test_fallback():
+    """
+    バッチが使えない場合は個別のリクエストで同じ結果になる
+    """
+    server = FakeBatchServer(statuses={"b.jpg": 403, "gone.jpg": 404}, batch_status=404)
+    repository = make_repository(server)
+    failed = await repository.make_public_batch(["a.jpg", "b.jpg"])
+    check("Failed batch falls back to individual calls", sorted(server.singles) == sorted([("POST", "/storage/v1/b/fake-bucket/o/a.jpg/acl"), ("POST", "/storage/v1/b/fake-bucket/o/b.jpg/acl")]), str(server.singles))
+    check("Individual statuses are reported", failed == ["b.jpg"], str(failed))
+
+    failed = await repository.delete_files(["a.jpg", "gone.jpg", "b.jpg"])
+    check("Individual deletes treat 404 as deleted", failed == ["b.jpg"], str(failed))
+
+    check("Empty call list sends nothing", await repository.delete_files([]) == [] and len(server.singles) == 5)
+
+
+async def main():
+    await test_request_format()
+    await test_partial_failure()
+    await test_chunking()
+    await test_fallback()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
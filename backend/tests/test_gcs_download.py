@@ -0,0 +1,136 @@
+import os
+import sys
+import base64
+import asyncio
+import tempfile
+from urllib.parse import unquote
+
+import httpx
+import google_crc32c
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+os.environ["BUCKET_NAME"] = "fake-bucket"
+
+from app.repositories import gcs_repository
+from app.repositories.gcs_repository import AsyncGCSRepository, ChecksumMismatchError
+
+BLOB = "videos/test.mp4"
+SLICE_SIZE = 256 * 1024
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+class FakeRangeServer:
+    """
+    GCS JSON API のメタデータ取得と Range 付きダウンロードだけを実装した httpx のトランスポート
+    crc32c_of を渡すと、メタデータにはその内容の CRC32C を返す（破損したダウンロードの再現）
+    """
+    def __init__(self, data: bytes, crc32c_of: bytes = None, short_slice_at: int = None):
+        self.data = data
+        self.crc32c = base64.b64encode(google_crc32c.Checksum(crc32c_of if crc32c_of is not None else data).digest()).decode()
+        self.short_slice_at = short_slice_at
+        self.ranges = []
+        self.generations = set()
+        self.active = 0
+        self.peak = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        name = unquote(request.url.path.split("/o/", 1)[1])
+        if name != BLOB:
+            return httpx.Response(404)
+        if request.url.params.get("alt") != "media":
+            return httpx.Response(200, json={"name": BLOB, "size": str(len(self.data)), "generation": "7", "crc32c": self.crc32c})
+
+        self.generations.add(request.url.params.get("generation"))
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.active -= 1
+
+        range_header = request.headers.get("Range")
+        if not range_header:
+            return httpx.Response(200, content=self.data)
+        first, last = (int(v) for v in range_header.replace("bytes=", "").split("-"))
+        self.ranges.append((first, last))
+        body = self.data[first:last + 1]
+        if first == self.short_slice_at:
+            body = body[:-1]
+        return httpx.Response(206, content=body, headers={"Content-Range": f"bytes {first}-{last}/{len(self.data)}"})
+
+
+def make_repository(server: FakeRangeServer) -> AsyncGCSRepository:
+    http = httpx.AsyncClient(transport=httpx.MockTransport(server.handle))
+    return AsyncGCSRepository(http, credentials=None, api_base="http://fake-gcs")
+
+
+async def test_sliced(work_dir: str):
+    data = os.urandom(SLICE_SIZE * 9 + 12345) # 最後のスライスは端数
+    server = FakeRangeServer(data)
+    path = os.path.join(work_dir, "sliced.mp4")
+    await make_repository(server).download_file(BLOB, path, workers=4, slice_size=SLICE_SIZE)
+
+    with open(path, "rb") as f:
+        check("Sliced download reassembles the object", f.read() == data)
+    expected = [(start, min(start + SLICE_SIZE, len(data)) - 1) for start in range(0, len(data), SLICE_SIZE)]
+    check("Every slice is requested once", sorted(server.ranges) == expected, f"{len(server.ranges)} ranges")
+    check("Slices run in parallel up to the worker limit", 1 < server.peak <= 4, f"peak {server.peak}")
+    check("Slices are pinned to the metadata generation", server.generations == {"7"}, str(server.generations))
+
+
+async def test_small_object_streams(work_dir: str):
+    data = os.urandom(SLICE_SIZE)
+    server = FakeRangeServer(data)
+    path = os.path.join(work_dir, "small.mp4")
+    await make_repository(server).download_file(BLOB, path, workers=4, slice_size=SLICE_SIZE)
+    with open(path, "rb") as f:
+        check("Small object is downloaded in one stream", f.read() == data and not server.ranges)
+
+
+async def test_checksum_mismatch(work_dir: str):
+    data = os.urandom(SLICE_SIZE * 3)
+    server = FakeRangeServer(data, crc32c_of=data[:-1] + b"\0")
+    path = os.path.join(work_dir, "mismatch.mp4")
+    try:
+        await make_repository(server).download_file(BLOB, path, workers=4, slice_size=SLICE_SIZE)
+        raised = False
+    except ChecksumMismatchError:
+        raised = True
+    check("CRC32C mismatch raises ChecksumMismatchError", raised)
+    check("CRC32C mismatch removes the download", not os.path.exists(path))
+
+
+async def test_short_slice(work_dir: str):
+    data = os.urandom(SLICE_SIZE * 3)
+    server = FakeRangeServer(data, short_slice_at=SLICE_SIZE)
+    path = os.path.join(work_dir, "short.mp4")
+    try:
+        await make_repository(server).download_file(BLOB, path, workers=4, slice_size=SLICE_SIZE)
+        error = None
+    except IOError as e:
+        error = e
+    check("Incomplete slice raises", error is not None and "Incomplete slice" in str(error), str(error))
+    check("Incomplete slice removes the download", not os.path.exists(path))
+
+
+async def main():
+    gcs_repository.SLICED_DOWNLOAD_MIN_BYTES, min_bytes = SLICE_SIZE * 2, gcs_repository.SLICED_DOWNLOAD_MIN_BYTES
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            await test_sliced(work_dir)
+            await test_small_object_streams(work_dir)
+            await test_checksum_mismatch(work_dir)
+            await test_short_slice(work_dir)
+    finally:
+        gcs_repository.SLICED_DOWNLOAD_MIN_BYTES = min_bytes
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,174 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+import httpx
+from fastapi import FastAPI
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+from app.services import job_queue
+from app.services.job_queue import JobQueue, QUEUED, RUNNING, SUCCEEDED, FAILED
+from app.worker import Worker
+from app.routers import video
+from app.api.deps import get_manual_service, get_gemini_service
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+async def wait_for(predicate, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if await predicate():
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def test_retries(path: str):
+    """
+    失敗したジョブがバックオフ後に再実行され、最大試行回数で失敗になる
+    """
+    job_queue.JOB_RETRY_BACKOFF = 0.2
+    queue = JobQueue(path, visibility_timeout=5, max_attempts=3)
+    runs = {"flaky": 0, "broken": 0}
+    failures = []
+
+    async def flaky(payload):
+        runs[payload["name"]] += 1
+        if payload["name"] == "broken" or runs["flaky"] < 2:
+            raise RuntimeError(f"{payload['name']} failed")
+
+    async def on_failure(job, retry):
+        failures.append((job["id"], retry))
+
+    await queue.enqueue("flaky", "test", {"name": "flaky"})
+    await queue.enqueue("broken", "test", {"name": "broken"})
+    check("Duplicate enqueue of active job is ignored", not await queue.enqueue("flaky", "test", {"name": "flaky"}))
+
+    worker = Worker(queue, {"test": flaky}, concurrency=2, poll_interval=0.05, on_failure=on_failure)
+    runner = asyncio.create_task(worker.run())
+    async def finished():
+        return (await queue.get("flaky"))["status"] == SUCCEEDED and (await queue.get("broken"))["status"] == FAILED
+    check("Jobs reach final state", await wait_for(finished))
+    worker.stop()
+    await runner
+
+    flaky_job, broken_job = await queue.get("flaky"), await queue.get("broken")
+    check("Flaky job succeeded on retry", flaky_job["attempts"] == 2, f"{flaky_job['attempts']} attempts")
+    check("Broken job failed after max attempts", broken_job["attempts"] == 3 and "broken failed" in broken_job["last_error"])
+    check("Failures reported with retry flag", failures.count(("broken", True)) == 2 and ("broken", False) in failures, str(failures))
+    check("Finished job can be enqueued again", await queue.enqueue("flaky", "test", {"name": "flaky"}))
+    await queue.close()
+
+
+async def test_lease_expiry(path: str):
+    """
+    lease が切れたジョブ（ワーカーが落ちた想定）を別のワーカーが取得する
+    """
+    queue = JobQueue(path, visibility_timeout=0.3, max_attempts=3)
+    await queue.enqueue("crashed", "test", {})
+    claimed = await queue.claim("dead-worker")
+    check("Job claimed", claimed is not None and claimed["status"] == RUNNING)
+    check("Running job is not claimed twice", await queue.claim("other") is None)
+    await asyncio.sleep(0.4)
+    reclaimed = await queue.claim("other")
+    check("Expired lease is reclaimed", reclaimed is not None and reclaimed["attempts"] == 2)
+    check("Old owner cannot complete the job", not await queue.complete("crashed", "dead-worker"))
+    check("New owner completes the job", await queue.complete("crashed", "other"))
+    await queue.close()
+
+
+async def test_drain(path: str):
+    """
+    停止時は実行中のジョブを待ち、drain timeout を超えたジョブは試行回数を消費せずに戻す
+    """
+    queue = JobQueue(path, visibility_timeout=5, max_attempts=3)
+    await queue.enqueue("short", "test", {"seconds": 0.3})
+    await queue.enqueue("long", "test", {"seconds": 30})
+
+    async def sleep_job(payload):
+        await asyncio.sleep(payload["seconds"])
+
+    worker = Worker(queue, {"test": sleep_job}, concurrency=2, poll_interval=0.05, drain_timeout=1.0)
+    runner = asyncio.create_task(worker.run())
+    async def both_running():
+        return (await queue.stats()).get(RUNNING) == 2
+    await wait_for(both_running)
+
+    start = time.monotonic()
+    worker.stop()
+    await runner
+    elapsed = time.monotonic() - start
+
+    short_job, long_job = await queue.get("short"), await queue.get("long")
+    check("Running job finished during drain", short_job["status"] == SUCCEEDED)
+    check("Unfinished job returned to the queue", long_job["status"] == QUEUED and long_job["attempts"] == 0, f"{long_job['status']}, {long_job['attempts']} attempts")
+    check("Drain respected the timeout", elapsed < 2.0, f"{elapsed:.2f}s")
+    await queue.close()
+
+
+class FakeManualService:
+    """ジョブのドキュメントの作成を記録する"""
+    def __init__(self):
+        self.created = []
+
+    async def create_manual_job(self, manual_id, title, video_path=None, status="analyzing_structure"):
+        self.created.append((manual_id, status))
+        return manual_id
+
+
+async def test_resubmit_active_job(path: str):
+    """
+    待機中・実行中のジョブを /analyze で再リクエストすると 409 を返し、ドキュメントを作り直さない
+    """
+    queue = JobQueue(path, visibility_timeout=5, max_attempts=3)
+    job_queue._job_queue, shared_queue = queue, job_queue._job_queue
+    video.JOB_QUEUE_ENABLED, queue_enabled = True, video.JOB_QUEUE_ENABLED
+    manual_service = FakeManualService()
+    app = FastAPI()
+    app.include_router(video.router)
+    app.dependency_overrides[get_manual_service] = lambda: manual_service
+    app.dependency_overrides[get_gemini_service] = lambda: None
+    request = {"manual_id": "resubmit", "video_url": "gs://bucket/video.mp4"}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/analyze", json=request)
+            check("New job is accepted", response.status_code == 202 and manual_service.created == [("resubmit", QUEUED)], f"{response.status_code} {manual_service.created}")
+
+            response = await client.post("/analyze", json=request)
+            check("Queued job is rejected with 409", response.status_code == 409, f"{response.status_code} {response.text}")
+            check("Queued job keeps its document", len(manual_service.created) == 1)
+
+            job = await queue.claim("worker-1")
+            response = await client.post("/analyze", json=request)
+            check("Running job is rejected with 409", response.status_code == 409, f"{response.status_code} {response.text}")
+            check("Running job keeps its document", len(manual_service.created) == 1)
+            check("Running job is left alone", (await queue.get("resubmit"))["status"] == RUNNING)
+
+            await queue.complete(job["id"], "worker-1")
+            response = await client.post("/analyze", json=request)
+            check("Finished job can be analyzed again", response.status_code == 202 and len(manual_service.created) == 2 and (await queue.get("resubmit"))["status"] == QUEUED)
+    finally:
+        job_queue._job_queue = shared_queue
+        video.JOB_QUEUE_ENABLED = queue_enabled
+        await queue.close()
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as work_dir:
+        await test_retries(os.path.join(work_dir, "retries.sqlite3"))
+        await test_lease_expiry(os.path.join(work_dir, "lease.sqlite3"))
+        await test_drain(os.path.join(work_dir, "drain.sqlite3"))
+        await test_resubmit_active_job(os.path.join(work_dir, "resubmit.sqlite3"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+from app.routers import video
+from app.api.deps import get_gemini_service, get_video_service
+from app.services.gemini_service import StepStructure, ManualStep, BoundingBox
+
+STEP_COUNT = 6
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+class FakeGeminiService:
+    """
+    後ろのステップほど解析が早く終わる Gemini の代わり（同時に解析している数の最大値を記録する）
+    """
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    async def analyze_video_structure(self, file_path):
+        return [StepStructure(timestamp=f"00:0{i}", title=f"Step {i}") for i in range(STEP_COUNT)]
+
+    def resolve_image_path(self, image_url):
+        return image_url
+
+    async def analyze_single_image(self, file_path, title, timestamp, image_url):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep((STEP_COUNT - int(timestamp[-1])) * 0.02)
+        finally:
+            self.active -= 1
+        box = BoundingBox(ymin=0, xmin=0, ymax=1, xmax=1)
+        return ManualStep(timestamp=timestamp, title=title, description=title, highlight_box=box, mask_boxes=[], image_url=image_url)
+
+
+class FakeVideoService:
+    async def extract_frames(self, video_path, steps, start_index=0):
+        for i, step in enumerate(steps):
+            step["image_url"] = f"/static/images/step_{start_index + i + 1}.jpg"
+        return steps
+
+    def release(self, video_path):
+        pass
+
+
+def stream(params: dict):
+    """
+    /process-video-stream を呼び出し、受信したイベントと Gemini の最大同時解析数を返す
+    """
+    gemini_service = FakeGeminiService()
+    app = FastAPI()
+    app.include_router(video.router)
+    app.dependency_overrides[get_gemini_service] = lambda: gemini_service
+    app.dependency_overrides[get_video_service] = FakeVideoService
+
+    with TestClient(app) as client:
+        response = client.post("/process-video-stream", params=params, files={"file": ("video.mp4", b"fake video", "video/mp4")})
+    events = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+    return events, gemini_service.peak
+
+
+def update_indexes(events: list) -> list:
+    return [e["index"] for e in events if e["type"] == "update"]
+
+
+def test_default():
+    events, peak = stream({})
+    indexes = update_indexes(events)
+    check("Default mode sends init first and complete last", events[0]["type"] == "init" and events[-1]["type"] == "complete")
+    check("Default mode sends every step", sorted(indexes) == list(range(STEP_COUNT)), str(indexes))
+    check("Default mode sends steps as they finish", indexes != sorted(indexes), str(indexes))
+    check("Default mode runs STREAM_CONCURRENCY steps at once", peak == min(video.STREAM_CONCURRENCY, STEP_COUNT), f"peak {peak}")
+    check("Default mode sends no image_ready", not any(e["type"] == "image_ready" for e in events))
+
+
+def test_ordered():
+    events, peak = stream({"ordered": "true"})
+    indexes = update_indexes(events)
+    check("Ordered mode preserves step order", indexes == list(range(STEP_COUNT)), str(indexes))
+    check("Ordered mode runs one step at a time", peak == 1, f"peak {peak}")
+
+
+def test_max_concurrency():
+    _, peak = stream({"max_concurrency": "2"})
+    check("max_concurrency limits concurrent steps", peak == 2, f"peak {peak}")
+
+
+def test_image_ready():
+    events, _ = stream({"image_ready": "true"})
+    order = [(e["type"], e.get("index")) for e in events if e["type"] in ("image_ready", "update")]
+    ready_first = all(
+        ("image_ready", index) in order and order.index(("image_ready", index)) < order.index(("update", index))
+        for index in range(STEP_COUNT)
+    )
+    check("image_ready precedes each step's update", ready_first, str(order))
+    check(
+        "image_ready carries the extracted image",
+        all(e["image_url"] == f"/static/images/step_{e['index'] + 1}.jpg" for e in events if e["type"] == "image_ready")
+    )
+
+
+if __name__ == "__main__":
+    test_default()
+    test_ordered()
+    test_max_concurrency()
+    test_image_ready()
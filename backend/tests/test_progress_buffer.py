@@ -0,0 +1,160 @@
+import os
+import sys
+import copy
+import asyncio
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+os.environ.setdefault("PROJECT_ID", "progress-buffer-test")
+
+from app.services import manual_service
+from app.services.manual_service import ManualService
+
+manual_service.PROGRESS_FLUSH_INTERVAL_MS = 0
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+class FakeFirestore:
+    """
+    書き込まれたドキュメントを、書き込んだ時点の値で保持する（subcollection 形式のステップは steps に持つ）
+    """
+    def __init__(self):
+        self.manual = {}
+        self.steps = {}
+
+    async def create_document(self, collection_name, document_id, data):
+        self.manual = copy.deepcopy(data)
+
+    async def update_document(self, collection_name, document_id, data):
+        self.manual.update(copy.deepcopy(data))
+
+    async def batch_write(self, sets=(), updates=(), deletes=()):
+        for collection_name, document_id, data in sets:
+            if collection_name.endswith("/steps"):
+                self.steps[int(document_id)] = copy.deepcopy(data)
+            else:
+                self.manual = copy.deepcopy(data)
+        for _, _, data in updates:
+            self.manual.update(copy.deepcopy(data))
+        for _, document_id in deletes:
+            self.steps.pop(int(document_id), None)
+
+    async def query_collection(self, collection_name, order_by=None):
+        return [{"id": str(index), **copy.deepcopy(self.steps[index])} for index in sorted(self.steps)]
+
+    def final_steps(self, layout: str):
+        if layout == "subcollection":
+            return [{k: v for k, v in self.steps[i].items() if k != "index"} for i in sorted(self.steps)]
+        return self.manual.get("steps")
+
+
+async def test_in_place_updates(layout: str):
+    """
+    gemini_service と同じく、init に渡したリストをその場で書き換えてから反映する
+    """
+    firestore_repository = FakeFirestore()
+    service = ManualService(firestore_repository=firestore_repository, gcs_repository=object())
+    service.steps_layout = layout
+    manual_id = f"manual-{layout}"
+
+    current_steps = [{"timestamp": f"00:0{i}", "title": f"Step {i}", "description": "", "image_url": None} for i in range(3)]
+    await service.init_manual_steps(manual_id, current_steps)
+
+    current_steps[0] = {**current_steps[0], "description": "first", "highlight_box": {"ymin": 1}}
+    await service.update_manual_steps(manual_id, list(current_steps))
+    check(f"[{layout}] Progress update writes steps changed in place", firestore_repository.final_steps(layout)[0].get("description") == "first")
+
+    current_steps[1] = {**current_steps[1], "description": "second", "highlight_box": {"ymin": 2}}
+    current_steps[2]["description"] = "third"
+    await service.complete_manual_job(manual_id, current_steps)
+    steps = firestore_repository.final_steps(layout)
+    check(
+        f"[{layout}] Final write contains every step",
+        [s.get("description") for s in steps] == ["first", "second", "third"],
+        str([s.get("description") for s in steps])
+    )
+    check(f"[{layout}] Manual is completed", firestore_repository.manual.get("status") == "completed")
+
+
+async def test_apply_job_result_after_pending_progress(layout: str):
+    """
+    解析結果の再利用（apply_job_result）も進捗バッファを通し、未反映の進捗が後から completed を上書きしない
+    """
+    manual_service.PROGRESS_FLUSH_INTERVAL_MS, interval = 100, manual_service.PROGRESS_FLUSH_INTERVAL_MS
+    try:
+        firestore_repository = FakeFirestore()
+        service = ManualService(firestore_repository=firestore_repository, gcs_repository=object())
+        service.steps_layout = layout
+        manual_id = f"manual-reuse-{layout}"
+
+        await service.update_manual_status(manual_id, "analyzing_structure")
+        await service.update_manual_status(manual_id, "extracting_images") # 間隔が空いていないので保留される
+        steps = [{"timestamp": "00:01", "title": "Reused", "description": "done", "highlight_box": {"ymin": 1}}]
+        await service.apply_job_result(manual_id, {"steps": steps, "source_manual_id": "source"})
+        await asyncio.sleep(0.2) # 保留されていた書き込みのタイマーが切れるまで待つ
+
+        check(f"[{layout}] Reused job stays completed", firestore_repository.manual.get("status") == "completed", str(firestore_repository.manual.get("status")))
+        check(f"[{layout}] Reused steps are written", firestore_repository.final_steps(layout) == steps)
+        check(f"[{layout}] Reused job's progress buffer is discarded", manual_id not in ManualService._progress_buffers)
+    finally:
+        manual_service.PROGRESS_FLUSH_INTERVAL_MS = interval
+
+
+def make_steps(count: int, label: str) -> list:
+    return [{"timestamp": f"00:0{i}", "title": f"{label} {i}", "description": label, "highlight_box": {"ymin": i}} for i in range(count)]
+
+
+async def test_rerun_with_fewer_steps(layout: str):
+    """
+    同じ manual_id を作り直して（または再試行で）前回より少ないステップになっても、前回のステップが残らない
+    """
+    firestore_repository = FakeFirestore()
+    service = ManualService(firestore_repository=firestore_repository, gcs_repository=object())
+    service.steps_layout = layout
+    manual_id = f"manual-rerun-{layout}"
+
+    # 1回目: 3ステップで完了
+    await service.create_manual_job(manual_id, "Video")
+    await service.init_manual_steps(manual_id, make_steps(3, "first"))
+    await service.complete_manual_job(manual_id, make_steps(3, "first"))
+
+    # 同じIDで再解析: 2ステップ
+    await service.create_manual_job(manual_id, "Video")
+    check(f"[{layout}] Recreated job has no steps", not firestore_repository.final_steps(layout), str(firestore_repository.final_steps(layout)))
+    await service.init_manual_steps(manual_id, make_steps(2, "second"))
+    await service.complete_manual_job(manual_id, make_steps(2, "second"))
+    steps = firestore_repository.final_steps(layout)
+    check(f"[{layout}] Re-analysis keeps only its own steps", steps == make_steps(2, "second"), str([s["title"] for s in steps]))
+
+    # 再試行: 前回の試行は3ステップ目まで書き込んで失敗し、別のプロセス（バッファなし）で再実行される
+    await service.init_manual_steps(manual_id, make_steps(3, "partial"))
+    ManualService._progress_buffers.pop(manual_id, None)
+    retry_service = ManualService(firestore_repository=firestore_repository, gcs_repository=object())
+    retry_service.steps_layout = layout
+    await retry_service.reset_manual_job(manual_id)
+    check(f"[{layout}] Retry starts without the failed attempt's steps", not firestore_repository.final_steps(layout), str(firestore_repository.final_steps(layout)))
+    await retry_service.init_manual_steps(manual_id, make_steps(1, "retry"))
+    await retry_service.complete_manual_job(manual_id, make_steps(1, "retry"))
+    steps = firestore_repository.final_steps(layout)
+    check(f"[{layout}] Retry keeps only its own steps", steps == make_steps(1, "retry"), str([s["title"] for s in steps]))
+    if layout == "subcollection":
+        check(f"[{layout}] Step count matches the retry", firestore_repository.manual.get("step_count") == 1, str(firestore_repository.manual.get("step_count")))
+
+
+async def main():
+    await test_in_place_updates("embedded")
+    await test_in_place_updates("subcollection")
+    await test_apply_job_result_after_pending_progress("embedded")
+    await test_apply_job_result_after_pending_progress("subcollection")
+    await test_rerun_with_fewer_steps("embedded")
+    await test_rerun_with_fewer_steps("subcollection")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from collections import deque
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+os.environ.setdefault("PROJECT_ID", "rate-limiter-test")
+
+from app.services import rate_limiter
+from app.services.rate_limiter import RateLimiter
+from app.services.gemini_service import GeminiService
+from app.services.call_policy import CallPolicy
+
+# 1分のクォータを WINDOW 秒に縮めてシミュレーションする
+WINDOW = 1.0
+rate_limiter.BUCKET_WINDOW_SECONDS = WINDOW
+
+
+class QuotaError(Exception):
+    def __init__(self, code: int):
+        self.code = code
+        super().__init__(f"{code} quota exceeded" if code == 429 else f"{code} overloaded")
+
+
+class FakeModels:
+    """
+    WINDOW 秒あたり quota 件を超えると 429、同時実行数が max_in_flight を超えると 503 を返すモデル
+    """
+    def __init__(self, quota: int, max_in_flight: int, latency: float):
+        self.quota = quota
+        self.max_in_flight = max_in_flight
+        self.latency = latency
+        self.accepted = deque()
+        self.completed = []
+        self.in_flight = 0
+        self.errors = {429: 0, 503: 0}
+
+    async def generate_content(self, model, contents, config):
+        now = time.monotonic()
+        while self.accepted and self.accepted[0] <= now - WINDOW:
+            self.accepted.popleft()
+        if len(self.accepted) >= self.quota:
+            self.errors[429] += 1
+            raise QuotaError(429)
+        if self.in_flight >= self.max_in_flight:
+            self.errors[503] += 1
+            raise QuotaError(503)
+        self.accepted.append(now)
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        self.completed.append(time.monotonic())
+        return type("Response", (), {"usage_metadata": type("Usage", (), {"total_token_count": 1500})()})()
+
+
+class FakeClient:
+    def __init__(self, models: FakeModels):
+        self.aio = type("Aio", (), {"models": models})()
+
+
+async def run(limiter, jobs: int, calls_per_job: int, job_concurrency: int, quota: int):
+    models = FakeModels(quota=quota, max_in_flight=quota // 2, latency=0.1)
+    # リトライは下の call() で行う（リミッターの効果だけを比べる）
+    service = GeminiService(client=FakeClient(models), rate_limiter=limiter, call_policy=CallPolicy(max_retries=0, parse_retries=0))
+    service.rate_limiter = limiter
+
+    async def call():
+        # 失敗したら少し待って再送する（一般的なクライアントの挙動）
+        while True:
+            try:
+                return await service._generate("image_detail", [], None)
+            except QuotaError:
+                await asyncio.sleep(0.05)
+
+    async def job():
+        semaphore = asyncio.Semaphore(job_concurrency)
+        async def step():
+            async with semaphore:
+                await call()
+        await asyncio.gather(*(step() for _ in range(calls_per_job)))
+
+    start = time.monotonic()
+    await asyncio.gather(*(job() for _ in range(jobs)))
+    elapsed = time.monotonic() - start
+
+    # WINDOW ごとの完了数（最後の半端な区間を除く）
+    buckets = {}
+    for t in models.completed:
+        index = int((t - start) / WINDOW)
+        buckets[index] = buckets.get(index, 0) + 1
+    full = [buckets.get(i, 0) for i in range(int(elapsed / WINDOW))]
+    return elapsed, models.errors, full
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Simulate Gemini quota pressure with and without the rate limiter")
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--calls", type=int, default=30)
+    parser.add_argument("--job-concurrency", type=int, default=4)
+    parser.add_argument("--quota", type=int, default=40, help="requests per simulated minute")
+    args = parser.parse_args()
+    total = args.jobs * args.calls
+
+    results = {}
+    for name, limiter in (
+        ("no limiter", None),
+        ("limiter", RateLimiter(rpm=args.quota, tpm=0, max_concurrency=args.quota, shared_path=None)),
+    ):
+        elapsed, errors, per_window = await run(limiter, args.jobs, args.calls, args.job_concurrency, args.quota)
+        results[name] = (elapsed, errors)
+        spread = statistics.pstdev(per_window) if per_window else 0
+        print(f"--- {name} ---")
+        print(f"Calls:        {total} in {elapsed:.2f}s ({total / elapsed * WINDOW:.1f} per window, quota {args.quota})")
+        print(f"Errors:       429 x {errors[429]}, 503 x {errors[503]}")
+        print(f"Per window:   {per_window} (stdev {spread:.1f})")
+        if limiter:
+            print(f"Limiter:      {limiter.stats()}")
+
+    limited_elapsed, limited_errors = results["limiter"]
+    if limited_errors[429] + limited_errors[503] < sum(results["no limiter"][1].values()):
+        print("PASS: Limiter reduced quota errors.")
+    else:
+        print("FAIL: Limiter did not reduce quota errors.")
+    ideal = total / args.quota * WINDOW
+    if limited_elapsed < ideal * 1.3:
+        print(f"PASS: Limited throughput is close to the quota ({limited_elapsed:.2f}s vs ideal {ideal:.2f}s).")
+    else:
+        print(f"FAIL: Limited run took {limited_elapsed:.2f}s (ideal {ideal:.2f}s).")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import base64
+import shutil
+import asyncio
+import hashlib
+import argparse
+import threading
+import subprocess
+from urllib.parse import urlparse, unquote, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import google_crc32c
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+# Config
+WORK_DIR = "/tmp/remote_frame_extraction_test"
+BUCKET = "fake-bucket"
+BLOB = "videos/test.mp4"
+
+
+class FakeGCSHandler(BaseHTTPRequestHandler):
+    """
+    GCS JSON API のうち、メタデータ取得と Range 付きダウンロードだけを実装したローカルサーバー
+    """
+    video_path = None
+    generation = 1
+    bytes_served = 0
+    requests = 0
+    metadata_requests = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        prefix = f"/b/{BUCKET}/o/"
+        if prefix not in url.path:
+            self.send_error(404)
+            return
+        name = unquote(url.path.split(prefix, 1)[1])
+        if name != BLOB:
+            self.send_error(404)
+            return
+
+        size = os.path.getsize(self.video_path)
+
+        if params.get("alt") != ["media"]:
+            with FakeGCSHandler.lock:
+                FakeGCSHandler.metadata_requests += 1
+            with open(self.video_path, "rb") as f:
+                content = f.read()
+            md5 = hashlib.md5(content).digest()
+            crc32c = google_crc32c.Checksum(content).digest()
+            body = json.dumps({
+                "bucket": BUCKET,
+                "name": BLOB,
+                "size": str(size),
+                "generation": str(FakeGCSHandler.generation),
+                "contentType": "video/mp4",
+                "md5Hash": base64.b64encode(md5).decode(),
+                "crc32c": base64.b64encode(crc32c).decode()
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if params.get("generation", [str(FakeGCSHandler.generation)]) != [str(FakeGCSHandler.generation)]:
+            # 上書きされた（古い generation の）オブジェクトは読めない
+            self.send_error(404)
+            return
+
+        status, start, end = 200, 0, size - 1
+        range_header = self.headers.get("Range")
+        if range_header:
+            first, _, last = range_header.replace("bytes=", "").partition("-")
+            status, start = 206, int(first)
+            end = min(int(last), end) if last else end
+        with open(self.video_path, "rb") as f:
+            f.seek(start)
+            body = f.read(end - start + 1)
+
+        with FakeGCSHandler.lock:
+            FakeGCSHandler.bytes_served += len(body)
+            FakeGCSHandler.requests += 1
+
+        self.send_response(status)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("x-goog-generation", str(FakeGCSHandler.generation))
+        self.send_header("Content-Length", str(len(body)))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_video(minutes: int) -> str:
+    """
+    ffmpeg の testsrc で指定長の合成動画を作成する（作成済みなら再利用）
+    画面録画に近いビットレートになるようノイズを加えて 3Mbps でエンコードする
+    """
+    path = os.path.join(WORK_DIR, f"video_{minutes}min.mp4")
+    if os.path.exists(path):
+        return path
+
+    print(f"Generating {minutes} min test video...")
+    subprocess.run([
+        "ffmpeg", "-loglevel", "error",
+        "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=30",
+        "-t", str(minutes * 60),
+        "-vf", "noise=alls=12:allf=t",
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", "250",
+        "-b:v", "3M", "-maxrate", "3M", "-bufsize", "6M",
+        "-pix_fmt", "yuv420p",
+        "-y", path
+    ], check=True)
+    return path
+
+
+def make_steps(minutes: int, step_count: int) -> list:
+    duration = minutes * 60
+    steps = []
+    for i in range(step_count):
+        seconds = int(duration * (i + 0.5) / step_count)
+        steps.append({"timestamp": f"{seconds // 60:02d}:{seconds % 60:02d}", "title": f"Step {i + 1}"})
+    return steps
+
+
+def read_frames(output_dir: str, steps: list) -> list:
+    frames = []
+    for step in steps:
+        if not step.get("image_url"):
+            frames.append(None)
+            continue
+        with open(os.path.join(output_dir, os.path.basename(step["image_url"])), "rb") as f:
+            frames.append(hashlib.sha256(f.read()).hexdigest())
+    return frames
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Byte-range frame extraction against a local fake GCS server")
+    parser.add_argument("--minutes", type=int, default=10)
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+
+    os.makedirs(WORK_DIR, exist_ok=True)
+    video_path = make_video(args.minutes)
+    video_size = os.path.getsize(video_path)
+
+    FakeGCSHandler.video_path = video_path
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGCSHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # アプリのクライアントをローカルの偽GCSに向ける
+    os.environ["STORAGE_EMULATOR_HOST"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ["BUCKET_NAME"] = BUCKET
+
+    from app.services import video_service
+    from app.services.video_service import VideoService
+
+    steps = make_steps(args.minutes, args.steps)
+    uri = f"gs://{BUCKET}/{BLOB}"
+
+    # 1. ローカルファイルから抽出（比較用）
+    local_dir = os.path.join(WORK_DIR, "local")
+    shutil.rmtree(local_dir, ignore_errors=True)
+    local_steps = await VideoService().extract_frames(video_path, [s.copy() for s in steps], output_dir=local_dir, mode="decoder")
+    VideoService().release(video_path)
+
+    # 2. 範囲読み込みで抽出
+    remote_dir = os.path.join(WORK_DIR, "remote")
+    shutil.rmtree(remote_dir, ignore_errors=True)
+    service = VideoService()
+    remote_steps = await service.extract_frames(uri, [s.copy() for s in steps], output_dir=remote_dir)
+    service.release(uri)
+    remote_bytes, remote_requests = FakeGCSHandler.bytes_served, FakeGCSHandler.requests
+
+    # 3. Phase 3 と同じく1ステップずつ抽出（メタデータの取得はデコーダ作成時の1回だけ）
+    FakeGCSHandler.metadata_requests = 0
+    per_step_dir = os.path.join(WORK_DIR, "per_step")
+    shutil.rmtree(per_step_dir, ignore_errors=True)
+    service = VideoService()
+    per_step_steps = []
+    for i, step in enumerate(steps[:-1]):
+        per_step_steps += await service.extract_frames(uri, [step.copy()], output_dir=per_step_dir, start_index=i)
+    per_step_metadata_requests = FakeGCSHandler.metadata_requests
+
+    # オブジェクトが置き換えられると固定した generation が読めなくなり、デコーダを作り直す
+    FakeGCSHandler.generation += 1
+    replaced_steps = await service.extract_frames(uri, [steps[-1].copy()], output_dir=per_step_dir, start_index=len(steps) - 1)
+    stale_decoder_dropped = uri not in video_service._decoder_cache
+    service.release(uri)
+
+    # 4. 全体ダウンロード（フォールバック）で抽出
+    FakeGCSHandler.bytes_served = FakeGCSHandler.requests = 0
+    fallback_dir = os.path.join(WORK_DIR, "fallback")
+    shutil.rmtree(fallback_dir, ignore_errors=True)
+    video_service.REMOTE_FRAME_EXTRACTION = False
+    service = VideoService()
+    fallback_steps = await service.extract_frames(uri, [s.copy() for s in steps], output_dir=fallback_dir)
+    service.release(uri)
+    fallback_bytes = FakeGCSHandler.bytes_served
+
+    server.shutdown()
+
+    print(f"--- Results ({args.minutes} min, {args.steps} steps) ---")
+    print(f"Video size:        {video_size / 1024 / 1024:.1f} MB")
+    print(f"Range reads:       {remote_bytes / 1024 / 1024:.1f} MB in {remote_requests} requests")
+    print(f"Full download:     {fallback_bytes / 1024 / 1024:.1f} MB")
+
+    expected = read_frames(local_dir, local_steps)
+    if read_frames(remote_dir, remote_steps) == expected and None not in expected:
+        print("PASS: Range-read frames match local extraction.")
+    else:
+        print("FAIL: Range-read frames differ from local extraction.")
+
+    if read_frames(fallback_dir, fallback_steps) == expected:
+        print("PASS: Full-download fallback frames match local extraction.")
+    else:
+        print("FAIL: Full-download fallback frames differ from local extraction.")
+
+    if per_step_metadata_requests == 1 and read_frames(per_step_dir, per_step_steps) == expected[:-1]:
+        print("PASS: Per-step extraction fetched metadata once and reused the cached decoder.")
+    else:
+        print(f"FAIL: Per-step extraction fetched metadata {per_step_metadata_requests} times.")
+
+    if stale_decoder_dropped and replaced_steps[0].get("image_url"):
+        print("PASS: Replaced object dropped the stale decoder and still extracted the frame.")
+    else:
+        print("FAIL: Replaced object kept the stale decoder or lost the frame.")
+
+    if remote_bytes < video_size:
+        print(f"PASS: Transferred {remote_bytes / video_size * 100:.1f}% of the video.")
+    else:
+        print("FAIL: Range reads transferred the whole video.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
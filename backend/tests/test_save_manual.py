@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import asyncio
+import tempfile
+from pathlib import Path
+from urllib.parse import unquote
+
+import httpx
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+os.environ["BUCKET_NAME"] = "fake-bucket"
+os.environ.setdefault("PROJECT_ID", "save-manual-test")
+
+from app.services import manual_service
+from app.services.manual_service import ManualService
+from app.repositories.gcs_repository import AsyncGCSRepository
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+class FakeGCS(AsyncGCSRepository):
+    """
+    バケットへの書き込みを記録する（URL の変換は AsyncGCSRepository のものを使う）
+    fail_on に含まれる名前で終わるオブジェクトへの書き込みは失敗する
+    """
+    def __init__(self, fail_on: set = (), fail_delete: bool = False):
+        super().__init__(http_client=object(), credentials=None, api_base="http://fake-gcs")
+        self.fail_on = set(fail_on)
+        self.fail_delete = fail_delete
+        self.objects = {"videos/source.mp4", "frames/a/step_0.jpg", "frames/b/step_0.jpg"}
+        self.uploads = []
+        self.copies = []
+        self.published = []
+        self.deleted = []
+
+    def _write(self, blob_name: str):
+        if any(blob_name.endswith(name) for name in self.fail_on):
+            raise RuntimeError(f"write failed: {blob_name}")
+        self.objects.add(blob_name)
+
+    async def upload_file(self, source_file_path, destination_blob_name, content_type=None, make_public=True):
+        await asyncio.sleep(0)
+        self._write(destination_blob_name)
+        self.uploads.append((source_file_path, destination_blob_name))
+        return self.public_url(destination_blob_name)
+
+    async def copy_file(self, source_blob_name, destination_blob_name, make_public=True):
+        await asyncio.sleep(0)
+        if source_blob_name not in self.objects:
+            raise FileNotFoundError(source_blob_name)
+        self._write(destination_blob_name)
+        self.copies.append((source_blob_name, destination_blob_name))
+        return self.public_url(destination_blob_name)
+
+    async def upload_structure_content(self, content, destination_blob_name, content_type="text/plain", make_public=True):
+        self._write(destination_blob_name)
+        self.saved_steps = json.loads(content)
+        self.uploads.append((None, destination_blob_name))
+        return self.public_url(destination_blob_name)
+
+    async def get_metadata(self, blob_name):
+        if blob_name not in self.objects:
+            raise FileNotFoundError(blob_name)
+        return {"size": 1}
+
+    async def make_public_batch(self, blob_names):
+        self.published.extend(blob_names)
+        return []
+
+    async def delete_files(self, blob_names):
+        if self.fail_delete:
+            raise RuntimeError("delete failed")
+        self.deleted.extend(blob_names)
+        self.objects.difference_update(blob_names)
+        return []
+
+
+class FakeFirestore:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.documents = {}
+
+    async def create_document(self, collection_name, document_id, data):
+        if self.fail:
+            raise RuntimeError("firestore unavailable")
+        self.documents[document_id] = data
+
+
+def make_service(work_dir: str, gcs: FakeGCS, firestore: FakeFirestore) -> ManualService:
+    service = ManualService(firestore_repository=firestore, gcs_repository=gcs)
+    service.app_dir = Path(work_dir)
+    return service
+
+
+def make_assets(work_dir: str):
+    """
+    /static/ 以下のローカル画像2枚と動画ファイルを作る
+    """
+    static_dir = os.path.join(work_dir, "static", "frames")
+    os.makedirs(static_dir, exist_ok=True)
+    for name in ("local_0.jpg", "local_1.jpg"):
+        with open(os.path.join(static_dir, name), "wb") as f:
+            f.write(b"jpeg")
+    video_path = os.path.join(work_dir, "video.mp4")
+    with open(video_path, "wb") as f:
+        f.write(b"mp4")
+    return video_path
+
+
+def make_steps():
+    return [
+        {"title": "local", "image_url": "/static/frames/local_0.jpg"},
+        {"title": "local", "image_url": "/static/frames/local_1.jpg"},
+        {"title": "bucket", "image_url": "http://fake-gcs/fake-bucket/frames/a/step_0.jpg"},
+    ]
+
+
+async def expect_error(coro) -> Exception:
+    try:
+        await coro
+    except Exception as e:
+        return e
+    return None
+
+
+async def test_rollback(work_dir: str):
+    """
+    保存に失敗したときは、このマニュアル用に書き込んだオブジェクトだけを削除する
+    """
+    video_path = make_assets(work_dir)
+
+    # Firestore への保存が失敗: 画像・動画・JSON をすべて削除する
+    gcs, firestore = FakeGCS(), FakeFirestore(fail=True)
+    error = await expect_error(make_service(work_dir, gcs, firestore).save_manual(make_steps(), "m1", video_path=video_path))
+    written = [dest for _, dest in gcs.uploads] + [dest for _, dest in gcs.copies]
+    check("Firestore failure is raised", isinstance(error, RuntimeError) and "firestore" in str(error), str(error))
+    check("Firestore failure deletes every written object", len(written) == 5 and sorted(gcs.deleted) == sorted(written), str(gcs.deleted))
+    check("Source objects are kept after rollback", {"videos/source.mp4", "frames/a/step_0.jpg"} <= gcs.objects)
+
+    # 画像のアップロードが失敗: 成功した分を削除し、公開も Firestore への保存もしない
+    gcs, firestore = FakeGCS(fail_on={"local_1.jpg"}), FakeFirestore()
+    error = await expect_error(make_service(work_dir, gcs, firestore).save_manual(make_steps(), "m2", video_path=video_path))
+    written = [dest for _, dest in gcs.uploads] + [dest for _, dest in gcs.copies]
+    check("Upload failure is raised", isinstance(error, RuntimeError) and "local_1.jpg" in str(error), str(error))
+    check("Upload failure deletes the completed uploads", written and sorted(gcs.deleted) == sorted(written), str(gcs.deleted))
+    check("Upload failure publishes and saves nothing", not gcs.published and not firestore.documents)
+
+    # 参照モードでは既存のオブジェクトを削除しない
+    manual_service.SAVE_ASSET_REUSE, reuse = "reference", manual_service.SAVE_ASSET_REUSE
+    try:
+        gcs, firestore = FakeGCS(), FakeFirestore(fail=True)
+        await expect_error(make_service(work_dir, gcs, firestore).save_manual(make_steps(), "m3", video_url="gs://fake-bucket/videos/source.mp4"))
+        check("Referenced objects are not rolled back", "videos/source.mp4" not in gcs.deleted and "frames/a/step_0.jpg" not in gcs.deleted and gcs.deleted, str(gcs.deleted))
+    finally:
+        manual_service.SAVE_ASSET_REUSE = reuse
+
+    # 削除が失敗しても元のエラーを返す
+    gcs, firestore = FakeGCS(fail_delete=True), FakeFirestore(fail=True)
+    error = await expect_error(make_service(work_dir, gcs, firestore).save_manual(make_steps(), "m4", video_path=video_path))
+    check("Failed rollback keeps the original error", isinstance(error, RuntimeError) and "firestore" in str(error), str(error))
+
+    # 何も書き込んでいなければ削除しない
+    gcs = FakeGCS()
+    await make_service(work_dir, gcs, FakeFirestore())._rollback_uploads([])
+    check("Empty rollback sends nothing", not gcs.deleted)
+
+
+def shared_image_steps():
+    """
+    同じ画像を使う2ステップと、別の場所にある同名の画像を使うステップ
+    """
+    return [
+        {"title": "a", "image_url": "gs://fake-bucket/frames/a/step_0.jpg"},
+        {"title": "a (merged)", "image_url": "http://fake-gcs/fake-bucket/frames/a/step_0.jpg"},
+        {"title": "b", "image_url": "http://fake-gcs/fake-bucket/frames/b/step_0.jpg"},
+        {"title": "local", "image_url": "/static/frames/local_0.jpg"},
+        {"title": "local (merged)", "image_url": "/static/frames/local_0.jpg"},
+    ]
+
+
+async def test_copy_mode(work_dir: str):
+    """
+    バケット内の画像・動画はサーバー側でコピーし、同じ画像のコピーは1回にする
+    """
+    make_assets(work_dir)
+    gcs, firestore = FakeGCS(), FakeFirestore()
+    result = await make_service(work_dir, gcs, firestore).save_manual(shared_image_steps(), "copy", video_url="gs://fake-bucket/videos/source.mp4")
+    full_id = result["id"]
+    copied = dict(gcs.copies)
+    urls = [step["image_url"] for step in gcs.saved_steps]
+
+    check("Video is copied into the manual", copied.get("videos/source.mp4") == f"manuals/{full_id}/video.mp4" and result["video_path"] == f"manuals/{full_id}/video.mp4", str(gcs.copies))
+    check("A shared image is copied once", [src for src, _ in gcs.copies].count("frames/a/step_0.jpg") == 1, str(gcs.copies))
+    check("A shared local image is uploaded once", len(gcs.uploads) == 2, str(gcs.uploads)) # 画像1枚 + JSON
+    check("Steps sharing an image share its URL", urls[0] == urls[1] and urls[3] == urls[4])
+    check("Images with the same name from different sources do not collide", copied["frames/a/step_0.jpg"] != copied["frames/b/step_0.jpg"] and urls[0] != urls[2], str(copied))
+    check("Copies stay under the manual and keep the file name", all(dest.startswith(f"manuals/{full_id}/images/") and dest.endswith("_step_0.jpg") for dest in copied.values() if dest.endswith(".jpg")))
+    check("Saved URLs point at the copies", all(gcs.blob_name_from_url(url).startswith(f"manuals/{full_id}/") for url in urls), str(urls))
+    check("Every copy is published", sorted(gcs.published) == sorted([dest for _, dest in gcs.uploads] + list(copied.values())))
+
+
+async def test_reference_mode(work_dir: str):
+    """
+    参照モードではバケット内の画像・動画をコピーせずにそのまま使う
+    """
+    make_assets(work_dir)
+    manual_service.SAVE_ASSET_REUSE, reuse = "reference", manual_service.SAVE_ASSET_REUSE
+    try:
+        gcs, firestore = FakeGCS(), FakeFirestore()
+        steps = shared_image_steps()
+        result = await make_service(work_dir, gcs, firestore).save_manual(steps, "reference", video_url="gs://fake-bucket/videos/source.mp4")
+        urls = [step["image_url"] for step in gcs.saved_steps]
+        check("Nothing is copied", not gcs.copies)
+        check("Video path references the source", result["video_path"] == "videos/source.mp4" and firestore.documents[result["id"]]["gcs_video_path"] == "videos/source.mp4")
+        check("Bucket image URLs are kept", urls[:3] == [step["image_url"] for step in steps[:3]], str(urls))
+        check("Local images are still uploaded", urls[3] == urls[4] and gcs.blob_name_from_url(urls[3]).startswith(f"manuals/{result['id']}/images/"))
+        check("Referenced objects are not published", not {"videos/source.mp4", "frames/a/step_0.jpg", "frames/b/step_0.jpg"} & set(gcs.published))
+
+        gcs = FakeGCS()
+        error = await expect_error(make_service(work_dir, gcs, FakeFirestore()).save_manual(steps, "missing", video_url="gs://fake-bucket/videos/missing.mp4"))
+        check("Missing referenced video is an error", isinstance(error, FileNotFoundError), repr(error))
+    finally:
+        manual_service.SAVE_ASSET_REUSE = reuse
+
+
+class FakeRewriteServer:
+    """
+    rewrite API を実装した httpx のトランスポート（rounds 回目の呼び出しで完了する）
+    """
+    def __init__(self, rounds: int, missing: bool = False):
+        self.rounds = rounds
+        self.missing = missing
+        self.calls = []
+        self.acl = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/acl"):
+            self.acl.append(request.url.path)
+            return httpx.Response(200, json={})
+        if self.missing:
+            return httpx.Response(404, json={})
+        self.calls.append((unquote(request.url.path), request.url.params.get("rewriteToken")))
+        if len(self.calls) < self.rounds:
+            return httpx.Response(200, json={"done": False, "rewriteToken": f"token-{len(self.calls)}"})
+        return httpx.Response(200, json={"done": True, "resource": {}})
+
+
+async def test_copy_file_rewrite():
+    """
+    大きなオブジェクトのコピーは rewriteToken を付けて完了まで繰り返す
+    """
+    server = FakeRewriteServer(rounds=3)
+    repository = AsyncGCSRepository(httpx.AsyncClient(transport=httpx.MockTransport(server.handle)), credentials=None, api_base="http://fake-gcs")
+    url = await repository.copy_file("frames/a/step 0.jpg", "manuals/m/images/x.jpg", make_public=False)
+    check("Rewrite is repeated until done", [token for _, token in server.calls] == [None, "token-1", "token-2"], str(server.calls))
+    check("Rewrite targets the destination", all(path.endswith("/o/frames/a/step 0.jpg/rewriteTo/b/fake-bucket/o/manuals/m/images/x.jpg") for path, _ in server.calls), str(server.calls))
+    check("Copy returns the destination URL", url == repository.public_url("manuals/m/images/x.jpg"), url)
+    check("make_public=False skips the ACL", not server.acl)
+
+    server = FakeRewriteServer(rounds=1)
+    repository = AsyncGCSRepository(httpx.AsyncClient(transport=httpx.MockTransport(server.handle)), credentials=None, api_base="http://fake-gcs")
+    await repository.copy_file("a.jpg", "b.jpg")
+    check("make_public=True publishes the copy", len(server.acl) == 1 and len(server.calls) == 1)
+
+    server = FakeRewriteServer(rounds=1, missing=True)
+    repository = AsyncGCSRepository(httpx.AsyncClient(transport=httpx.MockTransport(server.handle)), credentials=None, api_base="http://fake-gcs")
+    error = await expect_error(repository.copy_file("missing.jpg", "b.jpg"))
+    check("Missing source raises FileNotFoundError", isinstance(error, FileNotFoundError), repr(error))
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as work_dir:
+        await test_copy_mode(work_dir)
+        await test_reference_mode(work_dir)
+        await test_rollback(work_dir)
+    await test_copy_file_rewrite()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import base64
+import asyncio
+import hashlib
+import tempfile
+import threading
+from urllib.parse import urlparse, unquote, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import httpx
+import google_crc32c
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+# Config
+BUCKET = "fake-bucket"
+CHUNK_SIZE = 256 * 1024
+VIDEO_SIZE = 5 * CHUNK_SIZE + 1234
+
+
+class FakeGCSHandler(BaseHTTPRequestHandler):
+    """
+    GCS JSON API のうち、再開可能アップロードとメタデータ取得・削除だけを実装したローカルサーバー
+    """
+    objects = {}   # name -> bytes
+    sessions = {}  # upload_id -> {"name", "size", "data"}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", headers: dict = None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _metadata(self, name: str) -> bytes:
+        data = self.objects[name]
+        return json.dumps({
+            "bucket": BUCKET,
+            "name": name,
+            "size": str(len(data)),
+            "generation": "1",
+            "contentType": "video/mp4",
+            "md5Hash": base64.b64encode(hashlib.md5(data).digest()).decode(),
+            "crc32c": base64.b64encode(google_crc32c.Checksum(data).digest()).decode()
+        }).encode()
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if params.get("uploadType") != ["resumable"]:
+            self._send(400)
+            return
+        name = params["name"][0]
+        with self.lock:
+            if params.get("ifGenerationMatch") == ["0"] and name in self.objects:
+                self._send(412)
+                return
+            upload_id = hashlib.sha1(f"{name}{len(self.sessions)}".encode()).hexdigest()
+            self.sessions[upload_id] = {"name": name, "size": int(self.headers["X-Upload-Content-Length"]), "data": b""}
+        location = f"http://{self.headers['Host']}{url.path}?uploadType=resumable&upload_id={upload_id}"
+        self._send(200, headers={"Location": location})
+
+    def do_PUT(self):
+        params = parse_qs(urlparse(self.path).query)
+        session = self.sessions.get(params.get("upload_id", [""])[0])
+        if session is None:
+            self._send(404)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        byte_range, _, total = self.headers["Content-Range"].replace("bytes ", "").partition("/")
+        with self.lock:
+            if byte_range != "*":
+                start = int(byte_range.split("-")[0])
+                if start != len(session["data"]):
+                    self._send(400)
+                    return
+                session["data"] += body
+            if total != "*" and len(session["data"]) == int(total):
+                self.objects[session["name"]] = session["data"]
+                self._send(200, self._metadata(session["name"]), {"Content-Type": "application/json"})
+                return
+        headers = {"Range": f"bytes=0-{len(session['data']) - 1}"} if session["data"] else {}
+        self._send(308, headers=headers)
+
+    def do_GET(self):
+        name = unquote(urlparse(self.path).path.split(f"/b/{BUCKET}/o/", 1)[-1])
+        if name not in self.objects:
+            self._send(404)
+            return
+        self._send(200, self._metadata(name), {"Content-Type": "application/json"})
+
+    def do_DELETE(self):
+        name = unquote(urlparse(self.path).path.split(f"/b/{BUCKET}/o/", 1)[-1])
+        with self.lock:
+            found = self.objects.pop(name, None) is not None
+        self._send(204 if found else 404)
+
+
+class FakeFirestoreRepository:
+    """
+    ジョブの作成と取得だけを実装する
+    """
+    def __init__(self):
+        self.documents = {}
+
+    async def create_document(self, collection_path: str, document_id: str, data: dict):
+        self.documents[f"{collection_path}/{document_id}"] = data
+
+    async def get_document(self, collection_path: str, document_id: str):
+        return self.documents.get(f"{collection_path}/{document_id}")
+
+
+async def read_job(path: str, job_id: str):
+    from app.services.job_queue import JobQueue
+    queue = JobQueue(path)
+    try:
+        return await queue.get(job_id)
+    finally:
+        await queue.close()
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGCSHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_base = f"http://127.0.0.1:{server.server_port}"
+
+    # アプリのクライアントをローカルの偽GCSに向ける
+    os.environ["STORAGE_EMULATOR_HOST"] = api_base
+    os.environ["BUCKET_NAME"] = BUCKET
+    # 解析はキューに積まれるだけ（ワーカーは起動しない）
+    queue_dir = tempfile.TemporaryDirectory()
+    os.environ["JOB_QUEUE_PATH"] = os.path.join(queue_dir.name, "jobs.sqlite3")
+    os.environ["JOB_QUEUE_ENABLED"] = "1"
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.api import deps
+    from app.routers import uploads
+    from app.repositories.gcs_repository import AsyncGCSRepository
+    from app.services.manual_service import ManualService
+
+    firestore_repository = FakeFirestoreRepository()
+    app.dependency_overrides[deps.get_manual_service] = lambda: ManualService(
+        firestore_repository,
+        AsyncGCSRepository(httpx.AsyncClient(), None, api_base)
+    )
+    app.dependency_overrides[deps.get_gemini_service] = lambda: None
+
+    video = os.urandom(VIDEO_SIZE)
+
+    with TestClient(app) as client:
+        # 1. セッション発行
+        res = client.post("/api/uploads/sessions", json={"filename": "demo.mp4", "size": VIDEO_SIZE})
+        check("Session created", res.status_code == 201, res.text)
+        session = res.json()
+        manual_id, upload_url = session["manual_id"], session["upload_url"]
+
+        # 2. 途中まで直接アップロードしてから中断
+        first = 2 * CHUNK_SIZE
+        res = httpx.put(upload_url, content=video[:first], headers={"Content-Range": f"bytes 0-{first - 1}/{VIDEO_SIZE}"})
+        check("Partial chunk accepted", res.status_code == 308)
+
+        res = client.post(f"/api/uploads/sessions/{manual_id}/complete", json={"title": "Demo"})
+        check("Complete before finalize is rejected", res.status_code == 409, res.text)
+
+        # 3. 受信済みのバイト数を問い合わせて再開
+        res = httpx.put(upload_url, headers={"Content-Range": f"bytes */{VIDEO_SIZE}"})
+        received = int(res.headers["Range"].split("-")[1]) + 1
+        check("Status query reports received bytes", received == first, f"{received} bytes")
+        res = httpx.put(upload_url, content=video[received:], headers={"Content-Range": f"bytes {received}-{VIDEO_SIZE - 1}/{VIDEO_SIZE}"})
+        check("Upload resumed and finalized", res.status_code == 200)
+        check("Object matches uploaded bytes", FakeGCSHandler.objects.get(f"manuals/{manual_id}/video.mp4") == video)
+
+        # 4. 完了通知で解析を開始
+        res = client.post(f"/api/uploads/sessions/{manual_id}/complete", json={"title": "Demo"})
+        check("Completion accepted", res.status_code == 202, res.text)
+        job = asyncio.run(read_job(os.environ["JOB_QUEUE_PATH"], manual_id))
+        check("Analysis queued with gs:// URI", job is not None and job["payload"]["video_url"] == f"gs://{BUCKET}/manuals/{manual_id}/video.mp4", str(job and job["payload"]))
+        document = firestore_repository.documents.get(f"users/test-user-001/manuals/{manual_id}")
+        check("Job document created as queued", document is not None and document["status"] == "queued")
+
+        res = client.get(f"/api/jobs/{manual_id}")
+        check("Job status API reports the queue", res.status_code == 200 and res.json()["queue"]["status"] == "queued", res.text)
+
+        # 5. 入力チェック
+        res = client.post("/api/uploads/sessions", json={"filename": "demo.mp4", "size": VIDEO_SIZE, "manual_id": manual_id})
+        check("Existing video is not overwritten", res.status_code == 409, res.text)
+        res = client.post("/api/uploads/sessions", json={"filename": "big.mp4", "size": uploads.MAX_UPLOAD_BYTES + 1})
+        check("Oversize session is rejected", res.status_code == 413)
+        res = client.post("/api/uploads/sessions", json={"filename": "x.mp4", "size": 10, "manual_id": "../other"})
+        check("Unsafe manual_id is rejected", res.status_code == 400)
+
+    server.shutdown()
+    queue_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
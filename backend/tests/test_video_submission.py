@@ -0,0 +1,129 @@
+import os
+import sys
+import asyncio
+import tempfile
+
+# Add backend root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_root = os.path.dirname(current_dir)
+sys.path.append(backend_root)
+
+os.environ.setdefault("PROJECT_ID", "video-submission-test")
+
+from app.services import gemini_service
+from app.services.gemini_service import GeminiService, StepStructure
+
+MAX_INLINE = 1024
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"{'PASS' if condition else 'FAIL'}: {name}" + (f" ({detail})" if detail else ""))
+
+
+class FakeStagingRepository:
+    bucket_name = "staging-bucket"
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.uploaded = []
+        self.deleted = []
+
+    async def upload_file(self, local_path, blob_name, content_type=None, make_public=True):
+        if self.fail:
+            raise RuntimeError("upload failed")
+        self.uploaded.append(blob_name)
+
+    async def delete_file(self, blob_name):
+        self.deleted.append(blob_name)
+
+
+class FakeResponse:
+    def __init__(self, parsed):
+        self.parsed = parsed
+        self.text = ""
+
+
+def make_service(staging_repository: FakeStagingRepository, fail_generate: bool = False):
+    """
+    Gemini に渡された動画の Part を記録するサービス
+    """
+    service = GeminiService(client=object(), staging_repository=staging_repository)
+    service.parts = []
+
+    async def generate(kind, contents, config, parse):
+        service.parts.append(contents[0])
+        if fail_generate:
+            raise RuntimeError("model error")
+        return parse(FakeResponse([StepStructure(timestamp="00:01", title="Step")]))
+
+    service._generate = generate
+    return service
+
+
+def make_file(work_dir: str, name: str, size: int) -> str:
+    path = os.path.join(work_dir, name)
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return path
+
+
+async def test_inline(work_dir: str):
+    staging = FakeStagingRepository()
+    service = make_service(staging)
+    path = make_file(work_dir, "small.mp4", MAX_INLINE)
+    await service.analyze_video_structure(path)
+    part = service.parts[0]
+    with open(path, "rb") as f:
+        check("Video up to the limit is sent inline", part.inline_data is not None and part.inline_data.data == f.read())
+    check("Inline video is not staged", not staging.uploaded)
+
+
+async def test_staged(work_dir: str):
+    staging = FakeStagingRepository()
+    service = make_service(staging)
+    path = make_file(work_dir, "large.mp4", MAX_INLINE + 1)
+    steps = await service.analyze_video_structure(path)
+    part = service.parts[0]
+    check("Video over the limit is staged", len(staging.uploaded) == 1 and staging.uploaded[0].startswith(gemini_service.VIDEO_STAGING_PREFIX + "/"), str(staging.uploaded))
+    check("Staged video is sent by URI", part.file_data is not None and part.file_data.file_uri == f"gs://{staging.bucket_name}/{staging.uploaded[0]}", str(part.file_data))
+    check("Staged video is deleted after Phase 1", staging.deleted == staging.uploaded and len(steps) == 1)
+
+    staging = FakeStagingRepository()
+    service = make_service(staging, fail_generate=True)
+    await service.analyze_video_structure(path)
+    check("Staged video is deleted when Phase 1 fails", staging.deleted == staging.uploaded and len(staging.uploaded) == 1)
+
+
+async def test_staging_failure(work_dir: str):
+    staging = FakeStagingRepository(fail=True)
+    service = make_service(staging)
+    path = make_file(work_dir, "large_fallback.mp4", MAX_INLINE + 1)
+    await service.analyze_video_structure(path)
+    part = service.parts[0]
+    check("Failed staging falls back to inline", part.inline_data is not None and len(part.inline_data.data) == MAX_INLINE + 1)
+    check("Nothing is deleted after failed staging", not staging.deleted)
+
+
+async def test_gcs_uri():
+    staging = FakeStagingRepository()
+    service = make_service(staging)
+    await service.analyze_video_structure("gs://videos/upload.mp4")
+    part = service.parts[0]
+    check("gs:// video is sent by its own URI", part.file_data is not None and part.file_data.file_uri == "gs://videos/upload.mp4")
+    check("gs:// video is neither downloaded nor staged", part.inline_data is None and not staging.uploaded)
+
+
+async def main():
+    gemini_service.INLINE_VIDEO_MAX_BYTES, max_bytes = MAX_INLINE, gemini_service.INLINE_VIDEO_MAX_BYTES
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            await test_inline(work_dir)
+            await test_staged(work_dir)
+            await test_staging_failure(work_dir)
+        await test_gcs_uri()
+    finally:
+        gemini_service.INLINE_VIDEO_MAX_BYTES = max_bytes
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
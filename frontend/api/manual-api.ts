@@ -41,14 +41,17 @@ export async function toggleManualPublish(manualId: string, isPublic: boolean) {
 }
 
 // マニュアルの保存
-export async function saveManual(filename: string, steps: any[], videoFile: File | null) {
+// videoGsUrl がある場合（解析時にアップロード済み）は動画ファイルを送らず、サーバー側で再利用させる
+export async function saveManual(filename: string, steps: any[], videoFile: File | null, videoGsUrl?: string | null) {
     // Generate a cleaner manual_id from filename
     const manualId = filename.replace(/\.[^/.]+$/, "").replace(/[^a-z0-9]/gi, '_').toLowerCase();
 
     const formData = new FormData();
     formData.append("manual_id", manualId);
     formData.append("steps", JSON.stringify(steps));
-    if (videoFile) {
+    if (videoGsUrl) {
+        formData.append("video_url", videoGsUrl);
+    } else if (videoFile) {
         formData.append("video", videoFile);
     }
 
@@ -1,7 +1,7 @@
 "use client";
 
 import React, { createContext, useContext, useState, useEffect, ReactNode } from "react";
-import { doc, onSnapshot } from "firebase/firestore";
+import { collection, doc, onSnapshot, orderBy, query } from "firebase/firestore";
 import { ref, uploadBytes, uploadBytesResumable } from "firebase/storage";
 import { db, storage } from "@/lib/firebase";
 
@@ -38,6 +38,7 @@ interface VideoContextType {
   error: string | null;
   videoUrl: string | null;
   videoFile: File | null;
+  videoGsUrl: string | null; // アップロード済み動画の gs:// URL（保存時に再アップロードしない）
   manualId: string | null;
   setManualId: (id: string | null) => void;
   processVideo: (file: File) => Promise<void>;
@@ -57,7 +58,9 @@ export function VideoProvider({ children }: { children: ReactNode }) {
   const [error, setError] = useState<string | null>(null);
   const [videoUrl, setVideoUrl] = useState<string | null>(null);
   const [videoFile, setVideoFile] = useState<File | null>(null);
+  const [videoGsUrl, setVideoGsUrl] = useState<string | null>(null);
   const [manualId, setManualId] = useState<string | null>(null);
+  const [stepsLayout, setStepsLayout] = useState<string>("embedded");
 
   // Firestore Listener for Real-time Updates
   React.useEffect(() => {
@@ -72,9 +75,10 @@ export function VideoProvider({ children }: { children: ReactNode }) {
         const data = docSnap.data();
         console.log("Firestore Update:", data.status);
         setStatus(data.status); // Expose status
+        setStepsLayout(data.steps_layout || "embedded");
 
-        // Update Steps
-        if (data.steps && Array.isArray(data.steps)) {
+        // Update Steps (subcollection layout is handled by the listener below)
+        if (data.steps_layout !== "subcollection" && data.steps && Array.isArray(data.steps)) {
           setSteps(data.steps as Step[]);
         }
 
@@ -103,12 +107,36 @@ export function VideoProvider({ children }: { children: ReactNode }) {
     return () => unsubscribe();
   }, [manualId]);
 
+  // Steps stored as users/{uid}/manuals/{id}/steps/{index}
+  React.useEffect(() => {
+    if (!manualId || stepsLayout !== "subcollection") return;
+
+    const user_id = "test-user-001"; // Fixed for now
+    const stepsQuery = query(
+      collection(db, "users", user_id, "manuals", manualId, "steps"),
+      orderBy("index")
+    );
+
+    const unsubscribe = onSnapshot(stepsQuery, (snapshot) => {
+      setSteps(snapshot.docs.map((stepDoc) => {
+        const { index, ...step } = stepDoc.data();
+        return step as Step;
+      }));
+    }, (err) => {
+      console.error("Firestore Error:", err);
+      setError("Failed to sync with server.");
+    });
+
+    return () => unsubscribe();
+  }, [manualId, stepsLayout]);
+
   const processVideo = async (file: File) => {
     setIsProcessing(true);
     setError(null);
     setSteps(null);
     setFilename(file.name);
     setVideoFile(file);
+    setVideoGsUrl(null);
     // manualId set to null to clear previous listener
     setManualId(null);
 
@@ -150,6 +178,7 @@ export function VideoProvider({ children }: { children: ReactNode }) {
       const bucketName = process.env.NEXT_PUBLIC_FIREBASE_STORAGE_BUCKET;
       const gsUrl = `gs://${bucketName}/${storagePath}`;
       console.log("Uploaded. GS URL:", gsUrl);
+      setVideoGsUrl(gsUrl);
 
       setProcessingStage('analyzing'); // Upload done, API call next
 
@@ -203,6 +232,7 @@ export function VideoProvider({ children }: { children: ReactNode }) {
     setUploadProgress(0);
     setStatus("");
     setVideoFile(null);
+    setVideoGsUrl(null);
     setManualId(null);
     if (videoUrl) {
       URL.revokeObjectURL(videoUrl);
@@ -222,6 +252,7 @@ export function VideoProvider({ children }: { children: ReactNode }) {
         error,
         videoUrl,
         videoFile,
+        videoGsUrl,
         manualId,
         setManualId,
         processVideo,
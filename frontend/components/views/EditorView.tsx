@@ -14,7 +14,7 @@ import { saveManual } from "@/api/manual-api";
 import { ShareDialog } from "@/components/features/share/ShareDialog";
 
 export function EditorView() {
-    const { steps, filename, updateStep, reset, isProcessing, videoUrl, videoFile, manualId, setManualId } = useVideo();
+    const { steps, filename, updateStep, reset, isProcessing, videoUrl, videoFile, videoGsUrl, manualId, setManualId } = useVideo();
     const [viewMode, setViewMode] = useState<'edit' | 'preview'>('edit');
     const [isSaving, setIsSaving] = useState(false);
     const [isShareDialogOpen, setIsShareDialogOpen] = useState(false);
@@ -23,7 +23,7 @@ export function EditorView() {
         if (!steps || !filename) return;
         setIsSaving(true);
         try {
-            const result = await saveManual(filename, steps, videoFile);
+            const result = await saveManual(filename, steps, videoFile, videoGsUrl);
             if (result.paths && result.paths.id) {
                 setManualId(result.paths.id);
             }
@@ -29,6 +29,16 @@ fi
 BACKEND_PID=$!
 echo "[Backend] PID: $BACKEND_PID"
 
+# 解析ジョブのワーカーの起動（/api/analyze はキューに積むだけで、解析はこのプロセスが行う）
+echo "[Worker] Starting..."
+if [ -f ".venv/bin/python" ]; then
+    .venv/bin/python -m app.worker &
+else
+    python -m app.worker &
+fi
+WORKER_PID=$!
+echo "[Worker] PID: $WORKER_PID"
+
 # Frontendの起動
 echo "[Frontend] Starting..."
 cd "$PROJECT_ROOT/frontend"